@@ -0,0 +1,1529 @@
+from __future__ import division
+from time import perf_counter, process_time, sleep
+import time
+import argparse
+import asyncio
+import bisect
+import gzip
+import json
+import logging
+import os
+import queue
+import random
+import tempfile
+import re
+import socket
+import sys
+import tracemalloc
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import toml
+from fuzzywuzzy import fuzz
+from multiprocessing import Process, Queue
+from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor
+import pickle
+
+from smtp_stub import start_smtp_stub
+from fixture_server import start_fixture_server
+
+from main import ArbCrawler, Bovada, MyBookie, DriverPool, Site, SiteOdds, Game, GameMatcher, TeamRegistry, Channel, \
+    CycleUpdate, EndOfStream, OddsHistory, PageRecording, BrowserProfile, \
+    SmtpConnection, Notifier, CrawlScheduler, ParsePool, HttpFetcher, LoopQueue, HashRing, ShardAggregator, ShardNode, \
+    log_writer, process_tree_memory
+
+
+SITE_CLASSES = {
+    "Bovada": Bovada,
+    "MyBookie": MyBookie,
+}
+
+# a small gzipped corpus of each site's pages and the games parsed from them, checked by default
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+DEFAULT_CORPUS = os.path.join(FIXTURES_DIR, "pages")
+DEFAULT_GOLDEN = os.path.join(FIXTURES_DIR, "golden")
+# Bovada coupon feeds laid out under the path they are served from, for the "json" backend
+DEFAULT_FEEDS = os.path.join(FIXTURES_DIR, "feeds")
+
+
+def page_name_from_url(url):
+    """
+    Name a recorded page after its url, https://www.bovada.lv/sports/baseball/mlb becomes sports-baseball-mlb
+
+    :param url: String URL of the page
+    :return: String file name without extension
+    """
+    return re.sub('[^A-Za-z0-9]+', '-', urlsplit(url).path).strip('-') or "index"
+
+
+def game_to_golden(game):
+    """
+    JSON friendly form of a parsed Game that golden files are compared on
+
+    :param game: Game object
+    :return: dict
+    """
+    return {
+        "team_1_name": game.team_1_name,
+        "team_2_name": game.team_2_name,
+        "site_odds": [{"site": site_odds.site.name, "moneylines": list(site_odds.moneylines),
+                       "odds": list(site_odds.odds)}
+                      for site_odds in game.site_odds],
+    }
+
+
+def load_page_sources(corpus_dir):
+    """
+    Load recorded page sources laid out as <corpus_dir>/<site name>/<page>.html or <page>.html.gz
+
+    :param corpus_dir: String path of the page source corpus
+    :return: List of (String site name, String page name, String page source) tuples
+    """
+    pages = []
+    for site_name in sorted(os.listdir(corpus_dir)):
+        site_dir = os.path.join(corpus_dir, site_name)
+        if site_name not in SITE_CLASSES or not os.path.isdir(site_dir):
+            continue
+        for file_name in sorted(os.listdir(site_dir)):
+            file_path = os.path.join(site_dir, file_name)
+            if file_name.endswith(".html.gz"):
+                with gzip.open(file_path, "rt", encoding="utf-8") as f:
+                    pages.append((site_name, file_name[:-len(".html.gz")], f.read()))
+            elif file_name.endswith(".html"):
+                with open(file_path, "r", encoding="utf-8") as f:
+                    pages.append((site_name, file_name[:-len(".html")], f.read()))
+    return pages
+
+
+def time_parse(site, page_source, repeat):
+    """
+    Parse a page repeatedly and measure it
+
+    :param site: Site object to parse with
+    :param page_source: String HTML page source
+    :param repeat: int number of timed parses
+    :return: (List of Game objects, float seconds per parse, int peak bytes allocated during one parse) tuple
+    """
+    tracemalloc.start()
+    games = site.parse_page(page_source, "benchmark")
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = perf_counter()
+    for i in range(repeat):
+        site.parse_page(page_source, "benchmark")
+    seconds = (perf_counter() - start) / repeat
+
+    return games, seconds, peak_bytes
+
+
+def bench_parse(args):
+    """
+    Compare parsing the whole page tree against the scoped page_strainer parse for every page in the corpus
+    """
+    pages = load_page_sources(args.corpus)
+    if not pages:
+        print("No page sources found in {}".format(args.corpus))
+        return 1
+
+    sites = get_sites(site_name for site_name, page_name, page_source in pages)
+    mismatches = 0
+    print("{:<10} {:<30} {:>6} {:>12} {:>12} {:>12} {:>12}".format(
+        "site", "page", "games", "full ms", "scoped ms", "full KiB", "scoped KiB"))
+    for site_name, page_name, page_source in pages:
+        site = sites[site_name]
+
+        site.page_strainer = None
+        full_games, full_seconds, full_peak = time_parse(site, page_source, args.repeat)
+        del site.page_strainer
+        scoped_games, scoped_seconds, scoped_peak = time_parse(site, page_source, args.repeat)
+
+        if [repr(game) for game in full_games] != [repr(game) for game in scoped_games]:
+            mismatches += 1
+            print("MISMATCH: {}/{} parses differently when scoped".format(site_name, page_name))
+
+        print("{:<10} {:<30} {:>6} {:>12.2f} {:>12.2f} {:>12.0f} {:>12.0f}".format(
+            site_name, page_name[:30], len(scoped_games), full_seconds * 1000, scoped_seconds * 1000,
+            full_peak / 1024, scoped_peak / 1024))
+
+    return 1 if mismatches else 0
+
+
+def extracted_rows(games):
+    """
+    The rows a site's extraction script returns for a page, made from the games the HTML parser found on it
+    """
+    return json.dumps([[game.team_1_name, game.team_2_name, list(game.site_odds[0].moneylines)] for game in games])
+
+
+def cpu_per_parse(site, page_source, repeat):
+    start = process_time()
+    for i in range(repeat):
+        site.parse_page(page_source, "benchmark")
+    return (process_time() - start) / repeat
+
+
+def bench_extract(args):
+    """
+    Bytes read out of the browser and parsing CPU per page for the whole page source against the rows of the "dom"
+    backend's extraction script. With --browser every page is loaded in Firefox and both are read from it, otherwise
+    the rows are made from the HTML parser's games, which is what the script returns for the page
+    """
+    pages = load_page_sources(args.corpus)
+    if not pages:
+        print("No page sources found in {}".format(args.corpus))
+        return 1
+
+    sites = get_sites(site_name for site_name, page_name, page_source in pages)
+    driver_pool = None
+    if args.browser:
+        driver_pool = DriverPool(1, len(pages) + 1, logging.getLogger("benchmark"))
+        driver = driver_pool.idle_drivers.get()
+    mismatches = 0
+    print("{:<10} {:<30} {:>6} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}".format(
+        "site", "page", "games", "html KiB", "rows KiB", "html cpu ms", "rows cpu ms", "read html ms",
+        "extract ms"))
+    try:
+        for site_name, page_name, page_source in pages:
+            site = sites[site_name]
+            site.backend = "selenium"
+            html_games = site.parse_page(page_source, "benchmark")
+            read_seconds = extract_seconds = float("nan")
+            if driver_pool is not None:
+                with tempfile.NamedTemporaryFile("w", suffix=".html", encoding="utf-8") as page_file:
+                    page_file.write(page_source)
+                    page_file.flush()
+                    driver.get("file://" + page_file.name)
+                    start = perf_counter()
+                    page_source = driver.page_source
+                    read_seconds = perf_counter() - start
+                    start = perf_counter()
+                    rows = driver.execute_script(site.extract_script) or "null"
+                    extract_seconds = perf_counter() - start
+            else:
+                rows = extracted_rows(html_games)
+            html_cpu = cpu_per_parse(site, page_source, args.repeat)
+
+            site.backend = "dom"
+            extracted = '{{"rows": {}}}'.format(rows)
+            dom_games = site.parse_page(extracted, "benchmark")
+            rows_cpu = cpu_per_parse(site, extracted, args.repeat)
+            if Site.price_rows(dom_games or []) != Site.price_rows(html_games):
+                mismatches += 1
+                print("MISMATCH: {}/{} extracted rows differ from the HTML parser".format(site_name, page_name))
+
+            print("{:<10} {:<30} {:>6} {:>12.1f} {:>12.1f} {:>12.2f} {:>12.3f} {:>12.2f} {:>12.2f}".format(
+                site_name, page_name[:30], len(html_games), len(page_source.encode("utf-8")) / 1024,
+                len(rows.encode("utf-8")) / 1024, html_cpu * 1000, rows_cpu * 1000, read_seconds * 1000,
+                extract_seconds * 1000))
+    finally:
+        if driver_pool is not None:
+            driver_pool.idle_drivers.put(driver)
+            driver_pool.close()
+
+    return 1 if mismatches else 0
+
+
+def get_sites(site_names):
+    return {site_name: SITE_CLASSES[site_name](site_name, []) for site_name in set(site_names)}
+
+
+def bench_throughput(args):
+    """
+    Parse the whole corpus repeatedly and report pages/sec, games/sec and peak memory per site
+    """
+    pages = load_page_sources(args.corpus)
+    if not pages:
+        print("No page sources found in {}".format(args.corpus))
+        return 1
+
+    sites = get_sites(site_name for site_name, page_name, page_source in pages)
+    print("{:<10} {:>6} {:>12} {:>12} {:>12} {:>12}".format("site", "pages", "MiB", "pages/sec", "games/sec", "peak KiB"))
+    for site_name in sorted(sites):
+        site = sites[site_name]
+        site_pages = [page_source for name, page_name, page_source in pages if name == site_name]
+
+        tracemalloc.start()
+        game_count = 0
+        for page_source in site_pages:
+            game_count += len(site.parse_page(page_source, "benchmark"))
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        start = perf_counter()
+        for i in range(args.repeat):
+            for page_source in site_pages:
+                site.parse_page(page_source, "benchmark")
+        seconds = perf_counter() - start
+
+        print("{:<10} {:>6} {:>12.2f} {:>12.1f} {:>12.1f} {:>12.0f}".format(
+            site_name, len(site_pages), sum(len(page_source) for page_source in site_pages) / 2 ** 20,
+            len(site_pages) * args.repeat / seconds, game_count * args.repeat / seconds, peak_bytes / 1024))
+
+    return 0
+
+
+def check_golden(args):
+    """
+    Parse every page in the corpus and compare the games against <golden>/<site name>/<page>.json. With --update the
+    golden files are rewritten from the current parsers instead
+    """
+    pages = load_page_sources(args.corpus)
+    if not pages:
+        print("No page sources found in {}".format(args.corpus))
+        return 1
+
+    sites = get_sites(site_name for site_name, page_name, page_source in pages)
+    failures = 0
+    for site_name, page_name, page_source in pages:
+        parsed = [game_to_golden(game) for game in sites[site_name].parse_page(page_source, "golden")]
+        failures += compare_golden(parsed, args.golden, site_name, page_name, args.update)
+
+    if os.path.isdir(args.feeds):
+        failures += check_feeds(args.feeds, args.golden, args.update)
+
+    return 1 if failures else 0
+
+
+def compare_golden(parsed, golden_dir, site_name, page_name, update=False):
+    """
+    Compare parsed games against <golden_dir>/<site name>/<page>.json, or rewrite it with update
+
+    :param parsed: List of dicts from game_to_golden
+    :return: int 1 if the games differ from the golden file or it is missing, otherwise 0
+    """
+    golden_file = os.path.join(golden_dir, site_name, page_name + ".json")
+    if update:
+        os.makedirs(os.path.dirname(golden_file), exist_ok=True)
+        with open(golden_file, "w") as f:
+            json.dump(parsed, f, indent=2, sort_keys=True)
+        print("UPDATED: {} ({} games)".format(golden_file, len(parsed)))
+        return 0
+
+    if not os.path.isfile(golden_file):
+        print("MISSING: {}".format(golden_file))
+        return 1
+
+    with open(golden_file, "r") as f:
+        expected = json.load(f)
+
+    if parsed != expected:
+        print("FAILED: {}/{} parsed {} games, golden file has {}".format(site_name, page_name, len(parsed),
+                                                                        len(expected)))
+        for parsed_game, expected_game in zip(parsed, expected):
+            if parsed_game != expected_game:
+                print("    first difference: {} != {}".format(parsed_game, expected_game))
+                break
+        return 1
+
+    print("OK: {}/{} ({} games)".format(site_name, page_name, len(parsed)))
+    return 0
+
+
+def check_feeds(feeds_dir, golden_dir, update=False):
+    """
+    Serve the recorded Bovada coupon feeds from a local fixture server and read each one the way the crawler does
+    with the "json" backend, through the http fetcher from the feed url of its sports page, then compare the games
+    against <golden_dir>/Bovada/feed-<page>.json
+
+    :param feeds_dir: String directory the feeds are served from, each at the path of its feed url
+    :return: int number of feeds that failed
+    """
+    feed_dir = os.path.join(feeds_dir, Bovada.feed_path.strip("/"))
+    sport_paths = sorted(os.path.relpath(os.path.join(directory, file_name), feed_dir)[:-len(".gz")]
+                         for directory, directory_names, file_names in os.walk(feed_dir)
+                         for file_name in file_names if file_name.endswith(".gz"))
+    server, base_url = start_fixture_server(feeds_dir)
+    site = Bovada("Bovada", [], backend="json")
+    http_fetcher = HttpFetcher(1, 15, logging.getLogger("benchmark"))
+    failures = 0
+    try:
+        jobs = [(site, "{}/sports/{}".format(base_url, sport_path)) for sport_path in sport_paths]
+        for site, url, feed in http_fetcher.fetch_all(jobs):
+            page_name = "feed-" + page_name_from_url(url)
+            if feed is None:
+                failures += 1
+                print("FAILED: Bovada/{} could not be fetched from {}".format(page_name, site.fetch_url(url)))
+                continue
+            parsed = [game_to_golden(game) for game in site.parse_page(feed, url)]
+            failures += compare_golden(parsed, golden_dir, site.name, page_name, update)
+    finally:
+        http_fetcher.close()
+        server.shutdown()
+    return failures
+
+
+def check_copies(args):
+    """
+    Change a copied SiteOdds and check the original keeps its prices, then change the original and check the copy
+    keeps its prices. The same again for the site odds of a copied Game
+    """
+    site = Site("BookA", [])
+    failures = 0
+
+    def check(name, kept, expected):
+        nonlocal failures
+        state = (kept.moneylines, kept.odds, kept.url)
+        if state != expected:
+            print("FAILED: {} changed from {} to {}".format(name, expected, state))
+            failures += 1
+
+    def change(site_odds):
+        try:
+            site_odds.odds[0] = 9.0
+            print("FAILED: SiteOdds.odds can be changed in place")
+            return 1
+        except TypeError:
+            pass
+        site_odds.moneylines = (-400, 300)
+        site_odds.odds = tuple(site_odds.moneyline_to_decimal(ml) for ml in site_odds.moneylines)
+        site_odds.url = "https://changed.example"
+        return 0
+
+    moneylines = [150, -170]
+    original = SiteOdds(site, moneylines=moneylines, url="https://book.example")
+    expected = (original.moneylines, original.odds, original.url)
+    moneylines[0] = 900
+    check("SiteOdds after changing the moneylines list it was made from", original, expected)
+
+    copied = original.copy()
+    failures += change(copied)
+    check("original SiteOdds after changing its copy", original, expected)
+
+    copied = original.copy()
+    failures += change(original)
+    check("copied SiteOdds after changing the original", copied, expected)
+
+    game = Game("Team A", "Team B", SiteOdds(site, ml1=150, ml2=-170, url="https://book.example"))
+    expected = (game.site_odds[0].moneylines, game.site_odds[0].odds, game.site_odds[0].url)
+    copied_game = game.copy()
+    failures += change(copied_game.site_odds[0])
+    copied_game.site_odds.append(SiteOdds(site, ml1=100, ml2=-100))
+    check("original Game site odds after changing its copy", game.site_odds[0], expected)
+    if len(game.site_odds) != 1:
+        print("FAILED: original Game has {} site odds after adding to its copy".format(len(game.site_odds)))
+        failures += 1
+
+    copied_game = game.copy()
+    failures += change(game.site_odds[0])
+    check("copied Game site odds after changing the original", copied_game.site_odds[0], expected)
+
+    if not failures:
+        print("OK: SiteOdds and Game copies are independent of their originals")
+    return 1 if failures else 0
+
+
+def check_headless(args):
+    """
+    Check the options every pooled and baseline browser is started with ask Firefox to run headless, for the full and
+    the lean profile. Nothing is started, so this runs without Firefox
+    """
+    failures = 0
+    for lean in (False, True):
+        arguments = BrowserProfile(lean=lean).options().arguments
+        if "-headless" not in arguments:
+            print("FAILED: {} browser options are not headless, arguments {}".format("lean" if lean else "full",
+                                                                                     arguments))
+            failures += 1
+    if not failures:
+        print("OK: full and lean browsers start headless")
+    return 1 if failures else 0
+
+
+def check(args):
+    """
+    Everything that runs without a benchmark given, the golden files, the copy checks and the headless browser check
+    """
+    failures = check_golden(args)
+    failures += check_copies(args)
+    failures += check_headless(args)
+    return 1 if failures else 0
+
+
+def record_pages(args):
+    """
+    Capture the current page source of every page in a crawler config into the corpus as gzip files
+    """
+    with open(args.config, "r") as f:
+        config = toml.loads(f.read())
+
+    logger = logging.getLogger("benchmark")
+    sites = get_sites(page["site_name"] for page in config["pages"] if page["site_name"] in SITE_CLASSES)
+    jobs = [(sites[page["site_name"]], page["url"]) for page in config["pages"] if page["site_name"] in sites]
+
+    driver_pool = DriverPool(config.get("driver_pool_size", 1), config.get("driver_max_pages", 50), logger)
+    try:
+        for site, url, page_source in driver_pool.fetch_all(jobs):
+            if page_source is None:
+                print("SKIPPED: {} did not become ready".format(url))
+                continue
+            page_file = os.path.join(args.corpus, site.name, page_name_from_url(url) + ".html.gz")
+            os.makedirs(os.path.dirname(page_file), exist_ok=True)
+            with gzip.open(page_file, "wt", encoding="utf-8") as f:
+                f.write(page_source)
+            print("RECORDED: {} -> {}".format(url, page_file))
+    finally:
+        driver_pool.close()
+
+    return 0
+
+
+CITIES = ["Kansas City", "New York", "Los Angeles", "Chicago", "Boston", "Houston", "Denver", "Seattle", "Miami",
+          "Dallas", "Atlanta", "Detroit", "Phoenix", "Oakland", "Tampa Bay", "San Diego", "Cleveland", "Toronto",
+          "Minnesota", "Arizona", "Texas", "Ohio State", "Michigan State", "Penn State", "Florida State", "Oregon"]
+MASCOTS = ["Chiefs", "Yankees", "Dodgers", "Bears", "Red Sox", "Astros", "Broncos", "Mariners", "Dolphins", "Cowboys",
+           "Falcons", "Tigers", "Suns", "Athletics", "Rays", "Padres", "Guardians", "Blue Jays", "Twins", "Wildcats",
+           "Rangers", "Buckeyes", "Spartans", "Nittany Lions", "Seminoles", "Ducks", "Hawks", "Eagles", "Owls"]
+
+
+def synthetic_games(count, seed):
+    """
+    Games for the same events as listed by two books, the second spelling the names a little differently
+
+    :param count: int number of games per book
+    :param seed: int random seed
+    :return: List of Game objects, the first book's games followed by the second book's
+    """
+    rng = random.Random(seed)
+    book_a = Site("BookA", [])
+    book_b = Site("BookB", [])
+
+    def team_name():
+        return "{} {} {}".format(rng.choice(CITIES), rng.choice(MASCOTS), rng.randrange(count))
+
+    def respell(name):
+        words = name.split()
+        if rng.random() < 0.5:
+            words = words[1:]
+        return " ".join(words).upper() if rng.random() < 0.5 else " ".join(words)
+
+    events = [(team_name(), team_name()) for i in range(count)]
+    games = [Game(team_1, team_2, SiteOdds(book_a, ml1=rng.randint(100, 300), ml2=-rng.randint(100, 300)))
+             for team_1, team_2 in events]
+    games += [Game(respell(team_1), respell(team_2), SiteOdds(book_b, ml1=rng.randint(100, 300), ml2=-rng.randint(100, 300)))
+              for team_1, team_2 in events]
+    return games
+
+
+def brute_force_match(games, difference_parameter):
+    """
+    Reference matching loop, every game is scored against every collected game and merged into the best match
+    """
+    games_collected = []
+    for site_game in games:
+        best_match = None
+        best_score = None
+        for existing_game in games_collected:
+            team_1_score = fuzz.token_set_ratio(site_game.team_1_name, existing_game.team_1_name)
+            team_2_score = fuzz.token_set_ratio(site_game.team_2_name, existing_game.team_2_name)
+            if team_1_score > difference_parameter and team_2_score > difference_parameter and \
+                    (best_score is None or team_1_score + team_2_score > best_score):
+                best_match = existing_game
+                best_score = team_1_score + team_2_score
+        if best_match is None:
+            games_collected.append(site_game)
+        else:
+            best_match.site_odds = best_match.site_odds + site_game.site_odds
+    return games_collected
+
+
+def bench_match(args):
+    """
+    Time GameMatcher against the brute force loop on synthetic games and check both collect the same games. The
+    indexed matcher is timed on a cold team registry and again on the registry warmed by the first pass
+    """
+    print("{:>8} {:>12} {:>12} {:>12} {:>10}".format("games", "indexed s", "registry s", "brute s", "same"))
+    mismatches = 0
+    for count in args.counts:
+        games = synthetic_games(count, args.seed)
+        team_registry = TeamRegistry(max_entries=4 * len(games))
+        game_matcher = GameMatcher(args.difference_parameter, team_registry)
+        start = perf_counter()
+        for game in games:
+            game_matcher.merge(game)
+        indexed_seconds = perf_counter() - start
+        indexed = [repr(game) for game in game_matcher.games]
+
+        games = synthetic_games(count, args.seed)
+        game_matcher = GameMatcher(args.difference_parameter, team_registry)
+        start = perf_counter()
+        for game in games:
+            game_matcher.merge(game)
+        registry_seconds = perf_counter() - start
+
+        brute_seconds = float("nan")
+        same = "-"
+        if len(games) <= args.brute_limit:
+            games = synthetic_games(count, args.seed)
+            start = perf_counter()
+            brute = [repr(game) for game in brute_force_match(games, args.difference_parameter)]
+            brute_seconds = perf_counter() - start
+            same = "yes" if brute == indexed else "NO"
+            if brute != indexed:
+                mismatches += 1
+
+        print("{:>8} {:>12.3f} {:>12.3f} {:>12.3f} {:>10}".format(len(games), indexed_seconds, registry_seconds,
+                                                              brute_seconds, same))
+
+    return 1 if mismatches else 0
+
+
+def make_crawler(**config):
+    """
+    ArbCrawler built from throwaway config files, nothing is crawled or sent
+
+    :param config: extra config keys
+    :return: ArbCrawler
+    """
+    config = dict({"pages": [], "interval_minutes": 5}, **config)
+    email_config = {"email_server": "localhost", "email_port": 465, "email_user": "benchmark@localhost",
+                    "email_password": "", "recipients": []}
+    with tempfile.TemporaryDirectory() as config_dir:
+        config_file = os.path.join(config_dir, "config.toml")
+        email_config_file = os.path.join(config_dir, "email.toml")
+        with open(config_file, "w") as f:
+            toml.dump(config, f)
+        with open(email_config_file, "w") as f:
+            toml.dump(email_config, f)
+        return ArbCrawler(config_file, email_config_file)
+
+
+def synthetic_snapshot(count, books, seed):
+    """
+    A crawl cycle of games each priced by several books, with a few prices far enough apart to be arbitrage
+
+    :param count: int number of games
+    :param books: int number of books pricing each game
+    :param seed: int random seed
+    :return: List of Game objects
+    """
+    rng = random.Random(seed)
+    sites = [Site("Book{}".format(n), []) for n in range(books)]
+    games = []
+    for n in range(count):
+        favourite = rng.randint(130, 250)
+        game = Game("Team {}".format(2 * n), "Team {}".format(2 * n + 1))
+        for site in sites:
+            # the underdog is priced 20-40 cents short of the favourite, which keeps the books' margin
+            ml1 = favourite - 30 + rng.randint(-10, 10)
+            ml2 = -(favourite + rng.randint(-10, 10))
+            if rng.random() < 0.01:
+                ml2 = rng.randint(100, 150)
+            game.site_odds.append(SiteOdds(site, ml1=ml1, ml2=ml2))
+        games.append(game)
+    return games
+
+
+def bench_analysis(args):
+    """
+    Time the per game thread pool analysis against the numpy snapshot analysis and check they find the same arbs
+    """
+    arb_crawler = make_crawler()
+    print("{:>8} {:>6} {:>14} {:>14} {:>8} {:>6}".format("games", "books", "thread pool s", "batch s", "arbs", "same"))
+    mismatches = 0
+    for count in args.counts:
+        games = synthetic_snapshot(count, args.books, args.seed)
+        arb_queue = queue.Queue()
+        pool = ThreadPool(processes=5)
+        start = perf_counter()
+        for game in games:
+            pool.apply_async(func=arb_crawler.game_analyzer, args=(game, arb_queue, None,))
+        pool.close()
+        pool.join()
+        pool_seconds = perf_counter() - start
+        pool_arbs = sorted((game.team_1_name, game.margin, tuple(site_odds.site.name for site_odds in game.arb_site_odds))
+                           for game in list(arb_queue.queue))
+
+        games = synthetic_snapshot(count, args.books, args.seed)
+        arb_queue = queue.Queue()
+        start = perf_counter()
+        arb_crawler.analyze_snapshot(games, arb_queue)
+        batch_seconds = perf_counter() - start
+        batch_arbs = sorted((game.team_1_name, game.margin, tuple(site_odds.site.name for site_odds in game.arb_site_odds))
+                            for game in list(arb_queue.queue))
+
+        same = pool_arbs == batch_arbs
+        if not same:
+            mismatches += 1
+        print("{:>8} {:>6} {:>14.3f} {:>14.3f} {:>8} {:>6}".format(count, args.books, pool_seconds, batch_seconds,
+                                                                 len(batch_arbs), "yes" if same else "NO"))
+
+    return 1 if mismatches else 0
+
+
+class LegacySite:
+    # the Site fields that were pickled with every game before sites were sent by name
+
+    def __init__(self, name, urls):
+        self.name = name
+        self.urls = urls
+
+
+class LegacySiteOdds:
+    # SiteOdds as a plain object with a __dict__ and its own Site copy, as it was sent before
+
+    def __init__(self, site, ml1, ml2, odds1, odds2, url=None):
+        self.site = site
+        self.ml1 = ml1
+        self.ml2 = ml2
+        self.odds1 = odds1
+        self.odds2 = odds2
+        self.url = url
+
+    def copy(self):
+        return LegacySiteOdds(LegacySite(self.site.name, self.site.urls), self.ml1, self.ml2, self.odds1, self.odds2,
+                              self.url)
+
+
+class LegacyGame:
+    # Game as a plain object with a __dict__, copied before every put as it was before
+
+    def __init__(self, game):
+        self.team_1_name = game.team_1_name
+        self.team_2_name = game.team_2_name
+        self.site_odds = [LegacySiteOdds(LegacySite(site_odds.site.name, site_odds.site.urls), site_odds.ml1,
+                                         site_odds.ml2, site_odds.odds1, site_odds.odds2) for site_odds in game.site_odds]
+        self.arbitrage_opportunity = False
+        self.margin = None
+        self.wager_ratio_1 = None
+        self.wager_ratio_2 = None
+        self.arb_site_odds_1 = None
+        self.arb_site_odds_2 = None
+        self.league = None
+        self.time = None
+        self.date = None
+
+    def copy(self):
+        game = LegacyGame.__new__(LegacyGame)
+        game.__dict__.update(self.__dict__)
+        game.site_odds = [site_odds.copy() for site_odds in self.site_odds]
+        return game
+
+
+def drain_queue(message_queue, count):
+    for i in range(count):
+        message_queue.get()
+
+
+def queue_throughput(games, copy_games):
+    """
+    Put every game on a multiprocessing Queue read by another process
+
+    :param games: List of game objects
+    :param copy_games: bool copy each game before putting it, as the crawler used to
+    :return: float games per second
+    """
+    message_queue = Queue()
+    reader = Process(target=drain_queue, args=(message_queue, len(games)))
+    reader.start()
+    start = perf_counter()
+    for game in games:
+        message_queue.put(game.copy() if copy_games else game)
+    reader.join()
+    return len(games) / (perf_counter() - start)
+
+
+def memory_per_game(build, count):
+    tracemalloc.start()
+    games = build()
+    current_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del games
+    return current_bytes / count
+
+
+def bench_wire(args):
+    """
+    Memory, pickled size and multiprocessing Queue throughput of games in the old dict based form that was copied
+    before every put, and in the slotted form that is put as is with sites sent by name
+    """
+    print("{:>8} {:>6} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}".format(
+        "games", "books", "old B/game", "new B/game", "old pickle", "new pickle", "old games/s", "new games/s"))
+    for count in args.counts:
+        games = synthetic_snapshot(count, args.books, args.seed)
+        legacy_games = [LegacyGame(game) for game in games]
+
+        old_pickles = [pickle.dumps(game.copy()) for game in legacy_games]
+        new_pickles = [pickle.dumps(game) for game in games]
+        # unpickled games share nothing with the originals, so this is the memory each game takes on arrival
+        old_memory = memory_per_game(lambda: [pickle.loads(data) for data in old_pickles], count)
+        new_memory = memory_per_game(lambda: [pickle.loads(data) for data in new_pickles], count)
+        old_pickle = sum(len(data) for data in old_pickles) / count
+        new_pickle = sum(len(data) for data in new_pickles) / count
+
+        print("{:>8} {:>6} {:>12.0f} {:>12.0f} {:>12.0f} {:>12.0f} {:>12.0f} {:>12.0f}".format(
+            count, args.books, old_memory, new_memory, old_pickle, new_pickle,
+            queue_throughput(legacy_games, True), queue_throughput(games, False)))
+
+    return 0
+
+
+def drain_channel(channel):
+    while not isinstance(channel.get(), EndOfStream):
+        pass
+
+
+def channel_throughput(cycles, channel):
+    """
+    Send whole crawl cycles through a Channel read by another process until the end of stream
+
+    :param cycles: List of CycleUpdate objects
+    :param channel: Channel
+    :return: float seconds until the reader has unpacked every cycle
+    """
+    reader = Process(target=drain_channel, args=(channel,))
+    reader.start()
+    start = perf_counter()
+    for cycle_update in cycles:
+        channel.put(cycle_update)
+    channel.close("benchmark done")
+    reader.join()
+    return perf_counter() - start
+
+
+def bench_transport(args):
+    """
+    Games/sec and MB/sec from the crawler process to the game watcher, sending every game as its own Queue message
+    against one Channel message per crawl cycle, inline and through shared memory
+    """
+    print("{:>8} {:>6} {:>8} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}".format(
+        "games", "books", "cycles", "queue g/s", "queue MB/s", "inline g/s", "inline MB/s", "shm g/s", "shm MB/s"))
+    for count in args.counts:
+        games = synthetic_snapshot(count, args.books, args.seed)
+        cycles = [CycleUpdate(games, [], 0) for n in range(args.cycles)]
+        total_games = count * args.cycles
+        megabytes = sum(len(pickle.dumps(game)) for game in games) * args.cycles / 1e6
+
+        per_game = [game for cycle_update in cycles for game in cycle_update.games]
+        queue_seconds = total_games / queue_throughput(per_game, False)
+        inline_seconds = channel_throughput(cycles, Channel(args.max_messages, shared_memory_threshold=float("inf")))
+        shared_seconds = channel_throughput(cycles, Channel(args.max_messages, shared_memory_threshold=0))
+
+        print("{:>8} {:>6} {:>8} {:>12.0f} {:>12.1f} {:>12.0f} {:>12.1f} {:>12.0f} {:>12.1f}".format(
+            count, args.books, args.cycles,
+            total_games / queue_seconds, megabytes / queue_seconds,
+            total_games / inline_seconds, megabytes / inline_seconds,
+            total_games / shared_seconds, megabytes / shared_seconds))
+
+    return 0
+
+
+def bench_history(args):
+    """
+    Rows/sec appending crawl cycles to the odds history and queries/sec for one game over a time window, before and
+    after the sealed segments are compacted
+    """
+    print("{:>8} {:>6} {:>8} {:>10} {:>12} {:>14} {:>14}".format(
+        "games", "books", "cycles", "segments", "write rows/s", "scan query/s", "sorted query/s"))
+    rng = random.Random(args.seed)
+    for count in args.counts:
+        games = synthetic_snapshot(count, args.books, args.seed)
+        for game in games:
+            game.game_id = (game.team_1_name, game.team_2_name)
+
+        with tempfile.TemporaryDirectory() as history_dir:
+            odds_history = OddsHistory(history_dir, args.segment_rows, compact_segments=float("inf"))
+            rows = 0
+            start = perf_counter()
+            for cycle in range(args.cycles):
+                rows += odds_history.append(games, 300.0 * cycle)
+            write_rate = rows / (perf_counter() - start)
+            segment_count = len(odds_history.segments)
+
+            queries = [(rng.choice(games).game_id, 300.0 * rng.randint(0, args.cycles // 2),
+                        300.0 * rng.randint(args.cycles // 2, args.cycles)) for n in range(args.queries)]
+
+            def query_rate():
+                start = perf_counter()
+                for game_id, window_start, window_end in queries:
+                    odds_history.query(game_id, window_start, window_end)
+                return len(queries) / (perf_counter() - start)
+
+            scan_rate = query_rate()
+            # seal the open segment so every row is compacted
+            odds_history.roll_segment()
+            odds_history.compact([segment for segment in odds_history.segments if segment.meta['sealed']])
+            sorted_rate = query_rate()
+            odds_history.close()
+
+        print("{:>8} {:>6} {:>8} {:>10} {:>12.0f} {:>14.0f} {:>14.0f}".format(
+            count, args.books, args.cycles, segment_count, write_rate, scan_rate, sorted_rate))
+
+    return 0
+
+
+def recording_from_corpus(corpus_dir, recording_dir, cycles, interval):
+    """
+    Lay the corpus out as a PageRecording of the same pages fetched every interval seconds, half a second apart
+
+    :return: int number of pages recorded
+    """
+    page_recording = PageRecording(recording_dir)
+    pages = load_page_sources(corpus_dir)
+    for cycle in range(cycles):
+        cycle_started = cycle * interval
+        for position, (site_name, page_name, page_source) in enumerate(pages):
+            url = "https://{}/{}".format(site_name.lower(), page_name)
+            page_recording.write(cycle_started, cycle_started + position * 0.5, site_name, url, page_source)
+    return len(pages) * cycles
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float("nan")
+
+
+def bench_replay(args):
+    """
+    Replay a recording, or the corpus as a recording, through parsing, matching, analysis and the actioner and report
+    pages/sec and the latency from a game's last page to its arbitrage opportunity being actioned. With --expected the
+    opportunities found are compared against a file written by --update
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        recording_dir = args.recording
+        if recording_dir is None:
+            recording_dir = os.path.join(work_dir, "recording")
+            if not recording_from_corpus(args.corpus, recording_dir, args.cycles, args.interval):
+                print("No page sources found in {}".format(args.corpus))
+                return 1
+
+        recording = PageRecording(recording_dir)
+        cycles = list(recording.cycles())
+        pages = sorted(set((site_name, url) for cycle_started, cycle_pages in cycles
+                           for fetched_at, site_name, url, file_name in cycle_pages))
+        page_count = sum(len(cycle_pages) for cycle_started, cycle_pages in cycles) * args.repeat
+
+        arb_crawler = make_crawler(pages=[{"site_name": site_name, "url": url} for site_name, url in pages],
+                                   odds_history_dir="", analysis_mode=args.analysis_mode)
+        detections_file = os.path.join(work_dir, "detections.jsonl")
+        start = perf_counter()
+        arb_crawler.replay(recording_dir, speedup=args.speedup, repeat=args.repeat, detections_file=detections_file)
+        seconds = perf_counter() - start
+
+        detections = []
+        if os.path.isfile(detections_file):
+            with open(detections_file, "r") as f:
+                detections = [json.loads(line) for line in f]
+
+    latencies = [detection.pop("latency_seconds") for detection in detections]
+    print("{:>8} {:>8} {:>10} {:>10} {:>10} {:>14} {:>14}".format(
+        "cycles", "pages", "seconds", "pages/s", "arbs", "p50 latency ms", "p95 latency ms"))
+    print("{:>8} {:>8} {:>10.2f} {:>10.1f} {:>10} {:>14.1f} {:>14.1f}".format(
+        len(cycles) * args.repeat, page_count, seconds, page_count / seconds, len(detections),
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000))
+    print("stages: {}".format(arb_crawler.metrics.summary()))
+
+    detections.sort(key=lambda detection: json.dumps(detection, sort_keys=True))
+    if args.update:
+        with open(args.expected, "w") as f:
+            json.dump(detections, f, indent=2, sort_keys=True)
+        print("UPDATED: {} ({} arbs)".format(args.expected, len(detections)))
+    elif args.expected is not None:
+        with open(args.expected, "r") as f:
+            expected = json.load(f)
+        if detections != expected:
+            print("FAILED: found {} arbs, {} has {}".format(len(detections), args.expected, len(expected)))
+            return 1
+        print("OK: {} arbs match {}".format(len(detections), args.expected))
+
+    return 0
+
+
+def bench_notify(args):
+    """
+    Time spent on the actioner's hot path per arbitrage opportunity, emails sent and SMTP connections opened when
+    every opportunity is emailed on its own new connection, against the Notifier's digests over one kept open
+    connection with unchanged opportunities suppressed. Both send to a local SMTP stub
+    """
+    arb_crawler = make_crawler()
+    games = synthetic_snapshot(args.games, args.books, args.seed)
+    for game in games:
+        game.game_id = (game.team_1_name, game.team_2_name)
+    arb_queue = queue.Queue()
+    arb_crawler.analyze_snapshot(games, arb_queue)
+    arbs = list(arb_queue.queue)
+    if not arbs:
+        print("No arbitrage opportunities in {} synthetic games".format(args.games))
+        return 1
+
+    print("{:<10} {:>8} {:>8} {:>12} {:>14} {:>10}".format("path", "arbs", "emails", "connections", "hot path ms",
+                                                           "total s"))
+    stub = start_smtp_stub(delay_seconds=args.delay_ms / 1000)
+    port = stub.server_address[1]
+    recipients = ["benchmark@localhost"]
+    try:
+        start = perf_counter()
+        for cycle in range(args.cycles):
+            for game in arbs:
+                connection = SmtpConnection("127.0.0.1", port, "arbcrawler@localhost", "", use_ssl=False)
+                connection.send(recipients, "Subject: {}\n\n{}".format(game.team_1_name,
+                                                                       arb_crawler.game_notification_text(game)))
+                connection.close()
+        seconds = perf_counter() - start
+        print("{:<10} {:>8} {:>8} {:>12} {:>14.3f} {:>10.2f}".format(
+            "per arb", len(arbs) * args.cycles, len(stub.messages), stub.connections,
+            seconds * 1000 / (len(arbs) * args.cycles), seconds))
+
+        stub.messages.clear()
+        stub.connections = 0
+        connection = SmtpConnection("127.0.0.1", port, "arbcrawler@localhost", "", use_ssl=False)
+        notifier = Notifier(connection, recipients, arb_crawler.game_notification_text, args.window,
+                            metrics=arb_crawler.metrics)
+        start = perf_counter()
+        hot_path_seconds = 0
+        for cycle in range(args.cycles):
+            submit_start = perf_counter()
+            for game in arbs:
+                notifier.submit(game)
+            hot_path_seconds += perf_counter() - submit_start
+            # the next cycle's arbs arrive after the digest window has closed
+            sleep(args.window * 1.5)
+        notifier.close()
+        seconds = perf_counter() - start
+        print("{:<10} {:>8} {:>8} {:>12} {:>14.3f} {:>10.2f}".format(
+            "digest", len(arbs) * args.cycles, len(stub.messages), stub.connections,
+            hot_path_seconds * 1000 / (len(arbs) * args.cycles), seconds))
+    finally:
+        stub.shutdown()
+
+    return 0
+
+
+def bench_pipeline(args):
+    """
+    Crawl cycles of the corpus served from a local fixture server over the http backend, parsing in the crawler
+    against parse worker pools of each size, with the throughput and how busy each stage was over a cycle
+    """
+    pages = load_page_sources(args.corpus)
+    if not pages:
+        print("No page sources found in {}".format(args.corpus))
+        return 1
+
+    server, base_url = start_fixture_server(args.corpus)
+    print("{:>8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "workers", "pages", "pages/s", "games/s", "fetch %", "parse %", "match %"))
+    try:
+        for workers in args.workers:
+            config_pages = [{"site_name": site_name, "url": "{}/{}/{}.html".format(base_url, site_name, page_name)}
+                            for site_name, page_name, page_source in pages if site_name in SITE_CLASSES]
+            arb_crawler = make_crawler(pages=config_pages, odds_history_dir="", log_level="INFO",
+                                       site_backends={site_name: "http" for site_name in SITE_CLASSES})
+            arb_crawler.team_registry = TeamRegistry(None, arb_crawler.team_registry_size)
+            # the workers are forked before the fetcher starts its threads
+            arb_crawler.parse_pool = ParsePool(workers, args.max_pending)
+            arb_crawler.http_fetcher = HttpFetcher(args.fetchers, 15, arb_crawler.logger, arb_crawler.metrics)
+            jobs = [(site, url) for site in arb_crawler.sites for url in site.urls] * args.repeat
+
+            totals = defaultdict(float)
+            for cycle in range(args.cycles):
+                start = perf_counter()
+                arb_crawler.process_cycle(arb_crawler.http_fetcher.fetch_all(jobs), time.time())
+                totals['seconds'] += perf_counter() - start
+                counters, gauges, histograms = arb_crawler.metrics.snapshot()
+                totals['games'] += gauges['last_cycle_games']
+                for stage in ("fetch", "parse", "match"):
+                    totals[stage] += gauges['last_cycle_{}_utilization'.format(stage)]
+            arb_crawler.close_fetchers()
+            arb_crawler.close_parse_pool()
+
+            print("{:>8} {:>8} {:>10.1f} {:>10.0f} {:>10.0f} {:>10.0f} {:>10.0f}".format(
+                workers, len(jobs), len(jobs) * args.cycles / totals['seconds'], totals['games'] / totals['seconds'],
+                totals['fetch'] * 100 / args.cycles, totals['parse'] * 100 / args.cycles,
+                totals['match'] * 100 / args.cycles))
+    finally:
+        server.shutdown()
+
+    return 0
+
+
+def simulated_markets(urls, hot_share, hours, seed):
+    """
+    Price change times of each url over the simulated hours, a hot_share of the urls move about once a minute and are
+    live, the rest move about twice an hour and start tomorrow
+
+    :return: (List of (String url, Boolean hot) tuples, dict of url to sorted List of float change times)
+    """
+    rng = random.Random(seed)
+    markets = []
+    changes = {}
+    for n in range(urls):
+        url = "https://book{}/market-{}".format(n % 2, n)
+        hot = n < urls * hot_share
+        rate = 1 / 60 if hot else 1 / 1800
+        times = []
+        at = rng.expovariate(rate)
+        while at < hours * 3600:
+            times.append(at)
+            at += rng.expovariate(rate)
+        markets.append((url, hot))
+        changes[url] = times
+    return markets, changes
+
+
+def simulate_schedule(crawl_scheduler, markets, changes, hours, sites, games_per_page):
+    """
+    Run a scheduler against simulated markets without fetching anything
+
+    :return: (dict of url to int fetches, dict of url to List of float seconds from a price change to its next fetch)
+    """
+    fetches = defaultdict(int)
+    latencies = defaultdict(list)
+    seen_changes = defaultdict(int)
+    hot = dict(markets)
+    for url, is_hot in markets:
+        crawl_scheduler.add(sites[url], url, 0.0)
+    now = 0.0
+    while now < hours * 3600:
+        jobs = crawl_scheduler.due(now)
+        for site, url in jobs:
+            fetches[url] += 1
+            moved = bisect.bisect_right(changes[url], now)
+            latencies[url].extend(now - at for at in changes[url][seen_changes[url]:moved])
+            seen_changes[url] = moved
+            games = []
+            for n in range(games_per_page):
+                game = Game("{} home {}".format(url, n), "{} away {}".format(url, n),
+                            SiteOdds(site, ml1=100 + (moved + n) % 50, ml2=-120 - (moved + n) % 50))
+                # hot markets are live, the rest start tomorrow
+                game.start_time = now - 600 if hot[url] else now + 86400
+                games.append(game)
+            crawl_scheduler.observe(url, games, now)
+        crawl_scheduler.reschedule(jobs, now)
+        now = max(now + 0.001, crawl_scheduler.next_due())
+    return fetches, latencies
+
+
+def bench_schedule(args):
+    """
+    Pages fetched per minute and seconds from a price moving to its page being fetched, for markets that move every
+    minute and markets that barely move, crawling every url every interval against the adaptive schedule. Time is
+    simulated, nothing is fetched
+    """
+    markets, changes = simulated_markets(args.urls, args.hot_share, args.hours, args.seed)
+    sites = {url: Site(urlsplit(url).netloc, []) for url, hot in markets}
+    print("{:<10} {:>10} {:>12} {:>14} {:>14} {:>14} {:>14}".format(
+        "schedule", "pages/min", "hot pages/min", "hot p50 s", "hot p95 s", "cold p50 s", "cold p95 s"))
+    for schedule in ("fixed", "adaptive"):
+        crawl_scheduler = CrawlScheduler(args.min_interval, args.interval_minutes * 60, args.pages_per_minute,
+                                         adaptive=schedule == "adaptive")
+        fetches, latencies = simulate_schedule(crawl_scheduler, markets, changes, args.hours, sites,
+                                               args.games_per_page)
+        minutes = args.hours * 60
+        hot_urls = [url for url, hot in markets if hot]
+        cold_urls = [url for url, hot in markets if not hot]
+        hot_latencies = [latency for url in hot_urls for latency in latencies[url]]
+        cold_latencies = [latency for url in cold_urls for latency in latencies[url]]
+        print("{:<10} {:>10.1f} {:>12.1f} {:>14.1f} {:>14.1f} {:>14.1f} {:>14.1f}".format(
+            schedule, sum(fetches.values()) / minutes, sum(fetches[url] for url in hot_urls) / minutes,
+            percentile(hot_latencies, 0.5), percentile(hot_latencies, 0.95),
+            percentile(cold_latencies, 0.5), percentile(cold_latencies, 0.95)))
+
+    return 0
+
+
+def time_logged_cycles(corpus_dir, cycles, log_level, async_logging, log_dir, results):
+    """
+    Child process body of bench_logging, logging is configured once per process so every mode gets a fresh one
+    """
+    os.chdir(log_dir)
+    pages = load_page_sources(corpus_dir)
+    arb_crawler = make_crawler(pages=[{"site_name": site_name, "url": "https://{}/{}".format(site_name.lower(), name)}
+                                      for site_name, name, page_source in pages],
+                               odds_history_dir="", log_level=log_level, async_logging=async_logging)
+    arb_crawler.team_registry = TeamRegistry(None, arb_crawler.team_registry_size)
+    sites = {site.name: site for site in arb_crawler.sites}
+    fetched_pages = [(sites[site_name], "https://{}/{}".format(site_name.lower(), name), page_source)
+                     for site_name, name, page_source in pages]
+
+    cycle_seconds = []
+    for cycle in range(cycles):
+        start = perf_counter()
+        arb_crawler.process_cycle(fetched_pages, time.time())
+        cycle_seconds.append(perf_counter() - start)
+    start = perf_counter()
+    log_writer.stop()
+    drain_seconds = perf_counter() - start
+    log_bytes = sum(os.path.getsize(os.path.join(log_dir, name)) for name in os.listdir(log_dir))
+    results.put((cycle_seconds, drain_seconds, log_bytes))
+
+
+def bench_logging(args):
+    """
+    Time the crawler spends per cycle parsing and matching the corpus with synchronous DEBUG logging, with DEBUG
+    records formatted and written by the writer thread, and with DEBUG switched off
+    """
+    modes = [("sync DEBUG", "DEBUG", False), ("async DEBUG", "DEBUG", True), ("INFO", "INFO", False)]
+    print("{:<12} {:>8} {:>12} {:>12} {:>14} {:>10}".format(
+        "logging", "cycles", "ms/cycle", "overhead ms", "drain ms", "log KB"))
+    baseline = None
+    rows = []
+    for name, log_level, async_logging in modes:
+        results = Queue()
+        with tempfile.TemporaryDirectory() as log_dir:
+            process = Process(target=time_logged_cycles, args=(os.path.abspath(args.corpus), args.cycles, log_level,
+                                                               async_logging, log_dir, results))
+            process.start()
+            cycle_seconds, drain_seconds, log_bytes = results.get()
+            process.join()
+        # the first cycle fills the team registry, the rest are what a long running crawler sees
+        per_cycle = percentile(cycle_seconds[1:] or cycle_seconds, 0.5)
+        rows.append((name, per_cycle, drain_seconds, log_bytes))
+        if log_level == "INFO":
+            baseline = per_cycle
+
+    for name, per_cycle, drain_seconds, log_bytes in rows:
+        print("{:<12} {:>8} {:>12.2f} {:>12.2f} {:>14.2f} {:>10.1f}".format(
+            name, args.cycles, per_cycle * 1000, (per_cycle - baseline) * 1000, drain_seconds * 1000,
+            log_bytes / 1024))
+
+    return 0
+
+
+def relay_cycles(game_queue, arb_queue):
+    """
+    Game watcher stand in, sends the first game of every cycle on to the actioner as soon as the cycle arrives
+    """
+    while True:
+        cycle_update = game_queue.get()
+        if isinstance(cycle_update, EndOfStream):
+            arb_queue.close(cycle_update.reason)
+            return
+        cycle_update.games[0].timestamps['received'] = time.time()
+        arb_queue.put(cycle_update.games[0])
+
+
+def record_actioned(arb_queue, results):
+    """
+    Arbitrage actioner stand in, sends back how long each game took to reach the watcher and then the actioner
+    """
+    hops = []
+    while True:
+        game = arb_queue.get()
+        if isinstance(game, EndOfStream):
+            break
+        hops.append((game.timestamps['received'] - game.timestamps['queued'], time.time() - game.timestamps['received']))
+    results.put(hops)
+
+
+def process_handoffs(games, cycles, gap):
+    """
+    Hand cycles from this process, standing in for the crawler, to a watcher and an actioner process over Channels
+
+    :return: (List of (float cycle hop seconds, float arb hop seconds) tuples, int processes, int bytes resident)
+    """
+    game_queue = Channel(4)
+    arb_queue = Channel(1000)
+    results = Queue()
+    processes = [Process(target=relay_cycles, args=(game_queue, arb_queue)),
+                 Process(target=record_actioned, args=(arb_queue, results))]
+    for process in processes:
+        process.start()
+    memory = None
+    for n in range(cycles):
+        games[0].timestamps['queued'] = time.time()
+        game_queue.put(CycleUpdate(games))
+        sleep(gap)
+        if n == cycles // 2:
+            memory = process_tree_memory(os.getpid())
+    game_queue.close("benchmark done")
+    hops = results.get()
+    for process in processes:
+        process.join()
+    return hops, len(processes) + 1, memory
+
+
+async def async_handoffs(games, cycles, gap):
+    """
+    Hand cycles to a watcher and an actioner task over asyncio queues, the watcher passing the game on from an executor
+    thread the way the runtime's analysis does
+
+    :return: (List of (float cycle hop seconds, float arb hop seconds) tuples, int processes, int bytes resident)
+    """
+    loop = asyncio.get_running_loop()
+    cycle_queue = asyncio.Queue(4)
+    arb_queue = asyncio.Queue()
+    executor = ThreadPoolExecutor(5)
+    hops = []
+
+    async def relay():
+        arbs = LoopQueue(loop, arb_queue)
+        while True:
+            cycle_update = await cycle_queue.get()
+            if cycle_update is None:
+                await arb_queue.put(None)
+                return
+            cycle_update.games[0].timestamps['received'] = time.time()
+            await loop.run_in_executor(executor, arbs.put, cycle_update.games[0])
+
+    async def action():
+        while True:
+            game = await arb_queue.get()
+            if game is None:
+                return
+            hops.append((game.timestamps['received'] - game.timestamps['queued'],
+                         time.time() - game.timestamps['received']))
+
+    tasks = [loop.create_task(relay()), loop.create_task(action())]
+    memory = None
+    for n in range(cycles):
+        games[0].timestamps['queued'] = time.time()
+        await cycle_queue.put(CycleUpdate(games))
+        await asyncio.sleep(gap)
+        if n == cycles // 2:
+            memory = process_tree_memory(os.getpid())
+    await cycle_queue.put(None)
+    await asyncio.gather(*tasks)
+    executor.shutdown()
+    return hops, 1, memory
+
+
+def bench_runtime(args):
+    """
+    Latency of handing a crawl cycle to the game watcher and an arbitrage opportunity on to the actioner, between
+    processes over Channels and between asyncio tasks in one process, and the processes and memory each one takes
+    """
+    print("{:<10} {:>7} {:>7} {:>10} {:>14} {:>14} {:>12} {:>12} {:>10}".format(
+        "runtime", "games", "cycles", "processes", "p50 cycle ms", "p99 cycle ms", "p50 arb ms", "p99 arb ms", "RSS MB"))
+    games = synthetic_snapshot(args.games, args.books, args.seed)
+    for name in ("processes", "asyncio"):
+        if name == "processes":
+            hops, processes, memory = process_handoffs(games, args.cycles, args.gap_ms / 1000)
+        else:
+            hops, processes, memory = asyncio.run(async_handoffs(games, args.cycles, args.gap_ms / 1000))
+        cycle_hops = [cycle_hop for cycle_hop, arb_hop in hops]
+        arb_hops = [arb_hop for cycle_hop, arb_hop in hops]
+        print("{:<10} {:>7} {:>7} {:>10} {:>14.3f} {:>14.3f} {:>12.3f} {:>12.3f} {:>10.0f}".format(
+            name, args.games, args.cycles, processes, percentile(cycle_hops, 0.5) * 1000,
+            percentile(cycle_hops, 0.99) * 1000, percentile(arb_hops, 0.5) * 1000, percentile(arb_hops, 0.99) * 1000,
+            (memory or 0) / 1e6))
+
+    return 0
+
+
+def ring_movement(urls, nodes, replicas):
+    """
+    :return: (float most urls on one node over the mean, float share of the urls that move when a node joins, float
+    share that move when a node leaves) tuple
+    """
+    names = ["node-{}".format(n) for n in range(nodes)]
+    ring = HashRing(names, replicas)
+    owners = {url: ring.owner(url) for url in urls}
+    loads = defaultdict(int)
+    for owner in owners.values():
+        loads[owner] += 1
+    ring.add("node-{}".format(nodes))
+    joined = sum(1 for url in urls if ring.owner(url) != owners[url])
+    ring = HashRing(names[1:], replicas)
+    left = sum(1 for url in urls if ring.owner(url) != owners[url])
+    return max(loads.values()) * nodes / len(urls), joined / len(urls), left / len(urls)
+
+
+def ship_cycles(address, games, cycles, pages):
+    """
+    Send crawl cycles of parsed pages from a ShardNode to a ShardAggregator in this process
+
+    :return: List of float seconds from sending each cycle to the aggregator having it
+    """
+    authkey = b"benchmark"
+    aggregator = ShardAggregator(address, authkey, [], logger=logging.getLogger("benchmark"))
+    node = ShardNode(address, authkey, "benchmark")
+    per_page = max(1, len(games) // pages)
+    cycle_pages = [(games[n].site_odds[0].site.name, "https://book/page-{}".format(n), time.time(),
+                    games[n:n + per_page]) for n in range(0, len(games), per_page)]
+    hops = []
+    try:
+        for cycle in range(cycles):
+            start = perf_counter()
+            node.send_pages(cycle_pages)
+            received = aggregator.receive(5)
+            hops.append(perf_counter() - start)
+            assert len(received) == len(cycle_pages)
+    finally:
+        node.close()
+        aggregator.close()
+    return hops
+
+
+def bench_shard(args):
+    """
+    How evenly consistent hashing shares the urls out between crawler nodes and how many move when a node joins or
+    leaves, against the ideal of one in every number of nodes, then the latency of a node sending a cycle of parsed
+    pages to the aggregator over TCP on localhost and over a unix socket
+    """
+    urls = ["https://book{}/market-{}".format(n % 2, n) for n in range(args.urls)]
+    print("{:>6} {:>10} {:>14} {:>12} {:>14} {:>12}".format(
+        "nodes", "max/mean", "join moved %", "ideal %", "leave moved %", "ideal %"))
+    for nodes in args.nodes:
+        imbalance, joined, left = ring_movement(urls, nodes, args.replicas)
+        print("{:>6} {:>10.2f} {:>14.1f} {:>12.1f} {:>14.1f} {:>12.1f}".format(
+            nodes, imbalance, joined * 100, 100 / (nodes + 1), left * 100, 100 / nodes))
+
+    games = synthetic_snapshot(args.games, args.books, args.seed)
+    print()
+    print("{:<10} {:>7} {:>7} {:>14} {:>14}".format("transport", "games", "pages", "p50 cycle ms", "p99 cycle ms"))
+    with tempfile.TemporaryDirectory() as socket_dir:
+        for name, address in (("tcp", ("127.0.0.1", 0)), ("unix", os.path.join(socket_dir, "aggregator.sock"))):
+            if name == "tcp":
+                # a free port picked by binding to port 0
+                with socket.socket() as probe:
+                    probe.bind(address)
+                    address = probe.getsockname()
+            hops = ship_cycles(address, games, args.cycles, args.pages)
+            print("{:<10} {:>7} {:>7} {:>14.3f} {:>14.3f}".format(
+                name, args.games, args.pages, percentile(hops, 0.5) * 1000, percentile(hops, 0.99) * 1000))
+
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ArbCrawler benchmarks, with no benchmark given the golden files, "
+                                                 "copies and headless browser options are checked")
+    # the golden, copy and headless checks are what runs without a benchmark, against the committed fixtures
+    parser.set_defaults(func=check, corpus=DEFAULT_CORPUS, golden=DEFAULT_GOLDEN, feeds=DEFAULT_FEEDS,
+                        update=False)
+    subparsers = parser.add_subparsers(dest="benchmark")
+
+    parse_parser = subparsers.add_parser("parse", help="full tree vs scoped parse time and peak memory per page")
+    parse_parser.add_argument("corpus", nargs="?", default=DEFAULT_CORPUS,
+                              help="directory of recorded page sources, one sub directory per site")
+    parse_parser.add_argument("--repeat", type=int, default=5)
+    parse_parser.set_defaults(func=bench_parse)
+
+    extract_parser = subparsers.add_parser("extract", help="bytes and parsing CPU per page, page source vs extracted rows")
+    extract_parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    extract_parser.add_argument("--repeat", type=int, default=20)
+    extract_parser.add_argument("--browser", action="store_true", help="load the pages in Firefox and read both from it")
+    extract_parser.set_defaults(func=bench_extract)
+
+    throughput_parser = subparsers.add_parser("throughput", help="pages/sec, games/sec and peak memory per site")
+    throughput_parser.add_argument("corpus", nargs="?", default=DEFAULT_CORPUS)
+    throughput_parser.add_argument("--repeat", type=int, default=5)
+    throughput_parser.set_defaults(func=bench_throughput)
+
+    golden_parser = subparsers.add_parser("golden", help="check parsed games against the golden files")
+    golden_parser.add_argument("corpus", nargs="?", default=DEFAULT_CORPUS)
+    golden_parser.add_argument("--golden", default=DEFAULT_GOLDEN)
+    golden_parser.add_argument("--feeds", default=DEFAULT_FEEDS, help="Bovada coupon feeds read with the json backend")
+    golden_parser.add_argument("--update", action="store_true", help="rewrite the golden files from the parsers")
+    golden_parser.set_defaults(func=check_golden)
+
+    copies_parser = subparsers.add_parser("copies", help="check copied site odds and games are independent of the originals")
+    copies_parser.set_defaults(func=check_copies)
+
+    headless_parser = subparsers.add_parser("headless", help="check the browsers are started headless")
+    headless_parser.set_defaults(func=check_headless)
+
+    match_parser = subparsers.add_parser("match", help="indexed vs brute force cross-site game matching")
+    match_parser.add_argument("--counts", type=int, nargs="+", default=[100, 1000, 5000])
+    match_parser.add_argument("--brute-limit", type=int, default=2000,
+                              help="largest number of games to also run the brute force loop on")
+    match_parser.add_argument("--difference-parameter", type=int, default=50)
+    match_parser.add_argument("--seed", type=int, default=1)
+    match_parser.set_defaults(func=bench_match)
+
+    analysis_parser = subparsers.add_parser("analysis", help="per game thread pool vs numpy snapshot analysis")
+    analysis_parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000, 100000])
+    analysis_parser.add_argument("--books", type=int, default=4)
+    analysis_parser.add_argument("--seed", type=int, default=1)
+    analysis_parser.set_defaults(func=bench_analysis)
+
+    wire_parser = subparsers.add_parser("wire", help="memory, pickled size and queue throughput per game")
+    wire_parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000])
+    wire_parser.add_argument("--books", type=int, default=4)
+    wire_parser.add_argument("--seed", type=int, default=1)
+    wire_parser.set_defaults(func=bench_wire)
+
+    transport_parser = subparsers.add_parser("transport", help="per game queue vs batched channel games/sec and MB/sec")
+    transport_parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000])
+    transport_parser.add_argument("--books", type=int, default=4)
+    transport_parser.add_argument("--cycles", type=int, default=10)
+    transport_parser.add_argument("--max-messages", type=int, default=4, help="channel bound, the sender blocks past it")
+    transport_parser.add_argument("--seed", type=int, default=1)
+    transport_parser.set_defaults(func=bench_transport)
+
+    history_parser = subparsers.add_parser("history", help="odds history write rows/sec and range queries/sec")
+    history_parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000])
+    history_parser.add_argument("--books", type=int, default=4)
+    history_parser.add_argument("--cycles", type=int, default=100)
+    history_parser.add_argument("--segment-rows", type=int, default=200000)
+    history_parser.add_argument("--queries", type=int, default=200)
+    history_parser.add_argument("--seed", type=int, default=1)
+    history_parser.set_defaults(func=bench_history)
+
+    replay_parser = subparsers.add_parser("replay", help="end to end pages/sec and latency replaying recorded pages")
+    replay_parser.add_argument("recording", nargs="?", help="PageRecording directory, the corpus is used without one")
+    replay_parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    replay_parser.add_argument("--cycles", type=int, default=10, help="crawl cycles to make from the corpus")
+    replay_parser.add_argument("--interval", type=float, default=300, help="seconds between corpus cycles")
+    replay_parser.add_argument("--repeat", type=int, default=1, help="times to play the recording")
+    replay_parser.add_argument("--speedup", type=float, help="times faster than recorded, as fast as possible if unset")
+    replay_parser.add_argument("--analysis-mode", choices=["per_game", "batch"], default="per_game")
+    replay_parser.add_argument("--expected", help="JSON file of the arbs the replay should find")
+    replay_parser.add_argument("--update", action="store_true", help="rewrite the expected file from this replay")
+    replay_parser.set_defaults(func=bench_replay)
+
+    notify_parser = subparsers.add_parser("notify", help="per arb emails vs pooled digests against a local SMTP stub")
+    notify_parser.add_argument("--games", type=int, default=2000)
+    notify_parser.add_argument("--books", type=int, default=4)
+    notify_parser.add_argument("--cycles", type=int, default=3, help="cycles the same arbs are found in")
+    notify_parser.add_argument("--window", type=float, default=0.5, help="digest window in seconds")
+    notify_parser.add_argument("--delay-ms", type=float, default=20, help="time the stub takes to accept a message")
+    notify_parser.add_argument("--seed", type=int, default=1)
+    notify_parser.set_defaults(func=bench_notify)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="crawl cycle throughput and stage utilization per parse pool")
+    pipeline_parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    pipeline_parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4], help="0 parses in the crawler")
+    pipeline_parser.add_argument("--fetchers", type=int, default=8)
+    pipeline_parser.add_argument("--max-pending", type=int, default=8)
+    pipeline_parser.add_argument("--repeat", type=int, default=5, help="times each corpus page is fetched per cycle")
+    pipeline_parser.add_argument("--cycles", type=int, default=5)
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    schedule_parser = subparsers.add_parser("schedule", help="fixed vs adaptive crawl schedule over simulated markets")
+    schedule_parser.add_argument("--urls", type=int, default=40)
+    schedule_parser.add_argument("--hot-share", type=float, default=0.2, help="share of urls whose prices move")
+    schedule_parser.add_argument("--hours", type=float, default=6)
+    schedule_parser.add_argument("--interval-minutes", type=float, default=5)
+    schedule_parser.add_argument("--min-interval", type=float, default=30)
+    schedule_parser.add_argument("--pages-per-minute", type=int, default=20, help="per site, 0 for no limit")
+    schedule_parser.add_argument("--games-per-page", type=int, default=10)
+    schedule_parser.add_argument("--seed", type=int, default=1)
+    schedule_parser.set_defaults(func=bench_schedule)
+
+    logging_parser = subparsers.add_parser("logging", help="per cycle logging overhead, sync vs async vs DEBUG off")
+    logging_parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    logging_parser.add_argument("--cycles", type=int, default=20)
+    logging_parser.set_defaults(func=bench_logging)
+
+    runtime_parser = subparsers.add_parser("runtime", help="cycle and arb handoff latency, processes vs asyncio tasks")
+    runtime_parser.add_argument("--games", type=int, default=500)
+    runtime_parser.add_argument("--books", type=int, default=4)
+    runtime_parser.add_argument("--cycles", type=int, default=100)
+    runtime_parser.add_argument("--gap-ms", type=float, default=50, help="time between cycles")
+    runtime_parser.add_argument("--seed", type=int, default=1)
+    runtime_parser.set_defaults(func=bench_runtime)
+
+    shard_parser = subparsers.add_parser("shard", help="url balance and movement over crawler nodes, cycle send latency")
+    shard_parser.add_argument("--urls", type=int, default=2000)
+    shard_parser.add_argument("--nodes", type=int, nargs="+", default=[2, 4, 8, 16])
+    shard_parser.add_argument("--replicas", type=int, default=100)
+    shard_parser.add_argument("--games", type=int, default=500)
+    shard_parser.add_argument("--books", type=int, default=4)
+    shard_parser.add_argument("--pages", type=int, default=20, help="pages the games of a cycle are spread over")
+    shard_parser.add_argument("--cycles", type=int, default=100)
+    shard_parser.add_argument("--seed", type=int, default=1)
+    shard_parser.set_defaults(func=bench_shard)
+
+    record_parser = subparsers.add_parser("record", help="capture the pages of a crawler config into the corpus")
+    record_parser.add_argument("config", help="crawler config toml")
+    record_parser.add_argument("corpus", nargs="?", default=DEFAULT_CORPUS)
+    record_parser.set_defaults(func=record_pages)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
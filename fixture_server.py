@@ -0,0 +1,83 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+import gzip
+import os
+import sys
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves recorded page sources and feeds from the server's fixture directory. The request path, without the query
+    string, is looked up under the directory. A file stored as <path>.gz is served gzip encoded as-is to clients that
+    accept it, and decompressed for clients that do not.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].lstrip("/")
+        file_path = os.path.normpath(os.path.join(self.server.fixture_dir, path))
+        if not file_path.startswith(os.path.abspath(self.server.fixture_dir)):
+            self.send_error(403)
+            return
+
+        body = None
+        encoded = False
+        if os.path.isfile(file_path + ".gz"):
+            with open(file_path + ".gz", "rb") as f:
+                body = f.read()
+            encoded = True
+        elif os.path.isfile(file_path):
+            with open(file_path, "rb") as f:
+                body = f.read()
+
+        if body is None:
+            self.send_error(404)
+            return
+
+        if encoded and "gzip" not in self.headers.get("Accept-Encoding", ""):
+            body = gzip.decompress(body)
+            encoded = False
+
+        self.send_response(200)
+        if file_path.endswith(".json"):
+            self.send_header("Content-Type", "application/json")
+        else:
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+        if encoded:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server(fixture_dir, port=0):
+    """
+    Start serving a fixture directory on localhost in a background thread
+
+    :param fixture_dir: String path of the directory with recorded responses
+    :param port: int port to listen on, 0 picks a free port
+    :return: (ThreadingHTTPServer, String base url) tuple, call shutdown() on the server to stop it
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureRequestHandler)
+    server.fixture_dir = os.path.abspath(fixture_dir)
+    server.thread = Thread(target=server.serve_forever, daemon=True)
+    server.thread.start()
+
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Please supply a fixture directory and optionally a port")
+        sys.exit()
+
+    server, base_url = start_fixture_server(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 8000)
+    print("Serving {} at {}".format(sys.argv[1], base_url))
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.shutdown()
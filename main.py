@@ -1,36 +1,664 @@
 from __future__ import division
-from multiprocessing import Process, Queue
+from multiprocessing import Process, Queue, Array
 from multiprocessing.pool import ThreadPool
 from multiprocessing import Event
+from multiprocessing import shared_memory, resource_tracker
 from time import sleep
+import time
 import sys
 import toml
+import numpy as np
 from selenium import webdriver
 from selenium.webdriver.firefox.options import Options
+from selenium.common.exceptions import WebDriverException, TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions
 import re
-from bs4 import BeautifulSoup
+import json
+import gzip
+import itertools
+from urllib.parse import urlsplit, urlunsplit
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
 import signal
-from fuzzywuzzy import fuzz
+from fuzzywuzzy import fuzz, utils as fuzz_utils
+from collections import defaultdict, OrderedDict, Counter, deque
+import os
 import smtplib
 import traceback
 import logging
+import queue
+import heapq
+import bisect
+import cProfile
+import shutil
+import tempfile
+import hashlib
+import socket
+import zipfile
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing.util
+from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 logging.basicConfig(filename='connections.log', level=logging.DEBUG)
 
 
-def setup_logger(name, log_file, formatter, level=logging.DEBUG):
+class QueueingHandler(logging.Handler):
+    """
+    Stands in for a logger's file handlers when logging is asynchronous. Records are handed to the process's
+    LogWriter as they are, the message is only formatted from its args by the writer thread, so callers pass
+    immutable args or format what may change before the record is written
+    """
+
+    def __init__(self, log_writer, handlers):
+        logging.Handler.__init__(self)
+        self.log_writer = log_writer
+        self.handlers = handlers
+
+    def emit(self, record):
+        self.log_writer.put(self, record)
+
+    def dispatch(self, record, unflushed):
+        """
+        Write a record to the file handlers without flushing them
+
+        :param record: logging.LogRecord
+        :param unflushed: set of the handlers written to since they were last flushed
+        """
+        for handler in self.handlers:
+            if record.levelno < handler.level or not handler.filter(record):
+                continue
+            if not isinstance(handler, logging.StreamHandler) or handler.stream is None:
+                handler.handle(record)
+                continue
+            message = handler.format(record)
+            handler.acquire()
+            try:
+                handler.stream.write(message + handler.terminator)
+            finally:
+                handler.release()
+            unflushed.add(handler)
+
+
+class LogWriter:
+    """
+    One queue and one writer thread per process that format and write the records of every asynchronous logger. The
+    thread is started by the first record a process logs, a forked child starts its own and drops the records the
+    parent had queued, and the queue is drained when the process exits
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.level = logging.DEBUG
+        self.lock = threading.Lock()
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+    def attach(self, logger):
+        """
+        Move the file handlers of a logger behind a QueueingHandler
+
+        :param logger: logging.Logger
+        """
+        queueing_handler = None
+        for handler in list(logger.handlers):
+            if isinstance(handler, QueueingHandler):
+                queueing_handler = handler
+        file_handlers = [handler for handler in logger.handlers if handler is not queueing_handler]
+        if not file_handlers:
+            return
+        if queueing_handler is None:
+            queueing_handler = QueueingHandler(self, [])
+            logger.addHandler(queueing_handler)
+        for handler in file_handlers:
+            logger.removeHandler(handler)
+            queueing_handler.handlers.append(handler)
+
+    def put(self, queueing_handler, record):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.write, name="LogWriter", daemon=True)
+                    self.thread.start()
+                    # runs at exit in the main process and in multiprocessing children, which skip atexit
+                    multiprocessing.util.Finalize(self, self.stop, exitpriority=-10)
+        self.queue.put((queueing_handler, record))
+
+    def write(self):
+        # the files are flushed whenever the queue runs dry rather than after every record
+        unflushed = set()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            queueing_handler, record = item
+            try:
+                queueing_handler.dispatch(record, unflushed)
+            except Exception:
+                queueing_handler.handleError(record)
+            if self.queue.empty():
+                for handler in unflushed:
+                    handler.flush()
+                unflushed.clear()
+        for handler in unflushed:
+            handler.flush()
+
+    def stop(self, timeout=10):
+        """
+        Write out the queued records and stop the writer thread
+
+        :param timeout: float seconds to wait for the queue to drain
+        """
+        thread = self.thread
+        if thread is None:
+            return
+        self.queue.put(None)
+        thread.join(timeout)
+        self.thread = None
+
+
+log_writer = LogWriter()
+
+
+def configure_logging(level=logging.DEBUG, async_logging=False):
+    """
+    Set the level of the root logger and of every logger set up after this, and with async_logging move their file
+    handlers onto the process's log writer
+
+    :param level: int or String logging level
+    :param async_logging: Boolean, format and write records on a writer thread instead of the logging thread
+    """
+    log_writer.level = logging.getLevelName(level) if isinstance(level, str) else level
+    log_writer.enabled = async_logging
+    root_logger = logging.getLogger()
+    root_logger.setLevel(log_writer.level)
+    if async_logging:
+        log_writer.attach(root_logger)
+
+
+def setup_logger(name, log_file, formatter, level=None):
     handler = logging.FileHandler(log_file)
     handler.setFormatter(formatter)
 
     logger = logging.getLogger(name)
-    logger.setLevel(level)
+    logger.setLevel(log_writer.level if level is None else level)
 
     logger.addHandler(handler)
+    if log_writer.enabled:
+        log_writer.attach(logger)
 
     return logger
 
 
 
+class Metrics:
+    """
+    Counters and latency histograms shared by the crawler, game watcher and actioner processes. Every value lives in
+    one shared memory array made before the processes start, so each process adds to the same totals and the metrics
+    endpoint in the main process can read them all. Histograms use fixed bucket bounds in seconds, like Prometheus
+    """
+
+    # game_id_collisions counts the games of a cycle sharing their game_id with an earlier game of the cycle
+    counters = ('pages_fetched', 'pages_failed', 'pages_deferred', 'games_parsed', 'games_matched', 'games_analyzed',
+                'arbs_found', 'notifications_sent', 'notifications_failed', 'notifications_suppressed',
+                'game_id_collisions')
+    # the stage timings of the most recent crawl cycle, last_cycle_analysis_seconds is only set in batch mode, and the
+    # nodes connected to a sharded crawl's aggregator or the urls assigned to one of its nodes
+    gauges = ('last_cycle_seconds', 'last_cycle_fetch_wait_seconds', 'last_cycle_parse_seconds',
+              'last_cycle_match_seconds', 'last_cycle_analysis_seconds', 'last_cycle_pages', 'last_cycle_games',
+              'last_cycle_fetch_utilization', 'last_cycle_parse_utilization', 'last_cycle_match_utilization',
+              'shard_nodes', 'shard_urls')
+    # analysis_seconds is per game in per_game analysis mode and per crawl cycle in batch mode
+    histograms = ('fetch_seconds', 'render_wait_seconds', 'parse_seconds', 'match_seconds', 'cycle_seconds',
+                  'queue_seconds', 'analysis_seconds', 'notification_seconds', 'detection_latency_seconds',
+                  'crawl_interval_seconds')
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        # each histogram is its bucket counts, the +Inf bucket count, then the sum of the observations
+        self.histogram_size = len(self.buckets) + 2
+        self.values = Array('d', len(self.counters) + len(self.gauges) + len(self.histograms) * self.histogram_size)
+        self.counter_index = {name: index for index, name in enumerate(self.counters)}
+        self.gauge_index = {name: len(self.counters) + index for index, name in enumerate(self.gauges)}
+        self.histogram_index = {name: len(self.counters) + len(self.gauges) + index * self.histogram_size
+                                for index, name in enumerate(self.histograms)}
+
+    def increment(self, name, amount=1):
+        with self.values.get_lock():
+            self.values[self.counter_index[name]] += amount
+
+    def set(self, name, value):
+        with self.values.get_lock():
+            self.values[self.gauge_index[name]] = value
+
+    def observe(self, name, seconds):
+        """
+        :param name: String histogram name
+        :param seconds: float duration to add to the histogram
+        :return: None
+        """
+        start = self.histogram_index[name]
+        with self.values.get_lock():
+            self.values[start + bisect.bisect_left(self.buckets, seconds)] += 1
+            self.values[start + self.histogram_size - 1] += seconds
+
+    def snapshot(self):
+        """
+        :return: (dict of counter name to value, dict of gauge name to value, dict of histogram name to (List of per
+        bucket counts ending with the +Inf bucket, float sum)) tuple
+        """
+        with self.values.get_lock():
+            values = self.values[:]
+        counters = {name: int(values[index]) for name, index in self.counter_index.items()}
+        gauges = {name: values[index] for name, index in self.gauge_index.items()}
+        histograms = {name: ([int(count) for count in values[index:index + self.histogram_size - 1]],
+                             values[index + self.histogram_size - 1])
+                      for name, index in self.histogram_index.items()}
+        return counters, gauges, histograms
+
+    def quantile(self, bucket_counts, fraction):
+        """
+        :return: float upper bound of the bucket the fraction of observations falls in, None without observations
+        """
+        total = sum(bucket_counts)
+        if total == 0:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), bucket_counts):
+            seen += count
+            if seen >= fraction * total:
+                return bound
+
+    def render(self):
+        """
+        :return: String of every metric in the Prometheus text exposition format
+        """
+        counters, gauges, histograms = self.snapshot()
+        lines = []
+        for name in self.counters:
+            lines.append("# TYPE arbcrawler_{}_total counter".format(name))
+            lines.append("arbcrawler_{}_total {}".format(name, counters[name]))
+        for name in self.gauges:
+            lines.append("# TYPE arbcrawler_{} gauge".format(name))
+            lines.append("arbcrawler_{} {}".format(name, gauges[name]))
+        for name in self.histograms:
+            bucket_counts, total_seconds = histograms[name]
+            lines.append("# TYPE arbcrawler_{} histogram".format(name))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += count
+                lines.append('arbcrawler_{}_bucket{{le="{}"}} {}'.format(name, "+Inf" if bound == float('inf') else bound,
+                                                                       cumulative))
+            lines.append("arbcrawler_{}_sum {}".format(name, total_seconds))
+            lines.append("arbcrawler_{}_count {}".format(name, cumulative))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        :return: String one line summary of the counters and the p50/p95 bucket of every histogram with observations
+        """
+        counters, gauges, histograms = self.snapshot()
+        parts = ["{}={}".format(name, counters[name]) for name in self.counters]
+        for name in self.histograms:
+            bucket_counts, total_seconds = histograms[name]
+            if sum(bucket_counts):
+                parts.append("{} n={} mean={:.3f} p50<={} p95<={}".format(
+                    name, sum(bucket_counts), total_seconds / sum(bucket_counts),
+                    self.quantile(bucket_counts, 0.5), self.quantile(bucket_counts, 0.95)))
+        return ", ".join(parts)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the server's Metrics at /metrics for Prometheus to scrape
+    """
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(metrics, port):
+    """
+    Serve metrics on localhost in a background thread
+
+    :param metrics: Metrics object to serve
+    :param port: int port to listen on
+    :return: ThreadingHTTPServer, call shutdown() on it to stop it
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsRequestHandler)
+    server.metrics = metrics
+    server.thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server.thread.start()
+    return server
+
+
+class Profiler:
+    """
+    Profiling that is switched on and off in a running process from the command line. A control thread reads
+    ('start', mode) and ('stop', None) commands from the process's control queue.
+
+    "sample" starts a thread that records the stack of every other thread in the process each sample_interval seconds
+    and on stop writes them as collapsed stacks, one "thread;outer;...;inner count" line each, which flamegraph.pl and
+    speedscope read. "cprofile" runs cProfile in the process's main thread, which turns it on or off at its next
+    checkpoint between units of work, and on stop writes a pstats file.
+    """
+
+    def __init__(self, process_name, control_queue, profile_dir, sample_interval, logger):
+        self.process_name = process_name
+        self.control_queue = control_queue
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.logger = logger
+
+        self.mode = None
+        self.cprofile_wanted = False
+        self.profile = None
+        self.samples = Counter()
+        self.sampler = None
+        self.stop_sampling = threading.Event()
+
+        self.control_thread = threading.Thread(target=self.control_loop, name="profiler-control", daemon=True)
+        self.control_thread.start()
+
+    def control_loop(self):
+        while True:
+            action, mode = self.control_queue.get()
+            if action == 'start':
+                self.start(mode)
+            elif action == 'stop':
+                self.stop()
+
+    def start(self, mode):
+        if self.mode is not None:
+            print("{}: already profiling with {}".format(self.process_name, self.mode))
+            return
+
+        self.mode = mode
+        if mode == 'sample':
+            self.samples = Counter()
+            self.stop_sampling.clear()
+            self.sampler = threading.Thread(target=self.sample_loop, name="profiler-sampler", daemon=True)
+            self.sampler.start()
+        else:
+            self.cprofile_wanted = True
+        self.logger.debug("PROFILER: {} started {} profiling".format(self.process_name, mode))
+
+    def stop(self):
+        if self.mode == 'sample':
+            self.stop_sampling.set()
+            self.sampler.join()
+            self.write_collapsed_stacks()
+        elif self.mode == 'cprofile':
+            # the main thread writes the profile at its next checkpoint
+            self.cprofile_wanted = False
+            print("{}: cProfile will be written after the current unit of work".format(self.process_name))
+        self.mode = None
+
+    def sample_loop(self):
+        skipped = (threading.get_ident(), self.control_thread.ident)
+        while not self.stop_sampling.wait(self.sample_interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in skipped:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename),
+                                                     code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def checkpoint(self):
+        """
+        Called by the process's main loop between units of work to turn cProfile on or off in that thread
+
+        :return: None
+        """
+        if self.cprofile_wanted and self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif not self.cprofile_wanted and self.profile is not None:
+            self.profile.disable()
+            profile_file = self.profile_file("pstats")
+            self.profile.dump_stats(profile_file)
+            self.profile = None
+            print("{}: cProfile written to {}".format(self.process_name, profile_file))
+
+    def write_collapsed_stacks(self):
+        profile_file = self.profile_file("collapsed")
+        with open(profile_file, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write("{} {}\n".format(stack, count))
+        print("{}: {} samples written to {}".format(self.process_name, sum(self.samples.values()), profile_file))
+
+    def profile_file(self, extension):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        return os.path.join(self.profile_dir, "{}-{}.{}".format(self.process_name, time.strftime("%Y%m%d-%H%M%S"),
+                                                               extension))
+
+
+class SmtpConnection:
+    """
+    SMTP connection that is opened on first use and kept open between messages. When the server has dropped the
+    connection in the meantime, the send reconnects and is tried once more
+    """
+
+    def __init__(self, host, port, user, password, use_ssl=True, timeout=30, logger=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.logger = logger
+
+        self.server = None
+        self.connections = 0
+
+    def connect(self):
+        if self.use_ssl:
+            self.server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            self.server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        self.server.ehlo()
+        if self.password:
+            self.server.login(self.user, self.password)
+        self.connections += 1
+
+    def send(self, recipients, message):
+        """
+        :param recipients: List of String email addresses
+        :param message: String message including its headers
+        :return: None, raises smtplib.SMTPException or OSError if the message could not be sent
+        """
+        for attempt in range(2):
+            try:
+                if self.server is None:
+                    self.connect()
+                self.server.sendmail(self.user, recipients, message)
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+                self.close()
+                if attempt:
+                    raise
+                if self.logger is not None:
+                    self.logger.debug("SMTP_CONNECTION: Connection lost, reconnecting to {}".format(self.host))
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.server = None
+
+
+class Notifier:
+    """
+    Emails arbitrage opportunities without holding up the actioner. submit() only queues the game, a dispatcher thread
+    waits window_seconds after the first game for more to arrive and sends them all as one digest over a kept open
+    SmtpConnection. A game is not sent again while its sites and prices are unchanged, unless repeat_seconds have
+    passed since it was last sent
+    """
+
+    def __init__(self, connection, recipients, format_game, window_seconds=5, repeat_seconds=3600, max_remembered=10000,
+                 metrics=None, logger=None):
+        """
+        :param connection: SmtpConnection to send over
+        :param recipients: List of String email addresses
+        :param format_game: function of a Game returning the String describing it in the digest
+        """
+        self.connection = connection
+        self.recipients = recipients
+        self.format_game = format_game
+        self.window_seconds = window_seconds
+        self.repeat_seconds = repeat_seconds
+        self.max_remembered = max_remembered
+        self.metrics = metrics
+        self.logger = logger
+
+        self.pending = queue.Queue()
+        # game key -> (signature, unix time sent) of what was last emailed for the game, least recently sent first
+        self.sent = OrderedDict()
+        self.thread = threading.Thread(target=self.dispatch_loop, name="notifier", daemon=True)
+        self.thread.start()
+
+    def submit(self, game):
+        self.pending.put(game)
+
+    def close(self):
+        """
+        Send whatever is waiting, then stop the dispatcher and close the connection
+
+        :return: None
+        """
+        self.pending.put(None)
+        self.thread.join()
+        self.connection.close()
+
+    def game_key(self, game):
+        return game.game_id if game.game_id is not None else (game.team_1_name, game.team_2_name)
+
+    def signature(self, game):
+        return tuple((site_odds.site.name, site_odds.odds[outcome]) for outcome, site_odds in enumerate(game.arb_site_odds))
+
+    def dispatch_loop(self):
+        closing = False
+        while not closing:
+            game = self.pending.get()
+            if game is None:
+                break
+
+            digest = [game]
+            deadline = time.time() + self.window_seconds
+            while True:
+                try:
+                    game = self.pending.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if game is None:
+                    closing = True
+                    break
+                digest.append(game)
+
+            try:
+                self.send_digest(digest)
+            except Exception:
+                if self.logger is not None:
+                    self.logger.debug("NOTIFIER: ERROR building digest {}".format(sys.exc_info()[1]))
+
+    def send_digest(self, games):
+        """
+        Email the games that are new or changed since they were last sent as one message
+
+        :param games: List of Game objects that are arbitrage opportunities, later ones replace earlier ones for the
+        same game
+        :return: int number of games sent
+        """
+        now = time.time()
+        latest = OrderedDict()
+        for game in games:
+            latest[self.game_key(game)] = game
+
+        to_send = []
+        for key, game in latest.items():
+            last_sent = self.sent.get(key)
+            if last_sent is not None and last_sent[0] == self.signature(game) and now - last_sent[1] < self.repeat_seconds:
+                continue
+            to_send.append((key, game))
+
+        suppressed = len(games) - len(to_send)
+        if suppressed and self.metrics is not None:
+            self.metrics.increment('notifications_suppressed', suppressed)
+        if not to_send:
+            return 0
+
+        if len(to_send) == 1:
+            subject = 'Arbitrage Opportunity'
+            mail_body = "The bot has found the following arbitrage opportunity:\n"
+        else:
+            subject = '{} Arbitrage Opportunities'.format(len(to_send))
+            mail_body = "The bot has found the following {} arbitrage opportunities:\n".format(len(to_send))
+        mail_body += "\n".join(self.format_game(game) for key, game in to_send)
+        mail_body += "\nSent from ArbCrawler"
+        message = "From: {}\nTo: {}\nSubject: {}\n\n{}".format(self.connection.user, ", ".join(self.recipients),
+                                                               subject, mail_body)
+
+        try:
+            started = time.time()
+            self.connection.send(self.recipients, message)
+        except (smtplib.SMTPException, OSError):
+            if self.metrics is not None:
+                self.metrics.increment('notifications_failed')
+            if self.logger is not None:
+                self.logger.debug("NOTIFIER: ERROR There was an error sending an email {}".format(sys.exc_info()[1]))
+            return 0
+
+        notified_at = time.time()
+        for key, game in to_send:
+            self.sent[key] = (self.signature(game), notified_at)
+            self.sent.move_to_end(key)
+            game.timestamps['notified'] = notified_at
+            if self.metrics is not None and 'seen' in game.timestamps:
+                self.metrics.observe('detection_latency_seconds', notified_at - game.timestamps['seen'])
+        while len(self.sent) > self.max_remembered:
+            self.sent.popitem(last=False)
+
+        if self.metrics is not None:
+            self.metrics.observe('notification_seconds', notified_at - started)
+            self.metrics.increment('notifications_sent')
+        if self.logger is not None:
+            self.logger.debug("NOTIFIER: Sent {} arbitrage opportunities to {}".format(len(to_send), self.recipients))
+        return len(to_send)
+
+
 class InvalidOdds(Exception):
     pass
 
@@ -39,19 +667,505 @@ class NotArbitrageScenario(Exception):
     pass
 
 
+class ShutdownRequested(Exception):
+    """
+    Raised by the SIGTERM handler in the main process to leave the command line loop the way exit does
+    """
+    pass
+
+
+def process_tree_memory(pid):
+    """
+    Resident memory of a process and all of its descendants, read from /proc
+
+    :param pid: int process id
+    :return: int bytes, or None where there is no /proc
+    """
+    if not os.path.isdir('/proc'):
+        return None
+    children = defaultdict(list)
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry), 'r') as f:
+                # the parent pid follows the parenthesised command name, which may contain spaces
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children[int(fields[1])].append(int(entry))
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children[current])
+        try:
+            with open('/proc/{}/status'.format(current), 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class BrowserProfile:
+    """
+    Settings of the Firefox instances the DriverPool starts. The lean profile loads no images, web fonts or autoplaying
+    media, turns animations off, caps the memory cache and keeps nothing on disk. A temporary extension cancels requests
+    of the blocked resource types and to the blocked url patterns, which by default cover the usual ad and tracker hosts
+    """
+
+    default_block_resource_types = ("image", "imageset", "media", "font", "object", "ping", "beacon", "csp_report")
+    default_block_url_patterns = ("*://*.doubleclick.net/*", "*://*.googlesyndication.com/*",
+                                  "*://*.google-analytics.com/*", "*://*.googletagmanager.com/*",
+                                  "*://*.facebook.net/*", "*://*.hotjar.com/*", "*://*.newrelic.com/*",
+                                  "*://*.nr-data.net/*", "*://*.optimizely.com/*", "*://*.adnxs.com/*")
+
+    def __init__(self, lean=False, block_resource_types=default_block_resource_types,
+                 block_url_patterns=default_block_url_patterns, cache_mb=32):
+        """
+        :param lean: Boolean, False starts Firefox with its default settings
+        :param block_resource_types: iterable of String webRequest resource types to cancel
+        :param block_url_patterns: iterable of String webRequest match patterns to cancel
+        :param cache_mb: int size of the memory cache
+        """
+        self.lean = lean
+        self.block_resource_types = list(block_resource_types)
+        self.block_url_patterns = list(block_url_patterns)
+        self.cache_mb = cache_mb
+        self.addon_dir = None
+
+    def options(self):
+        """
+        :return: Options every driver is started with, headless and, for the lean profile, with the lean preferences
+        """
+        options = Options()
+        options.add_argument("-headless")
+        if not self.lean:
+            return options
+
+        options.set_preference("permissions.default.image", 2)
+        options.set_preference("image.animation_mode", "none")
+        options.set_preference("browser.display.use_document_fonts", 0)
+        options.set_preference("media.autoplay.default", 5)
+        options.set_preference("ui.prefersReducedMotion", 1)
+        options.set_preference("toolkit.cosmeticAnimations.enabled", False)
+        options.set_preference("privacy.trackingprotection.enabled", True)
+        options.set_preference("browser.cache.disk.enable", False)
+        options.set_preference("browser.cache.memory.capacity", self.cache_mb * 1024)
+        options.set_preference("browser.sessionhistory.max_entries", 2)
+        return options
+
+    def addon(self):
+        """
+        Build the blocking extension the first time it is needed
+
+        :return: String path of the .xpi file
+        """
+        if self.addon_dir is None:
+            self.addon_dir = tempfile.mkdtemp(prefix="arbcrawler-blocker-")
+        addon_file = os.path.join(self.addon_dir, "blocker.xpi")
+        if os.path.isfile(addon_file):
+            return addon_file
+
+        manifest = {
+            "manifest_version": 2,
+            "name": "ArbCrawler request blocker",
+            "version": "1.0",
+            "browser_specific_settings": {"gecko": {"id": "blocker@arbcrawler"}},
+            "permissions": ["webRequest", "webRequestBlocking", "<all_urls>"],
+            "background": {"scripts": ["background.js"]},
+        }
+        background = "function cancel() { return {cancel: true}; }\n"
+        if self.block_url_patterns:
+            background += "browser.webRequest.onBeforeRequest.addListener(cancel, {{urls: {}}}, " \
+                          "[\"blocking\"]);\n".format(json.dumps(self.block_url_patterns))
+        if self.block_resource_types:
+            background += "browser.webRequest.onBeforeRequest.addListener(cancel, {{urls: [\"<all_urls>\"], " \
+                          "types: {}}}, [\"blocking\"]);\n".format(json.dumps(self.block_resource_types))
+        with zipfile.ZipFile(addon_file, "w") as addon:
+            addon.writestr("manifest.json", json.dumps(manifest))
+            addon.writestr("background.js", background)
+        return addon_file
+
+    def create_driver(self):
+        """
+        :return: WebDriver started with this profile
+        """
+        driver = webdriver.Firefox(options=self.options())
+        if self.lean and (self.block_resource_types or self.block_url_patterns):
+            driver.install_addon(self.addon(), temporary=True)
+        return driver
+
+    def close(self):
+        if self.addon_dir is not None:
+            shutil.rmtree(self.addon_dir, ignore_errors=True)
+            self.addon_dir = None
+
+
+class DriverPool:
+    """
+    Pool of headless browser drivers so the crawler can fetch several pages at once. Each page is one unit of work
+    handed to whichever driver is idle. Drivers that crash are replaced, and every driver is restarted after
+    max_pages page loads to keep Firefox memory growth in check. Pages of sites on the "dom" backend are read by the
+    site's extraction script rather than as the whole page source, which is only sent along every verify_every pages.
+    Each page's time to ready and the browser's memory are logged, next to the same page in a browser with the full
+    profile once measure_baseline has loaded it
+    """
+
+    def __init__(self, size, max_pages, logger, metrics=None, verify_every=50, browser_profile=None):
+        self.size = size
+        self.max_pages = max_pages
+        self.logger = logger
+        self.metrics = metrics
+        self.verify_every = verify_every
+        self.extracted_pages = itertools.count()
+        self.browser_profile = browser_profile if browser_profile is not None else BrowserProfile()
+        # url to (float seconds to ready, int browser memory bytes or None) with the full profile
+        self.baseline = {}
+
+        self.page_counts = {}
+        self.idle_drivers = queue.Queue()
+        for i in range(self.size):
+            self.idle_drivers.put(self.create_driver())
+
+        # one thread per driver, threads just wait on the browser so the GIL is not a concern
+        self.thread_pool = ThreadPool(processes=self.size)
+
+    def create_driver(self):
+        driver = self.browser_profile.create_driver()
+        self.page_counts[driver] = 0
+        return driver
+
+    def measure_baseline(self, jobs):
+        """
+        Load each page once in a browser with Firefox's default settings to log this pool's page loads against
+
+        :param jobs: List of (Site, String url) tuples
+        :return: None
+        """
+        driver = BrowserProfile().create_driver()
+        try:
+            for site, url in jobs:
+                started = time.time()
+                driver.get(url)
+                site.wait_until_ready(driver)
+                self.baseline[url] = (time.time() - started, process_tree_memory(driver.service.process.pid))
+        except WebDriverException:
+            self.logger.debug("DRIVER_POOL: ERROR measuring the full profile baseline: {}".format(sys.exc_info()[1]))
+        finally:
+            driver.quit()
+
+    def log_page_load(self, driver, url, seconds):
+        """
+        Log how long a page took to be ready and the browser's memory, and the savings over the full profile baseline
+        """
+        memory = process_tree_memory(driver.service.process.pid)
+        message = "DRIVER_POOL: {} ready in {:.2f} seconds".format(url, seconds)
+        if memory is not None:
+            message += ", browser memory {:.0f} MB".format(memory / 2 ** 20)
+        if url in self.baseline:
+            baseline_seconds, baseline_memory = self.baseline[url]
+            message += ", {:.2f} seconds".format(baseline_seconds - seconds)
+            if memory is not None and baseline_memory is not None:
+                message += " and {:.0f} MB".format((baseline_memory - memory) / 2 ** 20)
+            message += " less than the full profile"
+        self.logger.debug(message)
+
+    def recycle_driver(self, driver):
+        """
+        Quit a driver and return a fresh one in its place
+
+        :param driver: WebDriver to be replaced
+        :return: new WebDriver
+        """
+        self.page_counts.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception:
+            self.logger.debug("DRIVER_POOL: ERROR quitting driver {}".format(sys.exc_info()[0]))
+        return self.create_driver()
+
+    def fetch(self, job):
+        """
+        Load a single url with the next idle driver
+
+        :param job: (Site, String url) tuple
+        :return: (Site, String url, String page source) tuple, page source is None if the driver failed
+        """
+        site, url = job
+        driver = self.idle_drivers.get()
+        page_source = None
+        try:
+            started = time.time()
+            driver.get(url)
+            loaded = time.time()
+            if not site.wait_until_ready(driver):
+                self.logger.debug("DRIVER_POOL: Page {} not ready after {} seconds, skipping".format(url, site.ready_timeout))
+            elif site.backend == "dom":
+                page_source = self.extract(site, driver)
+            else:
+                page_source = driver.page_source
+            if self.metrics is not None:
+                self.metrics.observe('fetch_seconds', loaded - started)
+                self.metrics.observe('render_wait_seconds', time.time() - loaded)
+            if page_source is not None and self.logger.isEnabledFor(logging.DEBUG):
+                self.log_page_load(driver, url, time.time() - started)
+            self.page_counts[driver] += 1
+            if self.page_counts[driver] >= self.max_pages:
+                self.logger.debug("DRIVER_POOL: Driver reached {} pages, recycling".format(self.max_pages))
+                driver = self.recycle_driver(driver)
+        except WebDriverException:
+            self.logger.debug("DRIVER_POOL: ERROR driver crashed loading {}, recycling: {}".format(url, sys.exc_info()[1]))
+            driver = self.recycle_driver(driver)
+        finally:
+            self.idle_drivers.put(driver)
+
+        return site, url, page_source
+
+    def extract(self, site, driver):
+        """
+        Run the site's extraction script in the rendered page. The page source is sent along for the HTML parser when
+        the script finds no games, and every verify_every pages to check the script against, never with verify_every 0
+
+        :param site: Site on the "dom" backend
+        :param driver: WebDriver that has rendered a page from the site
+        :return: String JSON with the extracted rows, and the page source when it was sent
+        """
+        rows = driver.execute_script(site.extract_script)
+        if rows is None or self.verify_every and next(self.extracted_pages) % self.verify_every == 0:
+            return '{{"rows": {}, "html": {}}}'.format(rows or "null", json.dumps(driver.page_source))
+        return '{{"rows": {}}}'.format(rows)
+
+    def fetch_all(self, jobs):
+        """
+        Fetch all of the jobs concurrently. Results are yielded in the same order as jobs
+
+        :param jobs: List of (Site, String url) tuples
+        :return: iterator of (Site, String url, String page source) tuples
+        """
+        return self.thread_pool.imap(self.fetch, jobs)
+
+    def close(self):
+        self.thread_pool.close()
+        self.thread_pool.join()
+        while not self.idle_drivers.empty():
+            driver = self.idle_drivers.get()
+            try:
+                driver.quit()
+            except Exception:
+                self.logger.debug("DRIVER_POOL: ERROR quitting driver {}".format(sys.exc_info()[0]))
+        self.browser_profile.close()
+
+
+class HttpFetcher:
+    """
+    Plain HTTP fetch backend for sites that serve their odds without a browser, either as server rendered HTML or as
+    a JSON feed. A single requests session is shared so connections are kept alive and reused, and responses are
+    gzip compressed. Has the same fetch/fetch_all/close interface as DriverPool.
+    """
+
+    def __init__(self, size, timeout, logger, metrics=None):
+        self.size = size
+        self.timeout = timeout
+        self.logger = logger
+        self.metrics = metrics
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.size, pool_maxsize=self.size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:68.0) Gecko/20100101 Firefox/68.0",
+            "Accept-Encoding": "gzip, deflate",
+        })
+
+        self.thread_pool = ThreadPool(processes=self.size)
+
+    def fetch(self, job):
+        """
+        Request a single url, using the site's feed url when the site reads its JSON feed
+
+        :param job: (Site, String url) tuple
+        :return: (Site, String url, String response body) tuple, body is None if the request failed
+        """
+        site, url = job
+        started = time.time()
+        try:
+            response = self.session.get(site.fetch_url(url), timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            self.logger.debug("HTTP_FETCHER: ERROR requesting {}: {}".format(url, sys.exc_info()[1]))
+            return site, url, None
+
+        page_source = response.text
+        if self.metrics is not None:
+            self.metrics.observe('fetch_seconds', time.time() - started)
+        return site, url, page_source
+
+    def fetch_all(self, jobs):
+        """
+        Fetch all of the jobs concurrently. Results are yielded in the same order as jobs
+
+        :param jobs: List of (Site, String url) tuples
+        :return: iterator of (Site, String url, String response body) tuples
+        """
+        return self.thread_pool.imap(self.fetch, jobs)
+
+    def close(self):
+        self.thread_pool.close()
+        self.thread_pool.join()
+        self.session.close()
+
+
 class Site:
-    def __init__(self, name, urls):
+    # CSS selector that is present once the odds have rendered, and how long to wait for it
+    ready_selector = None
+    ready_timeout = 10
+    ready_poll_interval = 0.25
+    # restricts which parts of the page source BeautifulSoup builds a tree for, None builds the whole page
+    page_strainer = None
+
+    # fetch backends a site supports: "selenium", "http" for server rendered HTML, "json" for the site's JSON feed,
+    # "dom" to run extract_script in the rendered page and read back just its rows
+    backends = ("selenium", "http")
+    # the backends fetched by the DriverPool
+    browser_backends = ("selenium", "dom")
+    # JavaScript run in the rendered page by the "dom" backend. It returns a JSON string of [team 1 name, team 2 name,
+    # [int moneyline per outcome]] rows, or null when it finds no games so the HTML parser gets to look at the page
+    extract_script = None
+
+    # every site created in this process by name, so SiteOdds can be sent between processes with just the name
+    registry = {}
+
+    def __init__(self, name, urls, backend="selenium"):
         self.name = name
         self.urls = urls
+        if backend not in self.backends:
+            raise ValueError("{} does not support the {} fetch backend".format(name, backend))
+        self.backend = backend
+        Site.registry[name] = self
+
+    @staticmethod
+    def by_name(name):
+        """
+        The site created in this process with the given name, or a bare Site if there is none
+
+        :param name: String site name
+        :return: Site
+        """
+        site = Site.registry.get(name)
+        if site is None:
+            site = Site(name, [])
+        return site
+
+    def fetch_url(self, url):
+        """
+        The url the http backends should request for a configured page url
+
+        :param url: String URL from the config
+        :return: String URL to request
+        """
+        return url
+
+    def wait_until_ready(self, driver):
+        """
+        Poll the loaded page until the site's ready_selector is present, or until ready_timeout passes
+
+        :param driver: WebDriver that has loaded a page from this site
+        :return: True if the page is ready to be parsed, False if it timed out
+        """
+        if self.ready_selector is None:
+            sleep(self.ready_timeout)
+            return True
+
+        try:
+            WebDriverWait(driver, self.ready_timeout, poll_frequency=self.ready_poll_interval).until(
+                expected_conditions.presence_of_element_located((By.CSS_SELECTOR, self.ready_selector)))
+        except TimeoutException:
+            return False
+        return True
 
-    def copy_just_fields(self):
-        return Site(self.name, self.urls)
+    def parse_extracted(self, page_source, parse_html):
+        """
+        Games from the rows the "dom" backend extracted in the browser. When the page source came along with them the
+        HTML parser reads it as well, as the fallback when the script found nothing and as a check on the script
+        otherwise, and its games are the ones used
+
+        :param page_source: String JSON of the extracted rows and optionally the HTML page source
+        :param parse_html: function taking the String HTML page source and returning a List of Game objects
+        :return: List of Game objects
+        """
+        extracted = json.loads(page_source)
+        found_games = None
+        if extracted['rows'] is not None:
+            found_games = []
+            for team_1_name, team_2_name, moneylines in extracted['rows']:
+                # prices the script could not read come back as null
+                if len(moneylines) < 2 or not all(isinstance(ml, int) for ml in moneylines):
+                    continue
+                found_games.append(Game(team_1_name=team_1_name, team_2_name=team_2_name,
+                                        site_odds=SiteOdds(self, moneylines=moneylines)))
+
+        if 'html' not in extracted:
+            return found_games or []
+
+        html_games = parse_html(extracted['html'])
+        if found_games is None:
+            self.logger.debug("PARSE_EXTRACTED: %s extraction script found no games, parsed the page source", self.name)
+        elif self.price_rows(found_games) != self.price_rows(html_games):
+            self.logger.debug("PARSE_EXTRACTED: ERROR %s extracted %s games that differ from the %s in the page source",
+                              self.name, len(found_games), len(html_games))
+        return html_games
+
+    @staticmethod
+    def price_rows(games):
+        return [(game.team_1_name, game.team_2_name, [site_odds.moneylines for site_odds in game.site_odds])
+                for game in games]
 
     def __repr__(self):
         return "Site name: {} urls: {}\n".format(self.name, str(self.urls))
 
 class Bovada(Site):
-    def __init__(self, name, urls):
+    ready_selector = "sp-coupon sp-two-way-vertical.market-type span.bet-price, sp-coupon sp-three-way-vertical.market-type span.bet-price"
+    backends = ("selenium", "http", "json", "dom")
+    # the same rules as parse_all_sports_page, run on the browser's DOM
+    extract_script = """
+        var rows = [];
+        var coupons = document.querySelectorAll("sp-coupon");
+        for (var i = 0; i < coupons.length; i++) {
+            var names = coupons[i].querySelectorAll("h4.competitor-name");
+            var markets = coupons[i].querySelectorAll("sp-two-way-vertical.market-type");
+            var outcomes = 2;
+            if (markets.length != 3) {
+                markets = coupons[i].querySelectorAll("sp-three-way-vertical.market-type");
+                outcomes = 3;
+            }
+            if (names.length < 2 || !names[0].querySelector("span") || !names[1].querySelector("span")) continue;
+            if (markets.length != 3) continue;
+            var prices = markets[1].querySelectorAll("span.bet-price");
+            if (prices.length < outcomes) continue;
+            var moneylines = [];
+            for (var j = 0; j < outcomes; j++) {
+                var ml = prices[j].textContent.match(/[+-]\\d+|EVEN/);
+                moneylines.push(ml === null ? null : ml[0] == "EVEN" ? 100 : parseInt(ml[0], 10));
+            }
+            rows.push([names[0].querySelector("span").textContent, names[1].querySelector("span").textContent,
+                       moneylines]);
+        }
+        return rows.length ? JSON.stringify(rows) : null;
+    """
+    feed_path = "/services/sports/event/coupon/events/A/description"
+    feed_query = "marketFilterId=def&preMatchOnly=false&lang=en"
+    # only build the tree for the game coupons, the rest of the page is never read
+    page_strainer = SoupStrainer("sp-coupon")
+    moneyline_regex = re.compile('[+-]\\d+|EVEN')
+    feed_moneyline_regex = re.compile(r'^[+-]?\d+$')
+
+    def __init__(self, name, urls, backend="selenium"):
 
         # Setup Logger
         self.log_name = "bovada_log"
@@ -60,7 +1174,7 @@ class Bovada(Site):
 
         self.logger = setup_logger(self.log_name, self.log_file, self.formatter)
 
-        Site.__init__(self, name, urls)
+        Site.__init__(self, name, urls, backend)
         self.games_xpath = "/html/body/bx-site/ng-component/div/sp-main/div/main/div/section/main/sp-home/div/sp-next-events/div/div/div/sp-coupon"
 
     def parse_page(self, page_source, url):
@@ -71,9 +1185,87 @@ class Bovada(Site):
         :param url: String URL of source location
         :return: List of Game objects
         """
-        found_games = self.parse_all_sports_page(page_source)
-        self.logger.debug("PARSE_ALL_SPORTS_PAGE: Bovada from url {} found games this run:".format(url))
-        self.logger.debug(found_games)
+        if self.backend == "json":
+            found_games = self.parse_event_feed(json.loads(page_source))
+            self.logger.debug("PARSE_EVENT_FEED: Bovada from url %s found games this run:", url)
+        elif self.backend == "dom":
+            found_games = self.parse_extracted(page_source, self.parse_all_sports_page)
+            self.logger.debug("PARSE_EXTRACTED: Bovada from url %s found games this run:", url)
+        else:
+            found_games = self.parse_all_sports_page(page_source)
+            self.logger.debug("PARSE_ALL_SPORTS_PAGE: Bovada from url %s found games this run:", url)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            # the games are merged into later, so they are written as they are now
+            self.logger.debug(repr(found_games))
+
+        return found_games
+
+    def fetch_url(self, url):
+        """
+        Map a sports page url such as https://www.bovada.lv/sports/baseball/mlb to the coupon feed the page is
+        rendered from when reading the JSON feed
+
+        :param url: String URL from the config
+        :return: String URL to request
+        """
+        if self.backend != "json":
+            return url
+
+        parts = urlsplit(url)
+        sport_path = parts.path.rstrip("/")
+        if sport_path.startswith("/sports"):
+            sport_path = sport_path[len("/sports"):]
+        return urlunsplit((parts.scheme, parts.netloc, self.feed_path + sport_path, self.feed_query, ""))
+
+    def parse_event_feed(self, feed):
+        """
+        Takes the decoded coupon feed for a sports page on Bovada and creates a list of games from the moneyline
+        markets, including the draw price of three way markets
+
+        :param feed: List of coupon path blocks decoded from the feed JSON
+        :return: List of Game objects
+        """
+        found_games = []
+
+        for path_block in feed:
+            for event in path_block.get("events", []):
+                outcomes = None
+                for display_group in event.get("displayGroups", []):
+                    for market in display_group.get("markets", []):
+                        if market.get("description") in ("Moneyline", "3-Way Moneyline") and \
+                                market.get("period", {}).get("main", True):
+                            outcomes = market.get("outcomes", [])
+                            break
+                    if outcomes is not None:
+                        break
+
+                if outcomes is None:
+                    continue
+
+                # same order as the page parser, the two teams then the draw if there is one
+                draws = [outcome for outcome in outcomes if outcome.get("type") == "D"]
+                outcomes = [outcome for outcome in outcomes if outcome.get("type") != "D"]
+                if len(outcomes) < 2:
+                    continue
+
+                prices = []
+                for outcome in outcomes[:2] + draws[:1]:
+                    ml = str(outcome.get("price", {}).get("american", ""))
+                    if ml == "EVEN":
+                        ml = "+100"
+                    prices.append(ml)
+
+                if not all(self.feed_moneyline_regex.match(ml) for ml in prices):
+                    continue
+
+                new_site_odds = SiteOdds(self, moneylines=[int(ml) for ml in prices])
+
+                game = Game(team_1_name=outcomes[0]["description"], team_2_name=outcomes[1]["description"],
+                            site_odds=new_site_odds)
+                if event.get("startTime"):
+                    # the feed gives start times in milliseconds
+                    game.start_time = event["startTime"] / 1000
+                found_games.append(game)
 
         return found_games
 
@@ -86,61 +1278,80 @@ class Bovada(Site):
         """
         found_games = []
 
-        soup = BeautifulSoup(page_source, 'lxml')
+        soup = BeautifulSoup(page_source, 'lxml', parse_only=self.page_strainer)
         games = soup.find_all("sp-coupon")
 
         for game in games:
             competitors = game.find_all("h4", {"class": "competitor-name"})
             team_a = competitors[0].find('span').text
             team_b = competitors[1].find('span').text
-            if len(game.find_all("sp-two-way-vertical", {"class": "market-type"})) == 3:
-                # normal game with no draw
-                bet_types = game.find_all("sp-two-way-vertical", {
-                    "class": "market-type"})  # find all market types, this will be spread, moneyline win and O/U
-                odds = bet_types[1].find_all('span', {
-                    "class": "bet-price"})  # this will take just the moneyline win odds
-                if len(odds) < 2:
-                    continue
 
-            elif len(game.find_all("sp-three-way-vertical", {"class": "market-type"})) == 3:
+            # find all market types, this will be spread, moneyline win and O/U
+            bet_types = game.find_all("sp-two-way-vertical", {"class": "market-type"})
+            if len(bet_types) != 3:
                 # game with draw
-                bet_types = game.find_all("sp-three-way-vertical", {
-                    "class": "market-type"})  # find all market types, this will be spread, moneyline win and O/U
-                odds = bet_types[1].find_all('span', {
-                    "class": "bet-price"})  # this will take just the moneyline win odds
-                if len(odds) < 2:
+                bet_types = game.find_all("sp-three-way-vertical", {"class": "market-type"})
+                if len(bet_types) != 3:
+                    # something went wrong
                     continue
-            else:
-                # something went wrong
-                continue
 
-            ml1 = re.search('[+-]\d+|EVEN', odds[0].text).group(0)
-
-            ml2 = re.search('[+-]\d+|EVEN', odds[1].text).group(0)
+            odds = bet_types[1].find_all('span', {"class": "bet-price"})  # this will take just the moneyline win odds
+            # two way markets list team 1 and team 2, three way markets add the draw after them
+            outcome_count = 3 if bet_types[1].name == "sp-three-way-vertical" else 2
+            if len(odds) < outcome_count:
+                continue
 
-            # check if the moneyline is EVEN, and change to string of numerical counterpart
-            if ml1 == "EVEN":
-                ml1 = "+100"
-            if ml2 == "EVEN":
-                ml2 = "+100"
+            moneylines = []
+            for price in odds[:outcome_count]:
+                ml = self.moneyline_regex.search(price.text).group(0)
+                # check if the moneyline is EVEN, and change to string of numerical counterpart
+                if ml == "EVEN":
+                    ml = "+100"
+                moneylines.append(int(ml))
 
-            new_site_odds = SiteOdds(self, ml1=int(ml1), ml2=int(ml2))
+            new_site_odds = SiteOdds(self, moneylines=moneylines)
 
             found_games.append(Game(team_1_name=team_a, team_2_name=team_b, site_odds=new_site_odds))
 
-        self.logger.debug(found_games)
         return found_games
 
 
 class MyBookie(Site):
-    def __init__(self, name, urls):
+    ready_selector = "div.sportsbook-lines div.spread-lines button"
+    game_block_attrs = {"class": "row m-0 mobile sportsbook-lines mb-2 border"}
+    # only build the tree for the game blocks, the rest of the page is never read
+    page_strainer = SoupStrainer("div", game_block_attrs)
+    moneyline_regex = re.compile('\\((.+?)\\)')
+    backends = ("selenium", "http", "dom")
+    # the same rules as parse_sportsbook_page, run on the browser's DOM
+    extract_script = """
+        var rows = [];
+        var blocks = document.querySelectorAll("div.row.m-0.mobile.sportsbook-lines.mb-2.border");
+        for (var i = 0; i < blocks.length; i++) {
+            var teams = blocks[i].querySelectorAll("div.team-lines a");
+            var buttons = blocks[i].querySelectorAll("div.spread-lines button");
+            if (teams.length < 2 || buttons.length < 2) continue;
+            var team_a = teams[0].textContent, team_b = teams[1].textContent;
+            if (team_a.slice(0, 2) == "1H" || team_b.slice(0, 2) == "1H") continue;
+            var moneylines = [];
+            for (var j = 0; j < 2; j++) {
+                var ml = buttons[j].textContent.match(/\\((.+?)\\)/);
+                if (ml === null) break;
+                moneylines.push(parseInt(ml[1], 10));
+            }
+            if (moneylines.length == 2) rows.push([team_a, team_b, moneylines]);
+        }
+        return rows.length ? JSON.stringify(rows) : null;
+    """
+
+    def __init__(self, name, urls, backend="selenium"):
         self.log_name = "mybookie_log"
         self.log_file = "mybookie.log"
         self.formatter = logging.Formatter("%(asctime)s %(levelname)s MYBOOKIE: %(message)s")
 
         self.logger = setup_logger(self.log_name, self.log_file, self.formatter)
 
-        Site.__init__(self, name, urls)
+        Site.__init__(self, name, urls, backend)
         self.games_xpath = ""
         self.game_element_mapping = {}
 
@@ -153,9 +1364,14 @@ class MyBookie(Site):
         :return: List of Game objects
         """
 
-        found_games = self.parse_sportsbook_page(page_source)
-        self.logger.debug("PARSE_SPORTSBOOK_PAGE: MyBookie from url {} found games this run:".format(url))
-        self.logger.debug(found_games)
+        if self.backend == "dom":
+            found_games = self.parse_extracted(page_source, self.parse_sportsbook_page)
+            self.logger.debug("PARSE_EXTRACTED: MyBookie from url %s found games this run:", url)
+        else:
+            found_games = self.parse_sportsbook_page(page_source)
+            self.logger.debug("PARSE_SPORTSBOOK_PAGE: MyBookie from url %s found games this run:", url)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(repr(found_games))
 
         return found_games
 
@@ -169,30 +1385,29 @@ class MyBookie(Site):
 
         found_games = []
 
-        soup = BeautifulSoup(page_source, 'lxml')
-        game_html_blocks = soup.find_all("div", {"class":"row m-0 mobile sportsbook-lines mb-2 border"})
-
+        soup = BeautifulSoup(page_source, 'lxml', parse_only=self.page_strainer)
+        game_html_blocks = soup.find_all("div", self.game_block_attrs)
 
-        for i in range(0, len(game_html_blocks)):
-            team_a = game_html_blocks[i].find_all("div", {"class":"team-lines"})[0].find_all("a")[0].get_text()
-            team_b = game_html_blocks[i].find_all("div", {"class":"team-lines"})[0].find_all("a")[1].get_text()
+        for game_html_block in game_html_blocks:
+            team_links = game_html_block.find("div", {"class": "team-lines"}).find_all("a")
+            team_a = team_links[0].get_text()
+            team_b = team_links[1].get_text()
 
             # Special Case: ignore any first half bets, first two characters will be "1H"
             # TODO: make this better so that 1H bets become own game
             if team_a[:2] == "1H" or team_b[:2] == "1H":
                 continue
 
-            ml1_text_data = game_html_blocks[i].find_all("div", {"class": "spread-lines"})[0].find_all("button")[0].get_text()
-            ml2_text_data = game_html_blocks[i].find_all("div", {"class": "spread-lines"})[0].find_all("button")[1].get_text()
-
-
+            spread_buttons = game_html_block.find("div", {"class": "spread-lines"}).find_all("button")
+            ml1_text_data = spread_buttons[0].get_text()
+            ml2_text_data = spread_buttons[1].get_text()
 
             # Skip this game if there aren't odds for both outcomes
             # TODO: make this better
             if ml1_text_data == "":
                 continue
             else:
-                ml1_text = re.search('\((.+?)\)', ml1_text_data)
+                ml1_text = self.moneyline_regex.search(ml1_text_data)
                 if ml1_text is None:
                     # There is no spread data for this game
                     continue
@@ -202,7 +1417,7 @@ class MyBookie(Site):
             if ml2_text_data == "":
                 continue
             else:
-                ml2_text = re.search('\((.+?)\)', ml2_text_data)
+                ml2_text = self.moneyline_regex.search(ml2_text_data)
                 if ml2_text is None:
                     # There is no spread data for this game
                     continue
@@ -218,6 +1433,7 @@ class MyBookie(Site):
 
 
 class SiteOdds:
+    __slots__ = ('site', 'moneylines', 'odds', 'url')
 
     def moneyline_to_decimal(self, ml):
         """ Converts the positive or negative moneyline value into a
@@ -233,26 +1449,62 @@ class SiteOdds:
         return 100 / -ml + 1
 
     def copy(self):
-        return SiteOdds(self.site.copy_just_fields(), self.ml1, self.ml2, self.odds1, self.odds1, self.url)
+        return SiteOdds(self.site, url=self.url, moneylines=self.moneylines, odds=self.odds)
 
+    def __init__(self, site, ml1=None, ml2=None, odds1=None, odds2=None, url=None, moneylines=None, odds=None):
+        """
+        Prices from one site for the outcomes of a game, either as ml1/ml2 and odds1/odds2 for two outcome markets or
+        as lists of moneylines or decimal odds for any number of outcomes. Outcomes are ordered team 1, team 2, draw
 
-    def __init__(self, site, ml1=None, ml2=None, odds1=None, odds2=None, url=None):
-        if ml1 is None and ml2 is None and odds1 is None and odds2 is None:
+        :param site: Site the prices were found on
+        :param moneylines: List of int moneyline values, one per outcome, stored as a tuple
+        :param odds: List of float decimal odds, one per outcome, stored as a tuple
+        """
+        if moneylines is None and (ml1 is not None or ml2 is not None):
+            moneylines = [ml1, ml2]
+        if odds is None and (odds1 is not None or odds2 is not None):
+            odds = [odds1, odds2]
+        if moneylines is None and odds is None:
             raise InvalidOdds
-        if odds1 is None and odds2 is None:
-            self.odds1 = self.moneyline_to_decimal(ml1)
-            self.odds2 = self.moneyline_to_decimal(ml2)
-        else:
-            self.odds1 = odds1
-            self.odds2 = odds2
+
+        if odds is None:
+            odds = [self.moneyline_to_decimal(ml) for ml in moneylines]
+        if moneylines is None:
+            moneylines = [None] * len(odds)
 
         self.site = site
-        self.ml1 = ml1
-        self.ml2 = ml2
+        self.moneylines = tuple(moneylines)
+        self.odds = tuple(odds)
         self.url = url
 
+    def __getstate__(self):
+        # the site travels by name, the receiving process looks up its own Site object
+        return self.site.name, self.moneylines, self.odds, self.url
+
+    def __setstate__(self, state):
+        site_name, self.moneylines, self.odds, self.url = state
+        self.site = Site.by_name(site_name)
+
+    @property
+    def ml1(self):
+        return self.moneylines[0]
+
+    @property
+    def ml2(self):
+        return self.moneylines[1]
+
+    @property
+    def odds1(self):
+        return self.odds[0]
+
+    @property
+    def odds2(self):
+        return self.odds[1]
+
 
 class Game:
+    __slots__ = ('team_1_name', 'team_2_name', 'site_odds', 'arbitrage_opportunity', 'margin', 'wager_ratios',
+                 'arb_site_odds', 'arb_combinations', 'game_id', 'league', 'time', 'date', 'start_time', 'timestamps')
 
     def __init__(self, team_1_name, team_2_name, site_odds=None):
         self.team_1_name = team_1_name
@@ -264,41 +1516,1869 @@ class Game:
         else:
             self.site_odds = []
 
+        # the arbitrage opportunity, one wager ratio and SiteOdds per outcome
         self.arbitrage_opportunity = False
         self.margin = None
-        self.wager_ratio_1 = None
-        self.wager_ratio_2 = None
-        self.arb_site_odds_1 = None
-        self.arb_site_odds_2 = None
+        self.wager_ratios = []
+        self.arb_site_odds = []
+        self.arb_combinations = []
+
+        # canonical (team 1 id, team 2 id) given by the GameMatcher, stable across crawl cycles
+        self.game_id = None
 
         self.league = None
         self.time = None
         self.date = None
+        # unix time the game starts, when the page shows it
+        self.start_time = None
+
+        # unix time the game reached each pipeline stage: seen (the last page pricing it was read), matched, queued,
+        # received by the game watcher, analyzed, actioned and notified
+        self.timestamps = {}
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in Game.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(Game.__slots__, state):
+            setattr(self, slot, value)
+
+    def outcome_names(self, outcome_count=2):
+        if outcome_count == 3:
+            return [self.team_1_name, self.team_2_name, "Draw"]
+        return [self.team_1_name, self.team_2_name]
+
+    def describe_arbitrage(self):
+        """
+        One line strategy for the arbitrage opportunity, which outcome to wager on at which site
+
+        :return: String
+        """
+        wagers = []
+        for outcome, outcome_name in enumerate(self.outcome_names(len(self.arb_site_odds))):
+            wagers.append("{} {} at odds {} on {}".format(outcome_name, self.wager_ratios[outcome],
+                                                          self.arb_site_odds[outcome].odds[outcome],
+                                                          self.arb_site_odds[outcome].site.name))
+        return "Wager {} for margin {}".format(" and ".join(wagers), self.margin)
 
     def copy(self):
         game = Game(self.team_1_name, self.team_2_name)
 
-        for i in range(len(self.site_odds)):
-            game.site_odds.append(self.site_odds[i].copy())
+        for i in range(len(self.site_odds)):
+            game.site_odds.append(self.site_odds[i].copy())
+
+        game.arbitrage_opportunity = self.arbitrage_opportunity
+        game.margin = self.margin
+        game.wager_ratios = list(self.wager_ratios)
+        game.arb_site_odds = list(self.arb_site_odds)
+        game.arb_combinations = list(self.arb_combinations)
+        game.game_id = self.game_id
+
+        game.league = self.league
+        game.time = self.time
+        game.date = self.date
+        game.start_time = self.start_time
+        game.timestamps = dict(self.timestamps)
+
+        return game
+
+    def unmatched_copy(self):
+        """
+        Game with the same teams and the same SiteOdds in a new list, so matching it again leaves this one as it is
+
+        :return: Game
+        """
+        game = Game(self.team_1_name, self.team_2_name)
+        game.site_odds = list(self.site_odds)
+        game.league = self.league
+        game.time = self.time
+        game.date = self.date
+        game.start_time = self.start_time
+        return game
+
+    def __repr__(self):
+        repr_str = "{} vs. {}\n".format(self.team_1_name, self.team_2_name)
+        for i in self.site_odds:
+            repr_str = repr_str + "    Site: {} {}".format(i.site.name, " vs. ".join(
+                "{} {}".format(ml, odds) for ml, odds in zip(i.moneylines, i.odds)))
+        return repr_str
+
+
+class TeamRegistry:
+    """
+    Maps each (site name, raw team name) to a canonical team id so names only need fuzzy matching the first time they
+    are seen. The id of a team is the first raw name it was seen under. Entries are kept in least recently used order,
+    bounded by max_entries and persisted to a JSON file between runs. Manual overrides are never evicted and always win.
+    """
+
+    def __init__(self, registry_file=None, max_entries=10000, overrides_file=None):
+        self.registry_file = registry_file
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.overrides = {}
+        self.dirty = False
+
+        if self.registry_file and os.path.isfile(self.registry_file):
+            with open(self.registry_file, 'r') as f:
+                for site_name, team_name, team_id in json.load(f)['entries']:
+                    self.entries[(site_name, team_name)] = team_id
+
+        if overrides_file:
+            with open(overrides_file, 'r') as f:
+                for override in toml.loads(f.read()).get('override', []):
+                    self.overrides[(override['site'], override['name'])] = override['team']
+
+    def lookup(self, site_name, team_name):
+        """
+        :param site_name: String name of the site the team name was found on
+        :param team_name: String raw team name
+        :return: String team id, None if the name has not been seen
+        """
+        key = (site_name, team_name)
+        if key in self.overrides:
+            return self.overrides[key]
+
+        team_id = self.entries.get(key)
+        if team_id is not None:
+            self.entries.move_to_end(key)
+        return team_id
+
+    def register(self, site_name, team_name, team_id):
+        key = (site_name, team_name)
+        if key in self.overrides:
+            return
+
+        self.entries[key] = team_id
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def save(self):
+        if not self.registry_file or not self.dirty:
+            return
+
+        temp_file = self.registry_file + ".tmp"
+        with open(temp_file, 'w') as f:
+            json.dump({'entries': [[site_name, team_name, team_id]
+                                   for (site_name, team_name), team_id in self.entries.items()]}, f)
+        os.replace(temp_file, self.registry_file)
+        self.dirty = False
+
+
+class HistorySegment:
+    """
+    One directory of column files in an OddsHistory. Columns are preallocated to the segment's capacity, meta holds
+    how many rows are written and the time range they cover, readers never look past the written rows.
+    """
+
+    dtypes = OrderedDict([('timestamp', np.float64), ('game', np.int32), ('site', np.int16), ('outcomes', np.int8),
+                          ('odds', np.float64)])
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.arrays = {}
+
+    @staticmethod
+    def create(path, capacity, sorted_rows=False):
+        """
+        :param path: String directory to create the segment in
+        :param capacity: int rows to preallocate
+        :param sorted_rows: bool the rows will be written ordered by game then timestamp
+        :return: HistorySegment open for appending
+        """
+        os.makedirs(path)
+        segment = HistorySegment(path, {'rows': 0, 'capacity': capacity, 'sorted': sorted_rows, 'sealed': False,
+                                        'start': None, 'end': None})
+        for name, dtype in HistorySegment.dtypes.items():
+            shape = (capacity, OddsHistory.max_outcomes) if name == 'odds' else (capacity,)
+            segment.arrays[name] = np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+',
+                                                             dtype=dtype, shape=shape)
+        segment.save_meta()
+        return segment
+
+    @staticmethod
+    def open(path):
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            return HistorySegment(path, json.load(f))
+
+    @property
+    def rows(self):
+        return self.meta['rows']
+
+    def column(self, name, writable=False):
+        if name not in self.arrays:
+            self.arrays[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r+' if writable else 'r')
+        return self.arrays[name][:self.meta['rows']]
+
+    def append(self, columns, start_row, end_row):
+        """
+        Copy rows start_row to end_row of the columns onto the end of the segment
+
+        :param columns: dict of column name to numpy array
+        :return: None
+        """
+        rows = self.meta['rows']
+        count = end_row - start_row
+        for name in self.dtypes:
+            if name not in self.arrays:
+                self.column(name, writable=True)
+            self.arrays[name][rows:rows + count] = columns[name][start_row:end_row]
+
+        timestamps = columns['timestamp'][start_row:end_row]
+        start, end = float(timestamps.min()), float(timestamps.max())
+        self.meta['start'] = start if self.meta['start'] is None else min(self.meta['start'], start)
+        self.meta['end'] = end if self.meta['end'] is None else max(self.meta['end'], end)
+        self.meta['rows'] = rows + count
+
+    def seal(self):
+        self.meta['sealed'] = True
+        self.flush()
+
+    def flush(self):
+        for array in self.arrays.values():
+            array.flush()
+        self.save_meta()
+
+    def save_meta(self):
+        temp_file = os.path.join(self.path, 'meta.json.tmp')
+        with open(temp_file, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(temp_file, os.path.join(self.path, 'meta.json'))
+
+    def select(self, game, start=None, end=None):
+        """
+        :param game: int game code
+        :param start: optional float timestamp, rows before it are skipped
+        :param end: optional float timestamp, rows at or after it are skipped
+        :return: slice or numpy index array of the matching rows, None if the segment cannot hold any
+        """
+        if self.rows == 0 or (start is not None and self.meta['end'] < start) or \
+                (end is not None and self.meta['start'] >= end):
+            return None
+
+        timestamps = self.column('timestamp')
+        if self.meta['sorted']:
+            games = self.column('game')
+            # a python int would make numpy cast the whole column before searching
+            game = games.dtype.type(game)
+            first = np.searchsorted(games, game, side='left')
+            last = np.searchsorted(games, game, side='right')
+            if start is not None:
+                first += np.searchsorted(timestamps[first:last], start, side='left')
+            if end is not None:
+                last = first + np.searchsorted(timestamps[first:last], end, side='left')
+            return slice(first, last)
+
+        mask = self.column('game') == game
+        if start is not None:
+            mask &= timestamps >= start
+        if end is not None:
+            mask &= timestamps < end
+        return np.flatnonzero(mask)
+
+
+class OddsHistory:
+    """
+    Append only store of every price the crawler sees, kept as columns in memory mapped segment files so a whole crawl
+    cycle is written with a few array copies. Rows go to the open segment until it is full, then it is sealed and a
+    new one started. Once compact_segments segments are sealed a background thread merges them into one segment
+    sorted by game and timestamp, which range queries binary search. Games and sites are stored as int codes, the
+    names behind the codes and the list of live segments are in history.json.
+    """
+
+    max_outcomes = 3
+
+    def __init__(self, history_dir, segment_rows=1000000, compact_segments=8, logger=None):
+        self.history_dir = history_dir
+        self.segment_rows = segment_rows
+        self.compact_segments = compact_segments
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.compaction = None
+        self.dirty = False
+
+        self.sites = []
+        self.games = []
+        self.site_codes = {}
+        self.game_codes = {}
+        self.segments = []
+        self.next_segment = 0
+        self.open_segment = None
+
+        history_file = os.path.join(self.history_dir, 'history.json')
+        if os.path.isfile(history_file):
+            with open(history_file, 'r') as f:
+                history = json.load(f)
+            self.sites = history['sites']
+            self.games = [tuple(game_id) for game_id in history['games']]
+            self.site_codes = {site_name: code for code, site_name in enumerate(self.sites)}
+            self.game_codes = {game_id: code for code, game_id in enumerate(self.games)}
+            self.segments = [HistorySegment.open(os.path.join(self.history_dir, name)) for name in history['segments']]
+            self.next_segment = history['next_segment']
+        else:
+            os.makedirs(self.history_dir, exist_ok=True)
+
+        if self.segments and not self.segments[-1].meta['sealed']:
+            self.open_segment = self.segments[-1]
+
+    def code(self, codes, names, name):
+        if name not in codes:
+            codes[name] = len(names)
+            names.append(name)
+            self.dirty = True
+        return codes[name]
+
+    def append(self, games, timestamp, urls=None):
+        """
+        Record the prices of every site for each game
+
+        :param games: List of Game objects with a game_id
+        :param timestamp: float unix time the prices were seen
+        :param urls: optional set of String urls, only prices read from them are recorded
+        :return: int rows written
+        """
+        game_column = []
+        site_column = []
+        outcome_column = []
+        odds_rows = []
+        padding = (float('nan'),) * self.max_outcomes
+        with self.lock:
+            for game in games:
+                game_code = self.code(self.game_codes, self.games, game.game_id)
+                for site_odds in game.site_odds:
+                    if urls is not None and site_odds.url not in urls:
+                        continue
+                    game_column.append(game_code)
+                    site_column.append(self.code(self.site_codes, self.sites, site_odds.site.name))
+                    outcome_column.append(len(site_odds.odds))
+                    odds_rows.append(site_odds.odds + padding[len(site_odds.odds):])
+        if not game_column:
+            return 0
+
+        count = len(game_column)
+        columns = {'timestamp': np.full(count, timestamp, dtype=np.float64),
+                   'game': np.array(game_column, dtype=np.int32),
+                   'site': np.array(site_column, dtype=np.int16),
+                   'outcomes': np.array(outcome_column, dtype=np.int8),
+                   'odds': np.array(odds_rows, dtype=np.float64)}
+
+        written = 0
+        while written < count:
+            if self.open_segment is None or self.open_segment.rows == self.open_segment.meta['capacity']:
+                self.roll_segment()
+            room = self.open_segment.meta['capacity'] - self.open_segment.rows
+            self.open_segment.append(columns, written, min(count, written + room))
+            written = min(count, written + room)
+
+        self.open_segment.save_meta()
+        with self.lock:
+            if self.dirty:
+                self.save()
+        return count
+
+    def new_segment_path(self):
+        path = os.path.join(self.history_dir, 'segment-{:08d}'.format(self.next_segment))
+        self.next_segment += 1
+        return path
+
+    def roll_segment(self):
+        with self.lock:
+            if self.open_segment is not None:
+                self.open_segment.seal()
+            self.open_segment = HistorySegment.create(self.new_segment_path(), self.segment_rows)
+            self.segments.append(self.open_segment)
+            self.dirty = True
+            self.save()
+
+        unsorted = [segment for segment in self.segments if segment.meta['sealed'] and not segment.meta['sorted']]
+        if len(unsorted) >= self.compact_segments and (self.compaction is None or not self.compaction.is_alive()):
+            self.compaction = threading.Thread(target=self.compact, args=(unsorted,), daemon=True)
+            self.compaction.start()
+
+    def compact(self, segments):
+        """
+        Merge sealed segments into one segment ordered by game then timestamp and drop the originals
+
+        :param segments: List of sealed HistorySegment objects
+        :return: None
+        """
+        columns = {name: np.concatenate([segment.column(name) for segment in segments])
+                   for name in HistorySegment.dtypes}
+        order = np.lexsort((columns['timestamp'], columns['game']))
+        with self.lock:
+            path = self.new_segment_path()
+        merged = HistorySegment.create(path, len(order), sorted_rows=True)
+        merged.append({name: values[order] for name, values in columns.items()}, 0, len(order))
+        merged.seal()
+
+        with self.lock:
+            position = self.segments.index(segments[0])
+            self.segments = [segment for segment in self.segments if segment not in segments]
+            self.segments.insert(position, merged)
+            self.dirty = True
+            self.save()
+
+        for segment in segments:
+            segment.arrays = {}
+            shutil.rmtree(segment.path, ignore_errors=True)
+        if self.logger is not None:
+            self.logger.debug("ODDS_HISTORY: Compacted {} segments into {} rows".format(len(segments), len(order)))
+
+    def save(self):
+        temp_file = os.path.join(self.history_dir, 'history.json.tmp')
+        with open(temp_file, 'w') as f:
+            json.dump({'sites': self.sites, 'games': self.games, 'next_segment': self.next_segment,
+                       'segments': [os.path.basename(segment.path) for segment in self.segments]}, f)
+        os.replace(temp_file, os.path.join(self.history_dir, 'history.json'))
+        self.dirty = False
+
+    def query(self, game_id, start=None, end=None):
+        """
+        Every price recorded for a game in the time window [start, end)
+
+        :param game_id: game id the crawler matched the game under
+        :param start: optional float unix time
+        :param end: optional float unix time
+        :return: dict of 'timestamp', 'outcomes' and 'odds' numpy arrays and a 'site' list of site names, ordered by
+        timestamp. odds has max_outcomes columns, the ones past a row's outcomes are nan
+        """
+        game = self.game_codes.get(tuple(game_id))
+        with self.lock:
+            segments = list(self.segments)
+
+        parts = {name: [] for name in HistorySegment.dtypes}
+        if game is not None:
+            for segment in segments:
+                rows = segment.select(game, start, end)
+                if rows is None:
+                    continue
+                for name in HistorySegment.dtypes:
+                    parts[name].append(segment.column(name)[rows])
+
+        columns = {}
+        for name, dtype in HistorySegment.dtypes.items():
+            shape = (0, self.max_outcomes) if name == 'odds' else (0,)
+            columns[name] = np.concatenate(parts[name]) if parts[name] else np.empty(shape, dtype=dtype)
+        order = np.argsort(columns['timestamp'], kind='stable')
+        result = {name: columns[name][order] for name in ('timestamp', 'outcomes', 'odds')}
+        result['site'] = [self.sites[code] for code in columns['site'][order]]
+        return result
+
+    def close(self):
+        if self.compaction is not None:
+            self.compaction.join()
+        if self.open_segment is not None:
+            self.open_segment.flush()
+        with self.lock:
+            if self.dirty:
+                self.save()
+
+
+class PageRecording:
+    """
+    Page sources as the crawler fetched them, with the start time of their cycle and the time each one arrived, so a
+    run can be replayed without a browser. Pages are gzip files under <recording_dir>/<site name>/ and are listed in
+    fetch order in recording.jsonl
+    """
+
+    def __init__(self, recording_dir):
+        self.recording_dir = recording_dir
+        self.manifest_file = os.path.join(recording_dir, 'recording.jsonl')
+
+    def write(self, cycle_started, fetched_at, site_name, url, page_source):
+        """
+        :param cycle_started: float unix time the crawl cycle started
+        :param fetched_at: float unix time the page source arrived
+        :param site_name: String name of the site the page belongs to
+        :param url: String URL of the page
+        :param page_source: String HTML page source
+        :return: None
+        """
+        page_name = re.sub('[^A-Za-z0-9]+', '-', urlsplit(url).path).strip('-') or 'index'
+        file_name = os.path.join(site_name, '{}-{}.html.gz'.format(int(fetched_at * 1000), page_name))
+        os.makedirs(os.path.join(self.recording_dir, site_name), exist_ok=True)
+        with gzip.open(os.path.join(self.recording_dir, file_name), 'wt', encoding='utf-8') as f:
+            f.write(page_source)
+        with open(self.manifest_file, 'a') as f:
+            f.write(json.dumps({'cycle': cycle_started, 'time': fetched_at, 'site': site_name, 'url': url,
+                                'file': file_name}) + '\n')
+
+    def cycles(self):
+        """
+        :return: generator of (float cycle start time, List of (float fetch time, String site name, String url,
+        String file name) tuples) per recorded cycle
+        """
+        cycle_started = None
+        pages = []
+        with open(self.manifest_file, 'r') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['cycle'] != cycle_started and pages:
+                    yield cycle_started, pages
+                    pages = []
+                cycle_started = entry['cycle']
+                pages.append((entry['time'], entry['site'], entry['url'], entry['file']))
+        if pages:
+            yield cycle_started, pages
+
+    def read(self, file_name):
+        with gzip.open(os.path.join(self.recording_dir, file_name), 'rt', encoding='utf-8') as f:
+            return f.read()
+
+
+class CycleUpdate:
+    """
+    What changed in a crawl cycle, sent to the game watcher as one message. games holds the new games and the games
+    whose prices moved since the previous cycle, removed_game_ids the games no longer listed by at least two sites
+    """
+
+    def __init__(self, games, removed_game_ids=None, unchanged_count=0):
+        self.games = games
+        self.removed_game_ids = removed_game_ids if removed_game_ids is not None else []
+        self.unchanged_count = unchanged_count
+
+
+class EndOfStream:
+    """
+    Sent once through a Channel when the sending stage stops, so the receiving stage knows no more messages are coming
+    """
+
+    def __init__(self, reason="shutdown"):
+        self.reason = reason
+
+    def __repr__(self):
+        return "EndOfStream: {}".format(self.reason)
+
+
+class Channel:
+    """
+    Bounded queue between the pipeline processes. A CycleUpdate is shipped as a single message: the team names and
+    sites are pickled, and the odds and moneylines of every game travel as one float array, in shared memory when
+    the array is large. Senders block while max_messages are waiting, which keeps a slow stage from being buried.
+
+    The receiver unlinks a shared memory block once it has read it and acknowledges it on a second queue. The sender
+    remembers the blocks it has sent and unlinks the ones never acknowledged when it closes the channel.
+    """
+
+    def __init__(self, max_messages=0, shared_memory_threshold=65536, logger=None):
+        self.queue = Queue(maxsize=max_messages)
+        self.shared_memory_threshold = shared_memory_threshold
+        self.logger = logger
+        # names of the blocks this sender has sent and the receiver has not acknowledged yet
+        self.sent_blocks = set()
+        self.acknowledged_blocks = Queue()
+        if sys.version_info < (3, 13):
+            # blocks are tracked, start the resource tracker before the processes do so they all share this one
+            resource_tracker.ensure_running()
+
+    def put(self, item, timeout=None):
+        """
+        Send a message, a CycleUpdate is packed first. Blocks while the channel is full
+
+        :param item: CycleUpdate, Game or EndOfStream
+        :param timeout: optional float seconds to wait for room, raises queue.Full after it
+        :return: None
+        """
+        if isinstance(item, CycleUpdate):
+            item = self.pack_update(item)
+
+        try:
+            self.queue.put(item, block=False)
+        except queue.Full:
+            if self.logger is not None:
+                self.logger.debug("CHANNEL: Channel full, waiting for the receiver to catch up")
+            self.queue.put(item, timeout=timeout)
+
+    def get(self, timeout=None):
+        """
+        Receive the next message, packed CycleUpdates are rebuilt
+
+        :param timeout: optional float seconds to wait, raises queue.Empty after it
+        :return: CycleUpdate, Game or EndOfStream
+        """
+        item = self.queue.get(timeout=timeout)
+        if isinstance(item, PackedUpdate):
+            item = self.unpack_update(item)
+        return item
+
+    def close(self, reason="shutdown", timeout=5):
+        """
+        Tell the receiver this sender is done. Waits at most timeout seconds for room, if the receiver is stuck
+        the shutdown event will stop it instead
+
+        :param reason: String why the stream ended
+        :param timeout: float seconds to wait for room in a full channel
+        :return: None
+        """
+        try:
+            self.queue.put(EndOfStream(reason), timeout=timeout)
+        except queue.Full:
+            if self.logger is not None:
+                self.logger.debug("CHANNEL: Channel full, could not send end of stream")
+        self.unlink_sent_blocks(timeout)
+
+    def read_acknowledgements(self, timeout=None):
+        """
+        Forget the sent blocks the receiver has acknowledged
+
+        :param timeout: optional float seconds to wait for the outstanding blocks, None only reads what is there
+        :return: None
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while self.sent_blocks:
+            try:
+                if deadline is None:
+                    name = self.acknowledged_blocks.get(block=False)
+                else:
+                    name = self.acknowledged_blocks.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                return
+            self.sent_blocks.discard(name)
+
+    def unlink_sent_blocks(self, timeout):
+        """
+        Wait up to timeout seconds for the receiver to acknowledge the blocks still in the channel, then unlink the
+        ones it never read
+
+        :param timeout: float seconds to wait for acknowledgements
+        :return: None
+        """
+        self.read_acknowledgements(timeout)
+        for name in self.sent_blocks:
+            try:
+                block = self.open_block(name)
+            except FileNotFoundError:
+                continue
+            block.close()
+            block.unlink()
+        if self.sent_blocks and self.logger is not None:
+            self.logger.debug("CHANNEL: Unlinked %s shared memory blocks the receiver never read", len(self.sent_blocks))
+        self.sent_blocks.clear()
+
+    @staticmethod
+    def create_block(size):
+        if sys.version_info >= (3, 13):
+            return shared_memory.SharedMemory(create=True, size=size, track=False)
+        return shared_memory.SharedMemory(create=True, size=size)
+
+    @staticmethod
+    def open_block(name):
+        if sys.version_info >= (3, 13):
+            return shared_memory.SharedMemory(name=name, track=False)
+        return shared_memory.SharedMemory(name=name)
+
+    def qsize(self):
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:
+            return -1
+
+    def pack_update(self, cycle_update):
+        games = []
+        values = []
+        for game in cycle_update.games:
+            site_odds = []
+            for odds in game.site_odds:
+                site_odds.append((odds.site.name, odds.url, len(odds.odds)))
+                values.extend(odds.odds)
+                values.extend(float('nan') if ml is None else ml for ml in odds.moneylines)
+            games.append((game.team_1_name, game.team_2_name, game.game_id, game.league, game.time, game.date,
+                          game.start_time, game.timestamps, site_odds))
+
+        values = np.array(values, dtype=np.float64)
+        packed = PackedUpdate(games, cycle_update.removed_game_ids, cycle_update.unchanged_count)
+        if values.nbytes >= self.shared_memory_threshold:
+            self.read_acknowledgements()
+            block = self.create_block(values.nbytes)
+            np.ndarray(values.shape, dtype=np.float64, buffer=block.buf)[:] = values
+            packed.shared_memory_name = block.name
+            packed.value_count = len(values)
+            block.close()
+            self.sent_blocks.add(block.name)
+        else:
+            packed.values = values.tobytes()
+        return packed
+
+    def unpack_update(self, packed):
+        if packed.shared_memory_name is not None:
+            try:
+                block = self.open_block(packed.shared_memory_name)
+            except FileNotFoundError:
+                # the sender gave up waiting and unlinked it
+                if self.logger is not None:
+                    self.logger.debug("CHANNEL: ERROR shared memory block %s is gone, dropping %s games",
+                                      packed.shared_memory_name, len(packed.games))
+                return CycleUpdate([], packed.removed_game_ids, packed.unchanged_count)
+            values = np.ndarray((packed.value_count,), dtype=np.float64, buffer=block.buf).tolist()
+            block.close()
+            block.unlink()
+            self.acknowledged_blocks.put(packed.shared_memory_name)
+        else:
+            values = np.frombuffer(packed.values, dtype=np.float64).tolist()
+
+        games = []
+        position = 0
+        for team_1_name, team_2_name, game_id, league, game_time, game_date, start_time, timestamps, site_entries in \
+                packed.games:
+            game = Game(team_1_name, team_2_name)
+            game.game_id = game_id
+            game.league = league
+            game.time = game_time
+            game.date = game_date
+            game.start_time = start_time
+            game.timestamps = timestamps
+            for site_name, url, outcome_count in site_entries:
+                odds = tuple(values[position:position + outcome_count])
+                moneylines = tuple(None if ml != ml else int(ml)
+                                   for ml in values[position + outcome_count:position + 2 * outcome_count])
+                position += 2 * outcome_count
+                # the prices were checked when they were parsed, restore them the way unpickling does
+                site_odds = SiteOdds.__new__(SiteOdds)
+                site_odds.__setstate__((site_name, moneylines, odds, url))
+                game.site_odds.append(site_odds)
+            games.append(game)
+
+        return CycleUpdate(games, packed.removed_game_ids, packed.unchanged_count)
+
+
+class PackedUpdate:
+    """
+    Wire form of a CycleUpdate made by Channel.pack_update, the float values are either inline bytes or in a named
+    shared memory block
+    """
+
+    def __init__(self, games, removed_game_ids, unchanged_count):
+        self.games = games
+        self.removed_game_ids = removed_game_ids
+        self.unchanged_count = unchanged_count
+        self.values = None
+        self.shared_memory_name = None
+        self.value_count = 0
+
+
+class OddsTracker:
+    """
+    Remembers the prices of every game from the previous crawl cycle so only games whose prices changed need to be
+    queued and analyzed again. Games matched under the same game_id, like the two games of a double header, are tracked
+    as one entry and queued together when any of their prices moves
+    """
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.previous_prices = {}
+
+    @staticmethod
+    def price_signature(game):
+        return tuple(sorted((site_odds.site.name, site_odds.odds) for site_odds in game.site_odds))
+
+    def update(self, games):
+        """
+        Compare this cycle's games to the previous cycle and remember them for the next one
+
+        :param games: List of Game objects with a game_id
+        :return: CycleUpdate with the new and changed games
+        """
+        games_by_id = defaultdict(list)
+        for game in games:
+            games_by_id[game.game_id].append(game)
+
+        current_prices = {}
+        changed_game_ids = set()
+        unchanged_count = 0
+        collisions = 0
+        for game_id, id_games in games_by_id.items():
+            collisions += len(id_games) - 1
+            signature = tuple(sorted(self.price_signature(game) for game in id_games))
+            current_prices[game_id] = signature
+            if self.previous_prices.get(game_id) == signature:
+                unchanged_count += len(id_games)
+            else:
+                changed_game_ids.add(game_id)
+        if collisions and self.metrics is not None:
+            self.metrics.increment('game_id_collisions', collisions)
+
+        changed = [game for game in games if game.game_id in changed_game_ids]
+        removed_game_ids = [game_id for game_id in self.previous_prices if game_id not in current_prices]
+        self.previous_prices = current_prices
+
+        return CycleUpdate(changed, removed_game_ids, unchanged_count)
+
+
+class GameMatcher:
+    """
+    Collects the games found in a crawl cycle and merges games from different sites that are the same event.
+
+    When a team registry is given, games whose team names have both been seen before are matched by their canonical
+    team ids with a dictionary lookup. Otherwise two games are the same when both team names score above
+    difference_parameter with fuzz.token_set_ratio. Rather than scoring a new game against every collected game, only
+    the games that could score above the threshold on both team names are scored: names sharing a processed token
+    share a blocking key (the token, broken into character trigrams), and names sharing none are kept when their
+    character counts leave room for a score above the threshold. A game is merged into its single best match, the same
+    one scoring every collected game would find.
+    """
+
+    # the characters fuzz_utils.full_process leaves in an ascii name, anything else is counted in one extra column
+    characters = " _0123456789abcdefghijklmnopqrstuvwxyz"
+    character_columns = {character: column for column, character in enumerate(characters)}
+
+    def __init__(self, difference_parameter, team_registry=None):
+        self.difference_parameter = difference_parameter
+        self.team_registry = team_registry
+        self.games = []
+        self.game_ids = []
+        self.games_by_id = {}
+        self.team_1_index = defaultdict(set)
+        self.team_2_index = defaultdict(set)
+        # per team, the character counts and lengths of the sorted token strings of the collected games, grown by
+        # doubling
+        self.team_counts = [np.zeros((64, len(self.characters) + 1), dtype=np.int16) for team in range(2)]
+        self.team_lengths = [np.zeros(64, dtype=np.int32) for team in range(2)]
+
+    @staticmethod
+    def blocking_keys(team_name):
+        """
+        Cheap keys for a team name, names sharing a token processed the way token_set_ratio processes it share a key
+
+        :param team_name: String team name as parsed from the site
+        :return: set of String keys
+        """
+        keys = set()
+        for token in fuzz_utils.full_process(team_name, force_ascii=True).split():
+            if len(token) <= 3:
+                keys.add(token)
+            else:
+                keys.update(token[i:i + 3] for i in range(len(token) - 2))
+        return keys
+
+    @classmethod
+    def character_counts(cls, team_name):
+        """
+        Character counts of the string token_set_ratio scores a team name by against a name it shares no token with,
+        its processed tokens sorted and joined by spaces
+
+        :param team_name: String team name as parsed from the site
+        :return: (numpy array of counts per column, int length) tuple
+        """
+        tokens = " ".join(sorted(set(fuzz_utils.full_process(team_name, force_ascii=True).split())))
+        counts = np.zeros(len(cls.characters) + 1, dtype=np.int16)
+        for character, count in Counter(tokens).items():
+            counts[cls.character_columns.get(character, len(cls.characters))] += count
+        return counts, len(tokens)
+
+    def candidates(self, game):
+        """
+        Positions of the collected games that could score above difference_parameter with game on both team names.
+
+        Names without a common token score the ratio of their sorted token strings, 2 * matches / total length, and
+        the matching characters are at most the characters the strings have in common. A score, rounded to an int,
+        can only be above the threshold when 400 * common characters >= (2 * threshold + 1) * total length.
+
+        :param game: Game object
+        :return: sorted List of int positions in self.games
+        """
+        count = len(self.games)
+        positions = np.arange(count)
+        threshold = 2 * int(self.difference_parameter) + 1
+        for team_index, team_counts, team_lengths, team_name in (
+                (self.team_1_index, self.team_counts[0], self.team_lengths[0], game.team_1_name),
+                (self.team_2_index, self.team_counts[1], self.team_lengths[1], game.team_2_name)):
+            if not len(positions):
+                break
+            shared = np.zeros(count, dtype=bool)
+            for key in self.blocking_keys(team_name):
+                shared[list(team_index.get(key, ()))] = True
+
+            counts, length = self.character_counts(team_name)
+            common = np.minimum(team_counts[positions], counts).sum(axis=1, dtype=np.int32)
+            possible = 400 * common >= threshold * (team_lengths[positions] + length)
+            positions = positions[shared[positions] | possible]
+        return positions.tolist()
+
+    def find_matches(self, game):
+        """
+        All collected games that game is considered the same as
+
+        :param game: Game object
+        :return: List of (int position, int team 1 score, int team 2 score) tuples
+        """
+        matches = []
+        for position in self.candidates(game):
+            existing_game = self.games[position]
+            if game.league is not None and existing_game.league is not None and game.league != existing_game.league:
+                continue
+            team_1_score = fuzz.token_set_ratio(game.team_1_name, existing_game.team_1_name)
+            if team_1_score <= self.difference_parameter:
+                continue
+            team_2_score = fuzz.token_set_ratio(game.team_2_name, existing_game.team_2_name)
+            if team_2_score <= self.difference_parameter:
+                continue
+            matches.append((position, team_1_score, team_2_score))
+        return matches
+
+    def add(self, game, game_id):
+        position = len(self.games)
+        game.game_id = game_id
+        self.games.append(game)
+        self.game_ids.append(game_id)
+        self.games_by_id.setdefault(game_id, game)
+        for key in self.blocking_keys(game.team_1_name):
+            self.team_1_index[key].add(position)
+        for key in self.blocking_keys(game.team_2_name):
+            self.team_2_index[key].add(position)
+
+        if position == len(self.team_lengths[0]):
+            self.team_counts = [np.concatenate((team_counts, np.zeros_like(team_counts)))
+                                for team_counts in self.team_counts]
+            self.team_lengths = [np.concatenate((team_lengths, np.zeros_like(team_lengths)))
+                                 for team_lengths in self.team_lengths]
+        for team, team_name in enumerate((game.team_1_name, game.team_2_name)):
+            self.team_counts[team][position], self.team_lengths[team][position] = self.character_counts(team_name)
+
+    def merge(self, game, logger=None):
+        """
+        Add the site odds of game to the collected game it is the same event as, or collect it as a new game
+
+        :param game: Game object found on a site
+        :param logger: optional Logger for match details
+        :return: True if game was merged into an existing game, False if it was added
+        """
+        site_name = game.site_odds[0].site.name
+        team_1_id = team_2_id = None
+        if self.team_registry is not None:
+            team_1_id = self.team_registry.lookup(site_name, game.team_1_name)
+            team_2_id = self.team_registry.lookup(site_name, game.team_2_name)
+
+            if team_1_id is not None and team_2_id is not None:
+                existing_game = self.games_by_id.get((team_1_id, team_2_id))
+                if existing_game is None:
+                    self.add(game, (team_1_id, team_2_id))
+                    return False
+                if logger is not None:
+                    logger.debug("CRAWLER: Registry matched %s vs. %s to %s vs. %s",
+                                 game.team_1_name, game.team_2_name, team_1_id, team_2_id)
+                existing_game.site_odds = existing_game.site_odds + game.site_odds
+                return True
+
+        matches = self.find_matches(game)
+        if not matches:
+            game_id = (team_1_id or game.team_1_name, team_2_id or game.team_2_name)
+            self.register_teams(site_name, game, game_id)
+            self.add(game, game_id)
+            return False
+
+        position, team_1_score, team_2_score = max(matches, key=lambda match: match[1] + match[2])
+        existing_game = self.games[position]
+        if logger is not None:
+            logger.debug("CRAWLER: We determined that %s was the same as %s with confidence %s and %s was the same as %s with confidence %s",
+                         game.team_1_name, existing_game.team_1_name, team_1_score,
+                         game.team_2_name, existing_game.team_2_name, team_2_score)
+            logger.debug("Adding odds information to the existing game")
+        existing_game.site_odds = existing_game.site_odds + game.site_odds
+        self.register_teams(site_name, game, self.game_ids[position])
+        return True
+
+    def register_teams(self, site_name, game, game_id):
+        if self.team_registry is None:
+            return
+        self.team_registry.register(site_name, game.team_1_name, game_id[0])
+        self.team_registry.register(site_name, game.team_2_name, game_id[1])
+
+
+class CrawlScheduler:
+    """
+    Decides when each url is crawled next. Urls wait in a heap keyed by the time they are due. After every fetch a
+    url's interval shrinks from max_interval towards min_interval the more its prices move between fetches, the more
+    of its games are live or starting soon, and the more recently one of its games was an arbitrage opportunity. No site
+    is fetched more than pages_per_minute times in any minute, the hottest due urls are fetched first and the rest wait
+    for a free slot. With adaptive off every url is crawled every max_interval, like the fixed cycles of old
+    """
+
+    # how strongly each signal, from 0 to 1, divides the interval
+    volatility_weight = 8
+    starting_weight = 4
+    arb_weight = 8
+    # urls due this close together are fetched in the same cycle
+    batch_seconds = 2.0
+
+    def __init__(self, min_interval, max_interval, pages_per_minute=0, hot_start_seconds=3 * 3600,
+                 arb_hot_seconds=1800, adaptive=True, metrics=None, logger=None):
+        """
+        :param min_interval: float seconds, the shortest interval of a url
+        :param max_interval: float seconds, the interval of a url whose prices never move
+        :param pages_per_minute: int most fetches of one site in any minute, 0 for no limit
+        :param hot_start_seconds: float seconds before a game starts that its url becomes hot
+        :param arb_hot_seconds: float seconds an arbitrage opportunity keeps its url hot
+        :param adaptive: Boolean, False crawls every url every max_interval
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.pages_per_minute = pages_per_minute
+        self.hot_start_seconds = hot_start_seconds
+        self.arb_hot_seconds = arb_hot_seconds
+        self.adaptive = adaptive
+        self.metrics = metrics
+        self.logger = logger
+
+        # (due time, sequence, url) entries, urls being fetched are not in the heap
+        self.heap = []
+        self.sequence = itertools.count()
+        # sequence of each url's live heap entry, entries of removed urls are left in the heap and skipped
+        self.entries = {}
+        self.sites = {}
+        self.intervals = {}
+        self.volatility = {}
+        self.starting = {}
+        self.last_arb = {}
+        self.prices = {}
+        # fetch time of the urls parsed since they were taken by due
+        self.fetched_at = {}
+        # recent fetch times of each site name
+        self.site_fetches = defaultdict(deque)
+
+    def add(self, site, url, due):
+        self.sites[url] = site
+        self.intervals[url] = self.max_interval
+        self.volatility[url] = 0.0
+        self.starting[url] = 0.0
+        self.push(url, due)
+
+    def remove(self, url):
+        """
+        Stop crawling a url, a fetch of it already under way is not rescheduled
+
+        :param url: String url added before
+        """
+        for state in (self.sites, self.intervals, self.volatility, self.starting, self.last_arb, self.prices,
+                      self.entries):
+            state.pop(url, None)
+
+    def push(self, url, due):
+        sequence = next(self.sequence)
+        self.entries[url] = sequence
+        heapq.heappush(self.heap, (due, sequence, url))
+
+    def next_due(self):
+        while self.heap and self.entries.get(self.heap[0][2]) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def due(self, now):
+        """
+        Take the urls due by now, or within batch_seconds of it, that their site's budget allows
+
+        :param now: float unix time
+        :return: List of (Site, String url) tuples to fetch, each must be handed back to reschedule
+        """
+        ready = []
+        while self.heap and self.heap[0][0] <= now + self.batch_seconds:
+            entry = heapq.heappop(self.heap)
+            if self.entries.get(entry[2]) == entry[1]:
+                ready.append(entry)
+        # when a site's budget runs out its hottest urls are the ones fetched
+        ready.sort(key=lambda entry: (self.intervals[entry[2]], entry[0]))
+
+        jobs = []
+        deferred = []
+        for due, sequence, url in ready:
+            site = self.sites[url]
+            fetches = self.site_fetches[site.name]
+            while fetches and fetches[0] <= now - 60:
+                fetches.popleft()
+            if self.pages_per_minute and len(fetches) >= self.pages_per_minute:
+                # wait for the site's oldest fetch in the minute to age out
+                deferred.append((fetches[0] + 60, sequence, url))
+                if self.metrics is not None:
+                    self.metrics.increment('pages_deferred')
+                continue
+            fetches.append(now)
+            jobs.append((site, url))
+        for entry in deferred:
+            heapq.heappush(self.heap, entry)
+        return jobs
+
+    def observe(self, url, games, fetched_at):
+        """
+        Update a url's price volatility and share of games starting soon from the games just parsed from it
+
+        :param url: String url
+        :param games: List of Game objects parsed from the page
+        :param fetched_at: float unix time the page was fetched
+        """
+        prices = {(game.team_1_name, game.team_2_name): tuple(site_odds.odds for site_odds in game.site_odds)
+                  for game in games}
+        previous = self.prices.get(url)
+        if previous is not None:
+            common = [key for key in prices if key in previous]
+            moved = sum(1 for key in common if prices[key] != previous[key])
+            # halve the weight of older fetches each time
+            moved_share = moved / len(common) if common else 0.0
+            self.volatility[url] = 0.5 * self.volatility.get(url, 0.0) + 0.5 * moved_share
+        self.prices[url] = prices
+        self.fetched_at[url] = fetched_at
+
+        starting = sum(1 for game in games
+                       if game.start_time is not None and game.start_time - fetched_at <= self.hot_start_seconds)
+        self.starting[url] = starting / len(games) if games else 0.0
+
+    def observe_arb(self, urls, found_at):
+        """
+        Mark the urls pricing a game as hot after an arbitrage opportunity was found on it
+
+        :param urls: iterable of String urls the game's prices were read from
+        :param found_at: float unix time the opportunity was found
+        """
+        for url in urls:
+            if url in self.sites:
+                self.last_arb[url] = found_at
+
+    def interval(self, url, now):
+        """
+        :return: float seconds until the url should be fetched again
+        """
+        if not self.adaptive:
+            return self.max_interval
+        arb_heat = 0.0
+        if url in self.last_arb:
+            arb_heat = max(0.0, 1 - (now - self.last_arb[url]) / self.arb_hot_seconds)
+        heat = self.volatility_weight * self.volatility[url] + self.starting_weight * self.starting[url] + \
+            self.arb_weight * arb_heat
+        return max(self.min_interval, self.max_interval / (1 + heat))
+
+    def reschedule(self, jobs, now):
+        """
+        Put the urls taken by due back in the heap, each due its interval after it was fetched
+
+        :param jobs: List of (Site, String url) tuples from due
+        :param now: float unix time the cycle finished, used for urls that failed to fetch
+        """
+        for site, url in jobs:
+            if url not in self.sites:
+                # removed while it was being fetched
+                self.fetched_at.pop(url, None)
+                continue
+            interval = self.interval(url, now)
+            self.intervals[url] = interval
+            if self.metrics is not None:
+                self.metrics.observe('crawl_interval_seconds', interval)
+            # a url that failed to fetch is tried again an interval from now
+            fetched_at = self.fetched_at.pop(url, None)
+            due = now + interval if fetched_at is None else max(now, fetched_at + interval)
+            if self.logger is not None:
+                self.logger.debug("CRAWL_SCHEDULER: %s next in %.0f seconds, volatility %.2f, starting %.2f", url,
+                                  due - now, self.volatility[url], self.starting[url])
+            self.push(url, due)
+
+
+def parse_page_job(job):
+    """
+    Parse one fetched page in a ParsePool worker, the Site is the worker's copy of the crawler's
+
+    :param job: (String site name, String url, String page source or None) tuple
+    :return: (List of Game objects or None, float seconds spent parsing) tuple
+    """
+    site_name, url, page_source = job
+    if page_source is None:
+        return None, 0.0
+    started = time.time()
+    games = Site.registry[site_name].parse_page(page_source, url)
+    return games, time.time() - started
+
+
+def init_parse_worker():
+    # a worker killed while it holds the pool's task queue lock hangs the pool, so a SIGTERM or Ctrl-C sent to the
+    # whole process group is left to the crawler, which closes the pool
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class ParsePool:
+    """
+    Worker processes that parse fetched pages while the fetchers carry on and the crawler matches the pages already
+    parsed. Pages go to the workers as they are fetched and their games stream back in the same order. At most
+    max_pending pages are waiting for or being parsed by the workers, past that the fetched pages wait in the
+    fetchers. With no workers the pages are parsed in the calling process as they are read. The workers are forked,
+    so the pool has to be started after the sites are made and before the process starts any threads of its own
+    """
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pool = multiprocessing.get_context("fork").Pool(workers, init_parse_worker) if workers else None
+        self.free_slots = None
+        self.closing = False
+
+    def parse_all(self, fetched_pages):
+        """
+        :param fetched_pages: iterable of (Site, String url, String page source or None) tuples
+        :return: iterator of (Site, String url, String page source or None, float unix time the page was fetched,
+        List of Game objects or None, float seconds spent parsing) tuples
+        """
+        if self.pool is None:
+            for site, url, page_source in fetched_pages:
+                fetched_at = time.time()
+                games, seconds = parse_page_job((site.name, url, page_source))
+                yield site, url, page_source, fetched_at, games, seconds
+            return
+
+        free_slots = self.free_slots = threading.Semaphore(self.max_pending)
+        pending = deque()
+
+        def jobs():
+            # runs on the pool's task thread, which blocks here once max_pending pages are out
+            for site, url, page_source in fetched_pages:
+                free_slots.acquire()
+                if self.closing:
+                    return
+                pending.append((site, url, page_source, time.time()))
+                yield site.name, url, page_source
+
+        for games, seconds in self.pool.imap(parse_page_job, jobs()):
+            site, url, page_source, fetched_at = pending.popleft()
+            free_slots.release()
+            yield site, url, page_source, fetched_at, games, seconds
+
+    def close(self, wait=True):
+        """
+        :param wait: Boolean, let the workers finish, False stops a cycle part way and the pages the workers already
+        have are parsed and dropped
+        """
+        if self.pool is None:
+            return
+        if not wait:
+            # a cycle that stopped part way leaves the task thread waiting for a free slot
+            self.closing = True
+            if self.free_slots is not None:
+                self.free_slots.release()
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+
+
+def shard_address(address):
+    """
+    :param address: String "host:port" to use TCP, anything else is the path of a unix socket
+    :return: address for multiprocessing.connection
+    """
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit():
+        return host, int(port)
+    return address
+
+
+class HashRing:
+    """
+    Consistent hashing of urls onto the crawler nodes of a sharded crawl. Each node has replicas points on a ring of
+    64 bit hashes and a url belongs to the node with the first point after the url's hash, so when a node joins or
+    leaves only the urls next to its points change owner, about one in every number of nodes
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        # sorted hashes of every node's points, and the node at each
+        self.points = []
+        self.owners = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = self.hash("{}#{}".format(node, replica))
+            if point not in self.owners:
+                bisect.insort(self.points, point)
+            self.owners[point] = node
+
+    def remove(self, node):
+        for replica in range(self.replicas):
+            point = self.hash("{}#{}".format(node, replica))
+            if self.owners.get(point) == node:
+                del self.owners[point]
+                del self.points[bisect.bisect_left(self.points, point)]
+
+    def owner(self, key):
+        """
+        :param key: String url
+        :return: the node the url belongs to, None with no nodes
+        """
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.owners[self.points[index]]
+
+    def assignments(self, keys):
+        """
+        :param keys: iterable of String urls
+        :return: dict of node to List of the urls it owns
+        """
+        assigned = defaultdict(list)
+        for key in keys:
+            owner = self.owner(key)
+            if owner is not None:
+                assigned[owner].append(key)
+        return assigned
+
+
+class ShardAggregator:
+    """
+    The aggregator's end of a sharded crawl. Crawler nodes connect to address and join under their name, the urls are
+    shared out between the nodes connected with a HashRing, and shared out again whenever a node joins or leaves. The
+    parsed pages the nodes send wait here until the aggregator takes them with receive. Each node has a thread reading
+    its connection. The transport is multiprocessing.connection, over TCP or a unix socket depending on the address,
+    and only peers that know authkey are accepted, the messages are pickled
+    """
+
+    def __init__(self, address, authkey, urls, replicas=100, logger=None, metrics=None):
+        """
+        :param address: address to listen on from shard_address
+        :param authkey: bytes secret shared with the nodes
+        :param urls: List of String urls to share out
+        :param replicas: int points each node has on the hash ring
+        """
+        self.urls = urls
+        self.ring = HashRing(replicas=replicas)
+        self.logger = logger
+        self.metrics = metrics
+        # node name to its connection, sends to the nodes are made holding the lock
+        self.nodes = {}
+        self.owners = {}
+        self.lock = threading.Lock()
+        # lists of (String site name, String url, float unix time fetched, List of Game objects) tuples, one per message
+        self.pages = queue.Queue()
+        self.closed = False
+        self.authkey = authkey
+        self.listener = Listener(address, authkey=authkey)
+        self.accept_thread = threading.Thread(target=self.accept_loop, daemon=True)
+        self.accept_thread.start()
+        self.node_threads = []
+
+    def accept_loop(self):
+        while not self.closed:
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                if not self.closed:
+                    self.logger.debug("AGGREGATOR: Refused a connection: {}".format(e))
+                continue
+            if self.closed:
+                connection.close()
+                return
+            node_thread = threading.Thread(target=self.node_loop, args=(connection,), daemon=True)
+            node_thread.start()
+            self.node_threads = [thread for thread in self.node_threads if thread.is_alive()] + [node_thread]
+
+    def node_loop(self, connection):
+        """
+        Read one node's messages until it leaves or its connection is lost
+        """
+        name = None
+        try:
+            message = connection.recv()
+            if message[0] != 'join':
+                return
+            name = message[1]
+            self.join(name, connection)
+            while True:
+                message = connection.recv()
+                if message[0] == 'pages':
+                    self.pages.put(message[1])
+                elif message[0] == 'leave':
+                    break
+        except (OSError, EOFError):
+            # the node went away, or join or close shut the connection down
+            pass
+        except Exception as e:
+            self.logger.debug("AGGREGATOR: ERROR reading from node {}".format(name))
+            traceback.print_exc()
+        finally:
+            if name is not None:
+                self.leave(name, connection)
+            connection.close()
+
+    def join(self, name, connection):
+        with self.lock:
+            previous = self.nodes.get(name)
+            if previous is not None:
+                # the node connected again before its old connection was noticed to be gone
+                self.shut_down(previous)
+            self.nodes[name] = connection
+            self.ring.add(name)
+            self.logger.debug("AGGREGATOR: Node %s joined", name)
+            self.rebalance()
+
+    def leave(self, name, connection):
+        with self.lock:
+            if self.nodes.get(name) is not connection:
+                return
+            del self.nodes[name]
+            self.ring.remove(name)
+            self.logger.debug("AGGREGATOR: Node %s left", name)
+            self.rebalance()
+
+    def rebalance(self):
+        """
+        Share the urls out between the nodes connected and send each node its urls, called holding the lock
+        """
+        assignments = self.ring.assignments(self.urls)
+        owners = {url: name for name, urls in assignments.items() for url in urls}
+        moved = sum(1 for url in self.urls if owners.get(url) != self.owners.get(url))
+        self.owners = owners
+        for name, connection in list(self.nodes.items()):
+            self.send(name, connection, ('assign', assignments.get(name, [])))
+        if self.metrics is not None:
+            self.metrics.set('shard_nodes', len(self.nodes))
+        self.logger.debug("AGGREGATOR: {} urls moved, {} nodes: {}".format(
+            moved, len(self.nodes), ", ".join("{} {}".format(name, len(assignments.get(name, [])))
+                                             for name in sorted(self.nodes))))
+
+    def send(self, name, connection, message):
+        try:
+            connection.send(message)
+        except OSError as e:
+            # its node_loop sees the connection is gone and the node leaves
+            self.logger.debug("AGGREGATOR: Could not send to node {}: {}".format(name, e))
+
+    def send_arb(self, urls, found_at):
+        """
+        Tell the nodes crawling the urls of an arbitrage opportunity, so their schedulers keep the urls hot
+
+        :param urls: iterable of String urls the game's prices were read from
+        :param found_at: float unix time the opportunity was found
+        """
+        with self.lock:
+            by_node = defaultdict(list)
+            for url in urls:
+                if url in self.owners:
+                    by_node[self.owners[url]].append(url)
+            for name, node_urls in by_node.items():
+                self.send(name, self.nodes[name], ('arb', node_urls, found_at))
+
+    def receive(self, timeout):
+        """
+        Wait up to timeout for pages from the nodes, then take every page already waiting
+
+        :param timeout: float seconds
+        :return: List of (String site name, String url, float unix time fetched, List of Game objects) tuples
+        """
+        pages = []
+        try:
+            pages.extend(self.pages.get(timeout=timeout))
+            while True:
+                pages.extend(self.pages.get_nowait())
+        except queue.Empty:
+            return pages
+
+    @staticmethod
+    def shut_down(connection):
+        """
+        Wake the node_loop reading a connection, which then closes it. Closing it from another thread would not wake
+        the reader, which would go on to read whatever socket reuses the file descriptor
+        """
+        try:
+            with socket.socket(fileno=os.dup(connection.fileno())) as node_socket:
+                node_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self, timeout=5):
+        """
+        Stop accepting nodes and close every connection. Closing a socket does not wake a thread blocked on it, which
+        would go on to use whatever socket reuses the file descriptor. So the accept loop is woken by a connection of
+        our own and the node connections are shut down, and every thread is joined before this returns
+
+        :param timeout: float seconds to wait for each thread
+        :return: None
+        """
+        self.closed = True
+        try:
+            Client(self.listener.address, authkey=self.authkey).close()
+        except (OSError, EOFError, AuthenticationError) as e:
+            self.logger.debug("AGGREGATOR: Could not wake the accept loop: {}".format(e))
+        self.accept_thread.join(timeout)
+        if self.accept_thread.is_alive():
+            self.logger.debug("AGGREGATOR: ERROR the accept loop did not stop")
+        self.listener.close()
+        with self.lock:
+            for connection in self.nodes.values():
+                self.shut_down(connection)
+            self.nodes = {}
+        for node_thread in self.node_threads:
+            node_thread.join(timeout)
+
+
+class ShardNode:
+    """
+    A crawler node's end of a sharded crawl. Joins the aggregator under the node's name, then receives the urls the
+    node owns whenever they change and the urls of arbitrage opportunities, and sends the pages it parses
+    """
+
+    def __init__(self, address, authkey, name):
+        self.connection = Client(address, authkey=authkey)
+        self.connection.send(('join', name))
+
+    def send_pages(self, pages):
+        """
+        :param pages: List of (String site name, String url, float unix time fetched, List of Game objects) tuples
+        """
+        self.connection.send(('pages', pages))
+
+    def receive(self, timeout):
+        """
+        Wait up to timeout for a message from the aggregator, then take every message already waiting
+
+        :param timeout: float seconds
+        :return: List of ('assign', List of String urls) and ('arb', List of String urls, float unix time found) tuples
+        """
+        messages = []
+        while self.connection.poll(0 if messages else timeout):
+            messages.append(self.connection.recv())
+        return messages
+
+    def close(self):
+        try:
+            self.connection.send(('leave',))
+        except OSError:
+            pass
+        self.connection.close()
+
+
+class LoopQueue:
+    """
+    put() for code running in executor threads, hands each item to an asyncio.Queue on the event loop's thread. Lets
+    the analysis methods place arbitrage opportunities on the runtime's arb queue the same way they do on a Channel
+    """
+
+    def __init__(self, loop, async_queue):
+        self.loop = loop
+        self.async_queue = async_queue
+
+    def put(self, item):
+        self.loop.call_soon_threadsafe(self.async_queue.put_nowait, item)
+
+
+class AsyncRuntime:
+    """
+    Runs the crawler, game watcher and arbitrage actioner as asyncio tasks on one event loop in the main process,
+    in place of three processes joined by Channels. The loop only coordinates: page loads run in a thread pool,
+    parsing in the ParsePool's worker processes, matching and analysis in executor threads. Cycles and arbitrage
+    opportunities are passed on asyncio queues as they are, nothing is pickled, and the command line is read from
+    stdin by the loop instead of a blocking input().
+
+    The exit command, SIGTERM and SIGINT shut down in pipeline order: the crawl task is cancelled, which drops the
+    page loads of its cycle that have not started, the cycles and opportunities already queued are analyzed and
+    actioned, then the other tasks are cancelled and the fetchers, parse pool and odds history are closed once the
+    threads using them are done. A task that fails stops the runtime the same way and the error is emailed.
+    """
+
+    stop_signals = (signal.SIGTERM, signal.SIGINT)
+
+    def __init__(self, arb_crawler):
+        self.arb_crawler = arb_crawler
+        self.logger = arb_crawler.logger
+        self.loop = None
+        self.stopping = None
+        self.stop_reason = None
+        self.failed = None
+        self.cycle_queue = None
+        self.arb_queue = None
+        # urls of the arbitrage opportunities actioned, read by the crawl task's scheduler before each cycle
+        self.arb_urls = deque()
+        self.fetch_executor = None
+        self.cycle_executor = None
+        self.analysis_executor = None
+        self.profiler = None
+        self.stdin_buffer = b""
+
+    def run(self):
+        """
+        Run until exit, SIGTERM, SIGINT or an error, everything is closed when this returns
+
+        :return: None
+        """
+        asyncio.run(self.supervise())
+
+    def stop(self, reason):
+        if self.stopping.is_set():
+            self.logger.debug("RUNTIME: Already shutting down, ignoring %s", reason)
+            return
+        self.stop_reason = reason
+        self.stopping.set()
+
+    async def supervise(self):
+        """
+        Start the tasks, wait for the runtime to be stopped and shut it down in pipeline order
+        """
+        crawler = self.arb_crawler
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.cycle_queue = asyncio.Queue(crawler.game_queue_max_cycles)
+        self.arb_queue = asyncio.Queue()
+        # status reports the runtime's queues and the profile commands go to its one profiler
+        crawler.game_queue, crawler.arb_queue = self.cycle_queue, self.arb_queue
+        crawler.control_queues = {'runtime': queue.Queue()}
+
+        tasks = []
+        try:
+            # forks the parse workers, before the runtime starts any threads or takes over the signals
+            if crawler.shard_role == 'aggregator':
+                crawler.open_aggregator()
+            else:
+                crawler.open_crawler()
+                crawler.open_matching()
+                crawler.schedule_pages()
+            self.profiler = crawler.start_profiler('runtime')
+            crawler.serve_metrics()
+            fetch_slots = sum(fetcher.size for fetcher in (crawler.driver_pool, crawler.http_fetcher)
+                              if fetcher is not None)
+            self.fetch_executor = ThreadPoolExecutor(max(1, fetch_slots), thread_name_prefix="fetch")
+            self.cycle_executor = ThreadPoolExecutor(1, thread_name_prefix="cycle")
+            self.analysis_executor = ThreadPoolExecutor(5, thread_name_prefix="analysis")
+            for signum in self.stop_signals:
+                self.loop.add_signal_handler(signum, self.stop, signal.Signals(signum).name)
+
+            if crawler.shard_role == 'aggregator':
+                crawl = self.start_task(self.aggregate(), "aggregator")
+            else:
+                crawl = self.start_task(self.crawl(), "crawler")
+            analysis = self.start_task(self.analysis_dispatcher(), "game watcher")
+            notifications = self.start_task(self.notifications(), "arbitrage actioner")
+            tasks = [crawl, analysis, notifications, self.start_task(self.command_line(), "command line"),
+                     self.start_task(self.metrics_reporter(), "metrics reporter")]
+            self.logger.debug("RUNTIME: ArbCrawler started, tasks running...")
+
+            await self.stopping.wait()
+            self.logger.debug("RUNTIME: Shutting down: %s", self.stop_reason)
+            crawl.cancel()
+            await asyncio.wait([crawl])
+            await self.drain(self.cycle_queue, analysis)
+            await self.drain(self.arb_queue, notifications)
+        except Exception as e:
+            self.logger.debug("RUNTIME: ERROR in the runtime")
+            traceback.print_exc()
+            self.failed = "runtime"
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for signum in self.stop_signals:
+            self.loop.remove_signal_handler(signum)
+        self.close()
+
+        if self.failed is not None:
+            crawler.send_error_notification()
+        self.logger.debug("RUNTIME: Runtime stopped")
+
+    def start_task(self, coroutine, name):
+        return self.loop.create_task(self.supervised(coroutine, name))
+
+    async def supervised(self, coroutine, name):
+        """
+        Run one of the runtime's tasks, a task that fails shuts the runtime down
+
+        :param coroutine: the task's coroutine
+        :param name: String name of the stage the task runs, for the log and the shutdown reason
+        :return: None
+        """
+        try:
+            await coroutine
+        except Exception as e:
+            self.logger.debug("RUNTIME: ERROR in the {}".format(name))
+            traceback.print_exc()
+            self.failed = name
+            self.stop("{} error".format(name))
+
+    async def drain(self, async_queue, consumer):
+        """
+        Wait until the consumer task has taken everything queued off the queue, or has stopped itself
+        """
+        joined = asyncio.ensure_future(async_queue.join())
+        await asyncio.wait([joined, consumer], return_when=asyncio.FIRST_COMPLETED)
+        joined.cancel()
 
-        game.arbitrage_opportunity = self.arbitrage_opportunity
-        game.margin = self.margin
-        game.wager_ratio_1 = self.wager_ratio_1
-        game.wager_ratio_2 = self.wager_ratio_2
-        game.arb_site_odds_1 = self.arb_site_odds_1
-        game.arb_site_odds_2 = self.arb_site_odds_2
+    def close(self):
+        """
+        Close the runtime's executors and the crawler's resources, the threads that use a resource are finished first
 
-        game.league = self.league
-        game.time = self.time
-        game.date = self.date
+        :return: None
+        """
+        crawler = self.arb_crawler
+        # the page loads already running are finished, those not started were cancelled with their cycle
+        for executor in (self.fetch_executor, self.cycle_executor, self.analysis_executor):
+            if executor is not None:
+                executor.shutdown()
+        crawler.close_fetchers()
+        crawler.close_parse_pool(self.failed is None)
+        crawler.close_shard_aggregator()
+        crawler.close_odds_history()
+
+    def fetcher(self, site):
+        crawler = self.arb_crawler
+        return crawler.driver_pool if site.backend in Site.browser_backends else crawler.http_fetcher
+
+    async def crawl(self):
+        """
+        Crawls the urls as they come due, waiting on the loop between cycles. Each cycle goes to the analysis task
+        on the cycle queue, which holds the crawler back when it is full
+        """
+        crawler = self.arb_crawler
+        crawl_scheduler = crawler.crawl_scheduler
+        self.logger.debug("CRAWLER: Crawler started.")
+        while True:
+            self.profiler.checkpoint()
+            while self.arb_urls:
+                crawl_scheduler.observe_arb(*self.arb_urls.popleft())
+            cycle_started = time.time()
+            jobs = crawl_scheduler.due(cycle_started)
+            if jobs:
+                cycle_update = await self.crawl_cycle(jobs, cycle_started)
+                crawl_scheduler.reschedule(jobs, time.time())
+
+                self.logger.debug("CRAWLER: Adding update of {} games from {} pages to game queue".format(
+                    len(cycle_update.games), len(jobs)))
+                crawler.stamp_queued(cycle_update, cycle_started)
+                await self.cycle_queue.put(cycle_update)
+
+            next_due = crawl_scheduler.next_due()
+            # with no urls scheduled the crawl waits an interval, stopping the runtime cancels the sleep
+            wait = crawl_scheduler.max_interval if next_due is None else max(0, next_due - time.time())
+            self.logger.debug("CRAWLER: Completed scraping cycle. Next cycle in %.0f seconds", wait)
+            await asyncio.sleep(wait)
+
+    async def aggregate(self):
+        """
+        Stands in for the crawl task in a sharded crawl's aggregator, matching the pages the crawler nodes send in the
+        cycle thread. The urls of arbitrage opportunities go to the nodes crawling them
+        """
+        crawler = self.arb_crawler
+        self.logger.debug("AGGREGATOR: Aggregator started.")
+        while True:
+            self.profiler.checkpoint()
+            while self.arb_urls:
+                crawler.shard_aggregator.send_arb(*self.arb_urls.popleft())
+            cycle_started, cycle_update = await self.loop.run_in_executor(self.cycle_executor,
+                                                                          crawler.aggregate_cycle)
+            if cycle_update is not None:
+                crawler.stamp_queued(cycle_update, cycle_started)
+                await self.cycle_queue.put(cycle_update)
+
+    async def crawl_cycle(self, jobs, cycle_started):
+        """
+        Load every job's page in the fetch threads and hand each page to process_cycle, parsing and matching in the
+        cycle thread, as soon as it has loaded. A cancelled cycle drops the page loads that have not started, and
+        process_cycle stops after the pages it already has
 
-        return game
+        :param jobs: List of (Site, String url) tuples
+        :param cycle_started: float unix time the cycle started
+        :return: CycleUpdate
+        """
+        crawler = self.arb_crawler
+        fetched_pages = queue.SimpleQueue()
+        cycle = self.loop.run_in_executor(self.cycle_executor, crawler.process_cycle, iter(fetched_pages.get, None),
+                                          cycle_started)
+        fetches = [self.loop.run_in_executor(self.fetch_executor, self.fetcher(site).fetch, (site, url))
+                   for site, url in jobs]
+        try:
+            for fetch in asyncio.as_completed(fetches):
+                fetched_pages.put(await fetch)
+        except BaseException:
+            for fetch in fetches:
+                fetch.cancel()
+            fetched_pages.put(None)
+            # the pages the parse workers have are not waited for, closing still joins the workers so it runs in a
+            # thread and the loop carries on with the shutdown
+            await self.loop.run_in_executor(None, lambda: crawler.parse_pool.close(wait=False))
+            raise
+        fetched_pages.put(None)
+        return await cycle
+
+    async def analysis_dispatcher(self):
+        """
+        Analyzes each cycle from the cycle queue in the analysis threads, the opportunities found go on the arb queue
+        """
+        crawler = self.arb_crawler
+        arb_queue = LoopQueue(self.loop, self.arb_queue)
+        self.logger.debug("GAME_WATCHER: Game watcher started.")
+        while True:
+            cycle_update = await self.cycle_queue.get()
+            try:
+                crawler.receive_cycle(cycle_update)
+                if crawler.analysis_mode == "batch":
+                    await self.loop.run_in_executor(self.analysis_executor, crawler.analyze_snapshot,
+                                                    cycle_update.games, arb_queue)
+                else:
+                    await asyncio.gather(*[self.loop.run_in_executor(self.analysis_executor, crawler.game_analyzer, game,
+                                                                     arb_queue, crawler.shutdown_event)
+                                           for game in cycle_update.games])
+            finally:
+                self.cycle_queue.task_done()
 
-    def __repr__(self):
-        repr_str = "{} vs. {}\n".format(self.team_1_name, self.team_2_name)
-        for i in self.site_odds:
-            repr_str = repr_str + "    Site: {} {} {} vs. {} {}".format(i.site.name, i.ml1, i.odds1, i.ml2, i.odds2)
-        return repr_str
+    async def notifications(self):
+        """
+        Hands each arbitrage opportunity from the arb queue to the Notifier, and its urls to the crawl scheduler
+        """
+        crawler = self.arb_crawler
+        notifier = Notifier(crawler.smtp_connection(), crawler.email_recipients, crawler.game_notification_text,
+                            crawler.notification_window_seconds, crawler.notification_repeat_minutes * 60,
+                            metrics=crawler.metrics, logger=self.logger)
+        try:
+            while True:
+                game = await self.arb_queue.get()
+                try:
+                    crawler.log_arbitrage(game)
+                    notifier.submit(game)
+                    self.arb_urls.append(([site_odds.url for site_odds in game.site_odds], game.timestamps['actioned']))
+                finally:
+                    self.arb_queue.task_done()
+        finally:
+            # sends the digest still waiting for its window to close
+            await self.loop.run_in_executor(None, notifier.close)
+
+    async def command_line(self):
+        """
+        The same commands as the process runtime's prompt, read from stdin when the loop sees a line is ready. Without
+        a stdin to read, or once it is closed, the runtime is stopped with SIGTERM or SIGINT
+        """
+        lines = asyncio.Queue()
+        try:
+            stdin = sys.stdin.fileno()
+            self.loop.add_reader(stdin, self.read_stdin, stdin, lines)
+        except (AttributeError, ValueError, OSError):
+            self.logger.debug("MAIN: No command line, stop with SIGTERM")
+            return
+        try:
+            while True:
+                print("$ ", end="", flush=True)
+                command = await lines.get()
+                if command is None:
+                    self.logger.debug("MAIN: stdin closed, stop with SIGTERM")
+                    return
+                if command == 'exit':
+                    self.stop("exit")
+                    return
+                output = self.arb_crawler.run_command(command)
+                if output:
+                    print(output)
+        finally:
+            self.loop.remove_reader(stdin)
+
+    def read_stdin(self, stdin, lines):
+        data = os.read(stdin, 4096)
+        if not data:
+            self.loop.remove_reader(stdin)
+            lines.put_nowait(None)
+            return
+        *complete, self.stdin_buffer = (self.stdin_buffer + data).split(b"\n")
+        for line in complete:
+            lines.put_nowait(line.decode(errors="replace").strip())
+
+    async def metrics_reporter(self):
+        while True:
+            await asyncio.sleep(self.arb_crawler.metrics_summary_seconds)
+            self.logger.debug("METRICS: {}".format(self.arb_crawler.metrics.summary()))
 
 
 class ArbCrawler:
@@ -308,6 +3388,17 @@ class ArbCrawler:
     """
 
     def __init__(self, config_file, email_config_file):
+        with open(config_file, 'r') as f:
+            c = f.read()
+            self.config = toml.loads(c)
+
+        with open(email_config_file, 'r') as f:
+            c = f.read()
+            self.email_config = toml.loads(c)
+
+        # Logging level of every stage, and whether records are written by a writer thread in each process
+        configure_logging(self.config.get('log_level', 'DEBUG'), self.config.get('async_logging', False))
+
         self.log_name = "arb_crawler.log"
         self.log_file = "arb_crawler.log"
         self.formatter = logging.Formatter("%(asctime)s %(levelname)s ARB_CRAWLER: %(message)s")
@@ -323,14 +3414,6 @@ class ArbCrawler:
 
         self.sites = []
 
-        with open(config_file, 'r') as f:
-            c = f.read()
-            self.config = toml.loads(c)
-
-        with open(email_config_file, 'r') as f:
-            c = f.read()
-            self.email_config = toml.loads(c)
-
         # Create the site object that arbcrawler will use from the config
         # Only supports Bovada and MyBookie
 
@@ -342,10 +3425,11 @@ class ArbCrawler:
                     found_existing_site = True
                     break
             if not found_existing_site:
+                backend = self.config.get('site_backends', {}).get(page['site_name'], 'selenium')
                 if page['site_name'] == 'Bovada':
-                    new_site = Bovada(name=page['site_name'], urls=[page['url']])
+                    new_site = Bovada(name=page['site_name'], urls=[page['url']], backend=backend)
                 elif page['site_name'] == 'MyBookie':
-                    new_site = MyBookie(name=page['site_name'], urls=[page['url']])
+                    new_site = MyBookie(name=page['site_name'], urls=[page['url']], backend=backend)
 
                 self.sites.append(new_site)
 
@@ -353,28 +3437,124 @@ class ArbCrawler:
             for url in i.urls:
                 self.logger.debug("INIT: Adding from config : {}".format(str(i)))
 
-        # game queue is a queue for games that the crawler has found
-        self.game_queue = Queue()
-        # arb_gueue is a queue for games that the analyzer has determined that are arbitrage opportunities
-        self.arb_queue = Queue()
+        # "asyncio" runs the crawler, game watcher and arbitrage actioner as tasks on one event loop, "processes"
+        # runs each in its own process
+        self.runtime = self.config.get('runtime', 'processes')
 
-        # Driver for selenium
-        options = Options()
-        options.headless = True
-        self.driver = webdriver.Firefox(options=options)
+        # game queue carries one update per crawl cycle of the games that the crawler has found
+        self.game_queue_max_cycles = self.config.get('game_queue_max_cycles', 4)
+        self.game_queue = Channel(self.game_queue_max_cycles,
+                                  self.config.get('shared_memory_threshold_bytes', 65536), self.logger)
+        # arb_gueue is a queue for games that the analyzer has determined that are arbitrage opportunities
+        self.arb_queue = Channel(self.config.get('arb_queue_max_games', 1000), logger=self.logger)
+
+        # Drivers for selenium and the http session, created by the crawler process
+        self.driver_pool = None
+        self.driver_pool_size = self.config.get('driver_pool_size', 1)
+        self.driver_max_pages = self.config.get('driver_max_pages', 50)
+        self.dom_verify_pages = self.config.get('dom_verify_pages', 50)
+        # processes parsing pages while the next ones are fetched, "auto" is one per core and 0 parses in the crawler
+        self.parse_workers = self.config.get('parse_workers', 0)
+        if self.parse_workers == 'auto':
+            self.parse_workers = os.cpu_count() or 1
+        self.parse_max_pending = self.config.get('parse_max_pending_pages', 8)
+        self.parse_pool = ParsePool(0, 0)
+        self.browser_profile = BrowserProfile(
+            self.config.get('lean_browser', False),
+            self.config.get('block_resource_types', BrowserProfile.default_block_resource_types),
+            self.config.get('block_url_patterns', BrowserProfile.default_block_url_patterns),
+            self.config.get('browser_cache_mb', 32))
+        self.lean_browser_baseline = self.config.get('lean_browser_baseline', False)
+        self.http_fetcher = None
+        self.http_pool_size = self.config.get('http_pool_size', 8)
+        self.http_timeout = self.config.get('http_timeout_seconds', 15)
 
         # How similar names have to be to match. Smaller is more lenient, larger is more stringent
         self.difference_parameter = 50
 
+        # Canonical team names remembered across cycles, created by the crawler process
+        self.team_registry = None
+        self.team_registry_file = self.config.get('team_registry_file', 'team_registry.json')
+        self.team_registry_size = self.config.get('team_registry_size', 10000)
+        self.team_overrides_file = self.config.get('team_overrides_file')
+
         self.mail_server = self.email_config['email_server']
         self.mail_server_port = self.email_config['email_port']
         self.gmail_user = self.email_config['email_user']
         self.gmail_pass = self.email_config['email_password']
         self.email_recipients = self.email_config['recipients']
 
-        # interval in minutes for site recheck
+        # arbitrage opportunities found within notification_window_seconds of each other are emailed as one digest,
+        # and an opportunity whose sites and prices have not changed is only emailed again after the repeat interval
+        self.notification_window_seconds = self.config.get('notification_window_seconds', 5)
+        self.notification_repeat_minutes = self.config.get('notification_repeat_minutes', 60)
+
+        # "per_game" analyzes each game in the watcher's thread pool, "batch" analyzes a whole cycle at once
+        self.analysis_mode = self.config.get('analysis_mode', 'per_game')
+
+        # every price seen is recorded in the odds history, created by the crawler process
+        self.odds_history = None
+        self.odds_history_dir = self.config.get('odds_history_dir', 'odds_history')
+        self.odds_history_segment_rows = self.config.get('odds_history_segment_rows', 1000000)
+        self.odds_history_compact_segments = self.config.get('odds_history_compact_segments', 8)
+
+        # page sources are saved with their fetch times for replaying when record_pages_dir is set
+        self.record_pages_dir = self.config.get('record_pages_dir', '')
+        self.page_recording = PageRecording(self.record_pages_dir) if self.record_pages_dir else None
+
+        # stage timings and counters from every process, served for Prometheus on metrics_port and summarized in the log
+        self.metrics = Metrics()
+        self.metrics_port = self.config.get('metrics_port', 0)
+        self.metrics_summary_seconds = self.config.get('metrics_summary_seconds', 60)
+        self.metrics_server = None
+
+        # profiling switched on from the command line, one control queue per worker process
+        self.profile_dir = self.config.get('profile_dir', 'profiles')
+        self.profile_sample_interval = self.config.get('profile_sample_interval_ms', 5) / 1000
+        self.control_queues = {'crawler': Queue(), 'watcher': Queue(), 'actioner': Queue()}
+        # the process the SIGTERM handler shuts down from, the workers it is forked into ignore it
+        self.main_pid = None
+
+        # set by replay, arbitrage opportunities go to detections_file instead of email
+        self.replaying = False
+        self.detections_file = None
+
+        # only queue games that are new or whose prices moved since the last cycle
+        self.incremental_updates = self.config.get('incremental_updates', True)
+        self.odds_tracker = OddsTracker(self.metrics)
+
+        # report every profitable pair of sites for a game, not just the best one
+        self.report_all_arbs = self.config.get('report_all_arbs', False)
+
+        # interval in minutes for site recheck, the slowest a url is crawled with the adaptive schedule
         self.interval_minutes = self.config['interval_minutes']
 
+        # when each url is crawled, "adaptive" crawls urls whose prices move, with games starting soon or recent
+        # arbitrage opportunities more often, "fixed" crawls every url every interval_minutes
+        self.crawl_scheduler = CrawlScheduler(self.config.get('crawl_min_interval_seconds', 30),
+                                              self.interval_minutes * 60,
+                                              self.config.get('site_pages_per_minute', 0),
+                                              self.config.get('hot_start_minutes', 180) * 60,
+                                              self.config.get('arb_hot_minutes', 30) * 60,
+                                              self.config.get('crawl_schedule', 'fixed') == 'adaptive',
+                                              self.metrics, self.logger)
+        # the last games parsed from each url, matched again in cycles that do not fetch it until they are too old
+        self.latest_pages = {}
+        self.page_expiry_seconds = 1.5 * self.interval_minutes * 60
+        # urls of the arbitrage opportunities actioned, sent back to the crawler's scheduler
+        self.arb_urls = Queue()
+
+        # "aggregator" matches, analyzes and notifies the pages that "node"s crawl and parse, sharing the urls out
+        # between them, "" crawls every url here. shard_address is "host:port" or a unix socket path
+        self.shard_role = self.config.get('shard_role', '')
+        self.shard_address = shard_address(self.config.get('shard_address', '127.0.0.1:7070'))
+        self.shard_authkey = self.config.get('shard_authkey', '').encode('utf-8') or None
+        self.shard_node_name = self.config.get('shard_node_name', '') or socket.gethostname()
+        self.shard_replicas = self.config.get('shard_replicas', 100)
+        self.shard_retry_seconds = self.config.get('shard_retry_seconds', 5)
+        # the aggregator's end of the connections to the nodes, created by the crawler process
+        self.shard_aggregator = None
+
     def moneyline_to_decimal(self, ml):
         """ Converts the positive or negative moneyline value into
         decimal odds, essentially the amount of payout including
@@ -388,65 +3568,259 @@ class ArbCrawler:
             return (ml + 100)/100
         return 100 / -ml + 1
 
-    def determine_margin_moneyline(self, mla, mlb):
+    def determine_margin_moneyline(self, *mls):
         """ Determine the margin from moneyline odds
 
-        :param mla: int moneyline odds for event a
-        :param mlb: int moneyline odds for event b
+        :param mls: int moneyline odds for each event
         :return: float margin value
         """
 
-        margin = (1 / self.moneyline_to_decimal(mla) + 1 / self.moneyline_to_decimal(mlb)) - 1
+        margin = sum(1 / self.moneyline_to_decimal(ml) for ml in mls) - 1
 
         return margin
 
-    def determine_margin_decimal(self, mla, mlb):
+    def determine_margin_decimal(self, *odds):
         """ Determine the margin from decimal odds
 
-        :param mla: float decimal odds for event a
-        :param mlb: float decimal odds for event b
+        :param odds: float decimal odds for each event
         :return: float margin value
         """
 
-        margin = (1/mla + 1/mlb) - 1
+        margin = sum(1 / o for o in odds) - 1
 
         return margin
 
-    def determine_wager_ratio(self, odds1, odds2):
+    def determine_wager_ratio(self, *odds):
         """
-        Determines the ratio of money should be spent on event1 vs event 2,
+        Determines the ratio of money should be spent on each event,
         if not an arbitrage opportunity will raise NotArbitrageScenario. Returns a tuple with the proportion of
         money that should be wagered
 
-        :param odds1: float decimal odds of event 1 happening
-        :param odds2: float decimal odds of event 2 happening
-        :return: (float, float) tuple of money amounts to wager on event1 and event2 respectively
+        :param odds: float decimal odds of each event happening
+        :return: tuple of money amounts to wager on each event
         :raises NotArbitrageScenario:
         """
 
-        if self.determine_margin_decimal(odds1, odds2) >= 0:
+        if self.determine_margin_decimal(*odds) >= 0:
             raise NotArbitrageScenario
 
-        w1 = 1 / ((odds1 / odds2) + 1)
-        w2 = 1 / ((odds2 / odds1) + 1)
+        implied_total = sum(1 / o for o in odds)
 
-        return w1, w2
+        return tuple((1 / o) / implied_total for o in odds)
 
-    def determine_arb_profit(self, wager1, odds1, wager2, odds2):
+    def determine_arb_profit(self, *wagers_and_odds):
         """
-        Checks for arbitrage scenario, then returns tuple of payoffs for event1 and event2 respectively
+        Checks for arbitrage scenario, then returns tuple of payoffs for each event
 
-        :param wager1:
-        :param odds1:
-        :param wager2:
-        :param odds2:
-        :return:
+        :param wagers_and_odds: wager1, odds1, wager2, odds2, ... for each event
+        :return: tuple of float payoffs
         """
 
-        if self.determine_margin_decimal(odds1, odds2) >= 0:
+        wagers = wagers_and_odds[0::2]
+        odds = wagers_and_odds[1::2]
+
+        if self.determine_margin_decimal(*odds) >= 0:
             raise NotArbitrageScenario
 
-        return wager1 * odds1 - (wager1 + wager2), wager2 * odds2 - (wager1 + wager2)
+        return tuple(wager * o - sum(wagers) for wager, o in zip(wagers, odds))
+
+    def start_profiler(self, process_name):
+        """
+        :param process_name: String 'crawler', 'watcher' or 'actioner', whose control queue the profiler reads
+        :return: Profiler for the calling process
+        """
+        return Profiler(process_name, self.control_queues[process_name], self.profile_dir, self.profile_sample_interval,
+                        self.logger)
+
+    def close_fetchers(self):
+        if self.driver_pool is not None:
+            self.driver_pool.close()
+            self.driver_pool = None
+        if self.http_fetcher is not None:
+            self.http_fetcher.close()
+            self.http_fetcher = None
+
+    def close_parse_pool(self, wait=True):
+        self.parse_pool.close(wait)
+        self.parse_pool = ParsePool(0, 0)
+
+    def close_odds_history(self):
+        if self.odds_history is not None:
+            self.odds_history.close()
+            self.odds_history = None
+
+    def process_cycle(self, fetched_pages, cycle_started):
+        """
+        Parse and match the pages of one crawl cycle, record them and work out which games need analyzing
+
+        :param fetched_pages: iterable of (Site, String url, String page source or None) tuples
+        :param cycle_started: float unix time the cycle started
+        :return: CycleUpdate
+        """
+        return self.match_cycle(self.parse_pool.parse_all(fetched_pages), cycle_started)
+
+    def match_cycle(self, parsed_pages, cycle_started):
+        """
+        Match the parsed pages of one crawl cycle, record them and work out which games need analyzing. The games of
+        urls not fetched this cycle are matched from the last time they were, until that is page_expiry_seconds old
+
+        :param parsed_pages: iterable of (Site, String url, String page source or None, float unix time fetched, List
+        of Game objects or None, float seconds spent parsing) tuples, like ParsePool.parse_all
+        :param cycle_started: float unix time the cycle started
+        :return: CycleUpdate
+        """
+        game_matcher = GameMatcher(self.difference_parameter, self.team_registry)
+        page_times = {}
+        fetched_urls = set()
+        stage_seconds = defaultdict(float)
+        page_count = 0
+        processing_started = waiting_since = time.time()
+        fetch_busy_started = self.fetch_busy_seconds()
+        for site, url, page_source, fetched_at, games_from_site, parse_seconds in parsed_pages:
+            received_at = time.time()
+            # parsing in this process is part of the wait for the page, it is counted as parsing instead
+            stage_seconds['fetch_wait'] += received_at - waiting_since - \
+                (0 if self.parse_pool.workers else parse_seconds)
+            self.logger.debug("CRAWLER: Got games from: %s", url)
+            if games_from_site is None:
+                self.metrics.increment('pages_failed')
+                waiting_since = time.time()
+                continue
+            page_count += 1
+            self.metrics.increment('pages_fetched')
+            if self.page_recording is not None:
+                self.page_recording.write(cycle_started, fetched_at, site.name, url, page_source)
+            stage_seconds['parse'] += parse_seconds
+            self.metrics.observe('parse_seconds', parse_seconds)
+            self.metrics.increment('games_parsed', len(games_from_site))
+
+            for site_game in games_from_site:
+                for site_odds in site_game.site_odds:
+                    site_odds.url = url
+                    page_times[id(site_odds)] = fetched_at
+            self.crawl_scheduler.observe(url, games_from_site, fetched_at)
+            # kept unmatched for the cycles that do not fetch this url
+            self.latest_pages[url] = (cycle_started, fetched_at, [game.unmatched_copy() for game in games_from_site])
+            fetched_urls.add(url)
+
+            # determine if games have been collected before
+            for site_game in games_from_site:
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("CRAWLER: Checking game: %s for an existing match this round", str(site_game))
+                if game_matcher.merge(site_game, self.logger):
+                    self.metrics.increment('games_matched')
+            waiting_since = time.time()
+            stage_seconds['match'] += waiting_since - received_at
+            self.metrics.observe('match_seconds', waiting_since - received_at)
+
+        for url, (page_cycle_started, fetched_at, games) in list(self.latest_pages.items()):
+            if url in fetched_urls:
+                continue
+            if cycle_started - page_cycle_started > self.page_expiry_seconds:
+                del self.latest_pages[url]
+                continue
+            for game in games:
+                site_game = game.unmatched_copy()
+                for site_odds in site_game.site_odds:
+                    page_times[id(site_odds)] = fetched_at
+                game_matcher.merge(site_game, self.logger)
+        stage_seconds['match'] += time.time() - waiting_since
+
+        self.metrics.set('last_cycle_fetch_wait_seconds', stage_seconds['fetch_wait'])
+        self.metrics.set('last_cycle_parse_seconds', stage_seconds['parse'])
+        self.metrics.set('last_cycle_match_seconds', stage_seconds['match'])
+        self.metrics.set('last_cycle_pages', page_count)
+        self.metrics.set('last_cycle_games', len(game_matcher.games))
+        self.report_utilization(time.time() - processing_started, self.fetch_busy_seconds() - fetch_busy_started,
+                                stage_seconds, page_count, len(game_matcher.games))
+
+        self.team_registry.save()
+        if self.odds_history is not None:
+            rows = self.odds_history.append(game_matcher.games, cycle_started, fetched_urls)
+            self.logger.debug("CRAWLER: Recorded {} prices in the odds history".format(rows))
+
+        priced_games = [game for game in game_matcher.games if len(game.site_odds) >= 2]
+        matched_at = time.time()
+        for game in priced_games:
+            game.timestamps['seen'] = max(page_times[id(site_odds)] for site_odds in game.site_odds)
+            game.timestamps['matched'] = matched_at
+        if self.incremental_updates:
+            cycle_update = self.odds_tracker.update(priced_games)
+        else:
+            cycle_update = CycleUpdate(priced_games)
+        self.logger.debug("CRAWLER: {} new or changed games, {} unchanged, {} removed".format(
+            len(cycle_update.games), cycle_update.unchanged_count, len(cycle_update.removed_game_ids)))
+        return cycle_update
+
+    def fetch_busy_seconds(self):
+        """
+        :return: float seconds the fetchers have spent loading pages, summed over every driver and connection
+        """
+        counters, gauges, histograms = self.metrics.snapshot()
+        return histograms['fetch_seconds'][1] + histograms['render_wait_seconds'][1]
+
+    def report_utilization(self, seconds, fetch_busy, stage_seconds, page_count, game_count):
+        """
+        Log a cycle's throughput and how busy each stage of the pipeline was over it, as the share of the time its
+        fetchers, parse workers and the matching were working
+
+        :param seconds: float seconds from the cycle's first fetch to the end of matching
+        :param fetch_busy: float seconds the fetchers spent loading pages in the cycle
+        :param stage_seconds: dict of the cycle's parse and match seconds
+        """
+        if seconds <= 0:
+            return
+        fetch_capacity = 0
+        if self.driver_pool is not None:
+            fetch_capacity += self.driver_pool.size
+        if self.http_fetcher is not None:
+            fetch_capacity += self.http_fetcher.size
+        utilization = {
+            'fetch': fetch_busy / (seconds * fetch_capacity) if fetch_capacity else 0.0,
+            'parse': stage_seconds['parse'] / (seconds * max(1, self.parse_pool.workers)),
+            'match': stage_seconds['match'] / seconds,
+        }
+        for stage, share in utilization.items():
+            self.metrics.set('last_cycle_{}_utilization'.format(stage), share)
+        self.logger.debug("CRAWLER: Cycle of %s pages and %s games in %.2f seconds, %.1f pages/s, %.0f games/s, "
+                          "utilization fetch %.0f%% of %s, parse %.0f%% of %s, match %.0f%%", page_count, game_count,
+                          seconds, page_count / seconds, game_count / seconds, utilization['fetch'] * 100,
+                          fetch_capacity, utilization['parse'] * 100, max(1, self.parse_pool.workers),
+                          utilization['match'] * 100)
+
+    def send_cycle(self, game_queue, cycle_update, cycle_started):
+        """
+        Stamp the games of a cycle as queued and send the cycle to the game watcher
+
+        :param game_queue: Queue object to send the CycleUpdate on
+        :param cycle_update: CycleUpdate from process_cycle
+        :param cycle_started: float unix time the cycle started
+        :return: None
+        """
+        self.stamp_queued(cycle_update, cycle_started)
+        game_queue.put(cycle_update)
+
+    def stamp_queued(self, cycle_update, cycle_started):
+        queued_at = time.time()
+        for game in cycle_update.games:
+            game.timestamps['queued'] = queued_at
+        self.metrics.observe('cycle_seconds', queued_at - cycle_started)
+        self.metrics.set('last_cycle_seconds', queued_at - cycle_started)
+
+    def receive_cycle(self, cycle_update):
+        """
+        Stamp the games of a cycle the game watcher has taken off the game queue as received
+
+        :param cycle_update: CycleUpdate from the crawler
+        :return: None
+        """
+        self.logger.debug("GAME_WATCHER: Analyzing {} changed games, {} removed games".format(
+            len(cycle_update.games), len(cycle_update.removed_game_ids)))
+        received_at = time.time()
+        for game in cycle_update.games:
+            game.timestamps['received'] = received_at
+        if cycle_update.games and 'queued' in cycle_update.games[0].timestamps:
+            self.metrics.observe('queue_seconds', received_at - cycle_update.games[0].timestamps['queued'])
 
     def crawler(self, game_queue, shutdown_event):
         """
@@ -459,108 +3833,613 @@ class ArbCrawler:
         self.logger.debug("CRAWLER: Crawler starting up...")
 
         try:
+            self.open_crawler()
+            self.open_matching()
+            self.schedule_pages()
+            profiler = self.start_profiler('crawler')
             self.logger.debug("CRAWLER: Crawler started.")
             while True:
-                games_collected = []
-                for site in self.sites:
-                    self.logger.debug("CRAWLER: Site to be checked this round: {}".format(str(site)))
-                    for url in site.urls:
-                        self.logger.debug("CRAWLER: Getting games from: {}".format(url))
-                        self.driver.get(url)
-                        sleep(10)
-                        page_source = self.driver.page_source
-                        games_from_site = site.parse_page(page_source, url)
-
-                        # determine if games have been collected before
-                        for site_game in games_from_site:
-                            self.logger.debug("CRAWLER: Checking game: {} for an existing match this round".format(str(site_game)))
-                            found_in_existing_games = False
-                            for existing_game in games_collected:
-                                # This if statement checks to see if the team names are similar enough to be considered the same
-                                if fuzz.token_set_ratio(site_game.team_1_name, existing_game.team_1_name) >\
-                                        self.difference_parameter and \
-                                        fuzz.token_set_ratio(site_game.team_2_name, existing_game.team_2_name) >\
-                                        self.difference_parameter:
-                                    # code to check sequence matcher
-                                    self.logger.debug("CRAWLER: We determined that {} was the same as {} with confidence {} and {} was the same as {} with confidence {}".format(
-                                            site_game.team_1_name, existing_game.team_1_name,
-                                            fuzz.token_set_ratio(site_game.team_1_name, existing_game.team_1_name),
-                                            site_game.team_2_name, existing_game.team_2_name,
-                                            fuzz.token_set_ratio(site_game.team_2_name, existing_game.team_2_name)))
-
-                                    # update existing game
-                                    self.logger.debug("Adding odds information to the existing game")
-                                    existing_game.site_odds = existing_game.site_odds + site_game.site_odds
-                                    found_in_existing_games = True
-
-                            if not found_in_existing_games:
-                                games_collected.append(site_game)
-
-                for game in games_collected:
-                    if len(game.site_odds) >= 2:
-                        # Performing deep copy and removing logger object from games siteodds sites
-                        game_copy = game.copy()
-                        self.logger.debug("CRAWLER: Adding game {} to game queue".format(str(game_copy)))
-                        game_queue.put(game_copy)
-
-                self.logger.debug("CRAWLER: Completed scraping cycle. Next cycle in {} minutes".format(self.interval_minutes))
-
-                if shutdown_event.wait(self.interval_minutes * 60): # Wait for time in mins * 60 secs or unless shutdown event happens
+                profiler.checkpoint()
+                self.read_arb_urls()
+                cycle_started = time.time()
+                jobs = self.crawl_scheduler.due(cycle_started)
+                if jobs:
+                    cycle_update = self.process_cycle(self.fetch_jobs(jobs), cycle_started)
+                    self.crawl_scheduler.reschedule(jobs, time.time())
+
+                    # the whole cycle goes to the game watcher as one message
+                    self.logger.debug("CRAWLER: Adding update of {} games from {} pages to game queue".format(
+                        len(cycle_update.games), len(jobs)))
+                    self.send_cycle(game_queue, cycle_update, cycle_started)
+
+                next_due = self.crawl_scheduler.next_due()
+                # with no urls scheduled the crawler waits an interval or for the shutdown event
+                wait = self.crawl_scheduler.max_interval if next_due is None else max(0, next_due - time.time())
+                self.logger.debug("CRAWLER: Completed scraping cycle. Next cycle in %.0f seconds", wait)
+
+                if shutdown_event.wait(wait): # Wait until the next url is due or unless shutdown event happens
                     self.logger.debug("Crawler detected shutdown event.")
-                    self.driver.quit()
+                    self.close_fetchers()
+                    self.close_parse_pool()
+                    self.close_odds_history()
+                    game_queue.close("crawler stopped")
                     break
 
         except Exception as e:
-            shutdown_event.set()  # Put none in queue to propagate shutdown
-            game_queue.put(None)
-            self.arb_queue.put(None)
-            self.driver.quit()
+            shutdown_event.set()  # End the stream to propagate shutdown
+            game_queue.close("crawler error")
+            self.close_fetchers()
+            self.close_parse_pool(wait=False)
+            self.close_odds_history()
             traceback.print_exc()
             self.send_error_notification()
 
         self.logger.debug("CRAWLER: Crawler shutting down")
 
+    def fetch_jobs(self, jobs):
+        """
+        Start fetching the pages of jobs, both backends start fetching as soon as their jobs are submitted
+
+        :param jobs: List of (Site, String url) tuples
+        :return: iterator of (Site, String url, String page source or None) tuples
+        """
+        selenium_jobs = [(site, url) for site, url in jobs if site.backend in Site.browser_backends]
+        http_jobs = [(site, url) for site, url in jobs if site.backend not in Site.browser_backends]
+
+        fetched_pages = []
+        if http_jobs:
+            fetched_pages.append(self.http_fetcher.fetch_all(http_jobs))
+        if selenium_jobs:
+            fetched_pages.append(self.driver_pool.fetch_all(selenium_jobs))
+        return itertools.chain(*fetched_pages)
+
+    def open_crawler(self):
+        """
+        Start the parse pool, fetchers, team registry and odds history the crawler works with. The parse workers are
+        forked first, before any other threads are started in this process
+
+        :return: None
+        """
+        self.parse_pool = ParsePool(self.parse_workers, self.parse_max_pending)
+        if any(site.backend in Site.browser_backends for site in self.sites):
+            self.driver_pool = DriverPool(self.driver_pool_size, self.driver_max_pages, self.logger, self.metrics,
+                                          self.dom_verify_pages, self.browser_profile)
+            if self.browser_profile.lean and self.lean_browser_baseline:
+                self.driver_pool.measure_baseline([(site, url) for site in self.sites for url in site.urls
+                                                   if site.backend in Site.browser_backends])
+        if any(site.backend not in Site.browser_backends for site in self.sites):
+            self.http_fetcher = HttpFetcher(self.http_pool_size, self.http_timeout, self.logger, self.metrics)
+
+    def open_matching(self):
+        """
+        Start the team registry and odds history the pages are matched and recorded with
+
+        :return: None
+        """
+        self.team_registry = TeamRegistry(self.team_registry_file, self.team_registry_size, self.team_overrides_file)
+        if self.odds_history_dir:
+            self.odds_history = OddsHistory(self.odds_history_dir, self.odds_history_segment_rows,
+                                            self.odds_history_compact_segments, self.logger)
+
+    def schedule_pages(self):
+        """
+        Schedule every url in the config to be crawled now
+        """
+        started = time.time()
+        for site in self.sites:
+            self.logger.debug("CRAWLER: Site to be checked: %s", site)
+            for url in site.urls:
+                self.crawl_scheduler.add(site, url, started)
+
+    def open_aggregator(self):
+        """
+        Start the team registry, odds history and the aggregator's end of a sharded crawl, which shares every url in the
+        config out between the crawler nodes. The nodes record the pages they fetch
+
+        :return: None
+        """
+        self.open_matching()
+        self.page_recording = None
+        self.shard_aggregator = ShardAggregator(self.shard_address, self.shard_authkey,
+                                                [url for site in self.sites for url in site.urls], self.shard_replicas,
+                                                self.logger, self.metrics)
+        self.logger.debug("AGGREGATOR: Listening for crawler nodes on {}".format(self.shard_address))
+
+    def close_shard_aggregator(self):
+        if self.shard_aggregator is not None:
+            self.shard_aggregator.close()
+            self.shard_aggregator = None
+
+    def aggregate_cycle(self):
+        """
+        Wait up to a second for pages from the crawler nodes, then match the pages received like a crawl cycle
+
+        :return: (float unix time the cycle started, CycleUpdate) tuple, (None, None) if no pages came
+        """
+        pages = self.shard_aggregator.receive(1.0)
+        if not pages:
+            return None, None
+        cycle_started = time.time()
+        self.logger.debug("AGGREGATOR: Matching {} pages from the crawler nodes".format(len(pages)))
+        # the nodes did the parsing, so none of the wait for the pages here is counted as parsing
+        cycle_update = self.match_cycle([(Site.registry[site_name], url, None, fetched_at, games, 0.0)
+                                         for site_name, url, fetched_at, games in pages], cycle_started)
+        return cycle_started, cycle_update
+
+    def read_arb_urls(self):
+        """
+        Hand the urls of the arbitrage opportunities the actioner has found since the last cycle to the scheduler, or
+        to the nodes crawling them when aggregating
+        """
+        while True:
+            try:
+                urls, found_at = self.arb_urls.get_nowait()
+            except queue.Empty:
+                return
+            if self.shard_aggregator is not None:
+                self.shard_aggregator.send_arb(urls, found_at)
+            else:
+                self.crawl_scheduler.observe_arb(urls, found_at)
+
+    def aggregator(self, game_queue, shutdown_event):
+        """
+        Stands in for the crawler in a sharded crawl's aggregator, matching the pages the crawler nodes send in cycles
+        for the game watcher
+
+        :param game_queue: Queue object for the aggregator to enqueue potential games for analysis
+        :return: None
+        """
+        self.logger.debug("AGGREGATOR: Aggregator starting up...")
+        try:
+            self.open_aggregator()
+            profiler = self.start_profiler('crawler')
+            self.logger.debug("AGGREGATOR: Aggregator started.")
+            while not shutdown_event.is_set():
+                profiler.checkpoint()
+                self.read_arb_urls()
+                cycle_started, cycle_update = self.aggregate_cycle()
+                if cycle_update is not None:
+                    self.send_cycle(game_queue, cycle_update, cycle_started)
+
+            self.logger.debug("Aggregator detected shutdown event.")
+            self.close_shard_aggregator()
+            self.close_odds_history()
+            game_queue.close("aggregator stopped")
+
+        except Exception as e:
+            shutdown_event.set()
+            game_queue.close("aggregator error")
+            self.close_shard_aggregator()
+            self.close_odds_history()
+            traceback.print_exc()
+            self.send_error_notification()
+
+        self.logger.debug("AGGREGATOR: Aggregator shutting down")
+
+    def run_node(self):
+        """
+        Crawl as a node of a sharded crawl in this process, until SIGTERM or SIGINT. Only the urls the aggregator
+        assigns this node are crawled, and the games parsed from them are sent to the aggregator to be matched there.
+        While the aggregator cannot be reached the node crawls nothing and tries again every shard_retry_seconds
+
+        :return: None
+        """
+        self.logger.debug("CRAWL_NODE: Node %s starting up...", self.shard_node_name)
+        stopping = threading.Event()
+        shard_node = None
+        retry_at = 0
+        try:
+            self.open_crawler()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                # only checked between steps, a cycle or a message is never stopped part way
+                signal.signal(signum, lambda signum, frame: stopping.set())
+            self.serve_metrics()
+            while not stopping.is_set():
+                if shard_node is None:
+                    if time.time() < retry_at:
+                        sleep(min(1.0, retry_at - time.time()))
+                        continue
+                    try:
+                        shard_node = ShardNode(self.shard_address, self.shard_authkey, self.shard_node_name)
+                    except (OSError, EOFError, AuthenticationError) as e:
+                        self.logger.debug("CRAWL_NODE: Cannot reach the aggregator at {}: {}".format(
+                            self.shard_address, e))
+                        retry_at = time.time() + self.shard_retry_seconds
+                        continue
+                    self.logger.debug("CRAWL_NODE: Joined the aggregator at {}".format(self.shard_address))
+
+                try:
+                    next_due = self.crawl_scheduler.next_due()
+                    # messages are waited for at most a second at a time so a shutdown is noticed
+                    wait = 1.0 if next_due is None else min(1.0, max(0, next_due - time.time()))
+                    for message in shard_node.receive(wait):
+                        if message[0] == 'assign':
+                            self.assign_urls(message[1])
+                        elif message[0] == 'arb':
+                            self.crawl_scheduler.observe_arb(message[1], message[2])
+                    cycle_started = time.time()
+                    jobs = self.crawl_scheduler.due(cycle_started)
+                    if jobs:
+                        pages = self.node_cycle(jobs, cycle_started)
+                        self.crawl_scheduler.reschedule(jobs, time.time())
+                        self.logger.debug("CRAWL_NODE: Sending {} pages to the aggregator".format(len(pages)))
+                        shard_node.send_pages(pages)
+                except (OSError, EOFError) as e:
+                    self.logger.debug("CRAWL_NODE: Lost the aggregator: {!r}".format(e))
+                    shard_node.connection.close()
+                    shard_node = None
+                    retry_at = time.time() + self.shard_retry_seconds
+                    # the aggregator shares this node's urls out between the nodes still connected
+                    self.assign_urls([])
+
+            self.logger.debug("CRAWL_NODE: Shutting down")
+            if shard_node is not None:
+                shard_node.close()
+            self.close_fetchers()
+            self.close_parse_pool()
+
+        except Exception as e:
+            if shard_node is not None:
+                shard_node.close()
+            self.close_fetchers()
+            self.close_parse_pool(wait=False)
+            traceback.print_exc()
+            self.send_error_notification()
+
+        self.logger.debug("CRAWL_NODE: Node shutting down")
+
+    def assign_urls(self, urls):
+        """
+        Crawl the urls the aggregator has assigned this node from now on, a url newly assigned is crawled straight away
+
+        :param urls: List of String urls
+        :return: None
+        """
+        sites = {url: site for site in self.sites for url in site.urls}
+        assigned = set(urls)
+        removed = [url for url in self.crawl_scheduler.sites if url not in assigned]
+        for url in removed:
+            self.crawl_scheduler.remove(url)
+        added = [url for url in urls if url not in self.crawl_scheduler.sites and url in sites]
+        now = time.time()
+        for url in added:
+            self.crawl_scheduler.add(sites[url], url, now)
+        self.metrics.set('shard_urls', len(self.crawl_scheduler.sites))
+        self.logger.debug("CRAWL_NODE: Assigned {} urls, {} new and {} given up".format(
+            len(self.crawl_scheduler.sites), len(added), len(removed)))
+
+    def node_cycle(self, jobs, cycle_started):
+        """
+        Fetch and parse the pages of jobs like a crawl cycle, the matching is left to the aggregator
+
+        :param jobs: List of (Site, String url) tuples from the scheduler
+        :param cycle_started: float unix time the cycle started
+        :return: List of (String site name, String url, float unix time fetched, List of Game objects) tuples
+        """
+        pages = []
+        for site, url, page_source, fetched_at, games, parse_seconds in self.parse_pool.parse_all(
+                self.fetch_jobs(jobs)):
+            if games is None:
+                self.metrics.increment('pages_failed')
+                continue
+            self.metrics.increment('pages_fetched')
+            if self.page_recording is not None:
+                self.page_recording.write(cycle_started, fetched_at, site.name, url, page_source)
+            self.metrics.observe('parse_seconds', parse_seconds)
+            self.metrics.increment('games_parsed', len(games))
+            self.crawl_scheduler.observe(url, games, fetched_at)
+            pages.append((site.name, url, fetched_at, games))
+        return pages
+
+    def replayer(self, game_queue, shutdown_event, recording_dir, speedup=None, repeat=1):
+        """
+        Stands in for the crawler during a replay, feeding the pages of a PageRecording through the same parsing and
+        matching. With a speedup pages arrive as far apart as they were recorded divided by it, otherwise as fast as
+        they can be parsed
+
+        :param game_queue: Queue object for the replayer to enqueue potential games for analysis
+        :param recording_dir: String directory of the PageRecording
+        :param speedup: optional float, how many times faster than recorded to replay
+        :param repeat: int number of times to play the recording, later plays are shifted to after the earlier ones
+        :return:
+        """
+        self.logger.debug("REPLAYER: Replayer starting up...")
+        try:
+            self.parse_pool = ParsePool(self.parse_workers, self.parse_max_pending)
+            recording = PageRecording(recording_dir)
+            cycles = list(recording.cycles())
+            sites = {site.name: site for site in self.sites}
+            # replays start from an empty registry so detections do not depend on earlier runs
+            self.team_registry = TeamRegistry(None, self.team_registry_size, self.team_overrides_file)
+            self.page_recording = None
+            if self.odds_history_dir:
+                self.odds_history = OddsHistory(self.odds_history_dir, self.odds_history_segment_rows,
+                                                self.odds_history_compact_segments, self.logger)
+
+            first_time = cycles[0][0] if cycles else 0
+            # the next play starts one recorded cycle interval after the last cycle of the previous one
+            if len(cycles) > 1:
+                cycle_interval = (cycles[-1][0] - first_time) / (len(cycles) - 1)
+            else:
+                cycle_interval = self.interval_minutes * 60
+            play_length = cycles[-1][0] - first_time + cycle_interval if cycles else 0
+            replay_started = time.time()
+            page_count = 0
+            game_count = 0
+
+            def replay_pages(pages, offset):
+                for fetched_at, site_name, url, file_name in pages:
+                    if site_name not in sites:
+                        self.logger.debug("REPLAYER: Skipping {}, {} is not in the config".format(url, site_name))
+                        continue
+                    if speedup:
+                        wait = replay_started + (fetched_at + offset - first_time) / speedup - time.time()
+                        if wait > 0:
+                            sleep(wait)
+                    yield sites[site_name], url, recording.read(file_name)
+
+            self.logger.debug("REPLAYER: Replaying {} cycles from {}".format(len(cycles), recording_dir))
+            for play in range(repeat):
+                offset = play * play_length
+                for cycle_started, pages in cycles:
+                    if shutdown_event.is_set():
+                        break
+                    replay_cycle_started = time.time()
+                    cycle_update = self.process_cycle(replay_pages(pages, offset), cycle_started + offset)
+                    page_count += len(pages)
+                    game_count += len(cycle_update.games)
+                    self.send_cycle(game_queue, cycle_update, replay_cycle_started)
+
+            self.logger.debug("REPLAYER: Replayed {} pages and {} changed games in {:.2f} seconds".format(
+                page_count, game_count, time.time() - replay_started))
+            game_queue.close("replay finished")
+            self.close_parse_pool()
+
+        except Exception as e:
+            shutdown_event.set()
+            game_queue.close("replayer error")
+            self.close_parse_pool(wait=False)
+            traceback.print_exc()
+
+        self.close_odds_history()
+        self.logger.debug("REPLAYER: Replayer shutting down")
+
     def game_analyzer(self, game, arb_queue, shutdown_event):
         """
         Worker thread routine for game_watcher to for analysis
 
-        As written it will return true at first arbitrage opportunity found between a pair of SiteOdds with necessary information
-        populated in the Game object
+        Finds the best decimal odds offered for each outcome across all of the game's SiteOdds in one pass, and if the
+        best combination is an arbitrage opportunity, populates the Game object with it and places it in the arb queue.
+        Two outcome and three outcome (draw) markets are analyzed separately. With report_all_arbs every profitable
+        combination is also stored in game.arb_combinations, ranked by margin
 
         :param game: Game object, the game that is being analyzed
         :param arb_queue: Queue to place Game objects that have been deemed arbitrage opportunities
         :return: None
         """
 
-        # compare odds between all combinations of sites
-        for i in game.site_odds:
-            for j in game.site_odds:
-                # Current version only supports moneyline
-                if i is not j:
-                    # Determine if one site has best odds for one event and the other site
-                    # has best odds for the other event. this is necessary for arbitrage
-                    if i.odds1 > j.odds1 and j.odds2 > i.odds2:
-                        # Test i.odds1 and j.odds2 for arbitrage opportunity
-                        if self.determine_margin_decimal(i.odds1, j.odds2) < 0:
-                            # is an opportunity
-                            game.arbitrage_opportunity = True
-                            game.margin = self.determine_margin_decimal(i.odds1, j.odds2)
-                            game.wager_ratio_1, game.wager_ratio_2 = self.determine_wager_ratio(i.odds1, j.odds2)
-                            game.arb_site_odds_1 = i
-                            game.arb_site_odds_2 = j
-                            self.logger.debug("GAME_ANALYZER: Found arbitrage opportunity")
-                            arb_queue.put(game)
-                            return
-                        if self.determine_margin_decimal(i.odds2, j.odds1) < 0:
-                            # is an opportunity
-                            game.arbitrage_opportunity = True
-                            game.margin = self.determine_margin_decimal(i.odds2, j.odds1)
-                            game.wager_ratio_2, game.wager_ratio_1 = self.determine_wager_ratio(i.odds2, j.odds1)
-                            game.arb_site_odds_1 = j
-                            game.arb_site_odds_2 = i
-                            self.logger.debug("GAME_ANALYZER: Found arbitrage opportunity")
-                            arb_queue.put(game)
-                            return
+        # Current version only supports moneyline
+        started = time.time()
+        best = None
+        for market in self.markets(game):
+            margin, combination = self.best_combination(market)
+            if best is None or margin < best[0]:
+                best = (margin, combination)
+        analyzed_at = time.time()
+        self.metrics.observe('analysis_seconds', analyzed_at - started)
+        self.metrics.increment('games_analyzed')
+
+        if best is None or best[0] >= 0:
+            return
+
+        # is an opportunity
+        game.timestamps['analyzed'] = analyzed_at
+        self.metrics.increment('arbs_found')
+        self.set_arbitrage(game, best[0], best[1])
+        self.logger.debug("GAME_ANALYZER: Found arbitrage opportunity")
+        arb_queue.put(game)
+
+    def markets(self, game):
+        """
+        Group a game's SiteOdds by their number of outcomes, only groups priced by at least two sites can be arbitrage
+
+        :param game: Game object
+        :return: List of lists of SiteOdds
+        """
+        markets = OrderedDict()
+        for site_odds in game.site_odds:
+            markets.setdefault(len(site_odds.odds), []).append(site_odds)
+        return [market for market in markets.values() if len(market) >= 2]
+
+    def best_combination(self, market):
+        """
+        The SiteOdds with the best price for each outcome of a market. A single site can't be an arbitrage
+        opportunity with itself, so if one site has the best price for every outcome the best combination with one
+        runner up price is used instead
+
+        :param market: List of SiteOdds with the same number of outcomes
+        :return: (float margin, List of SiteOdds, one per outcome) tuple
+        """
+        outcome_count = len(market[0].odds)
+        top_odds = [heapq.nlargest(2, market, key=lambda site_odds: site_odds.odds[outcome])
+                    for outcome in range(outcome_count)]
+
+        combination = [top[0] for top in top_odds]
+        if all(site_odds is combination[0] for site_odds in combination):
+            candidates = []
+            for outcome in range(outcome_count):
+                candidate = list(combination)
+                candidate[outcome] = top_odds[outcome][1]
+                candidates.append(candidate)
+            combination = min(candidates, key=self.combination_margin)
+
+        return self.combination_margin(combination), combination
+
+    def combination_margin(self, combination):
+        return self.determine_margin_decimal(*[site_odds.odds[outcome] for outcome, site_odds in enumerate(combination)])
+
+    def set_arbitrage(self, game, margin, combination, wager_ratios=None):
+        """
+        Populate a game with its arbitrage opportunity
+
+        :param game: Game object
+        :param margin: float margin of the combination
+        :param combination: List of SiteOdds, one per outcome
+        :param wager_ratios: optional already computed wager ratios, one per outcome
+        :return: None
+        """
+        if wager_ratios is None:
+            wager_ratios = self.determine_wager_ratio(
+                *[site_odds.odds[outcome] for outcome, site_odds in enumerate(combination)])
+
+        game.arbitrage_opportunity = True
+        game.margin = margin
+        game.wager_ratios = list(wager_ratios)
+        game.arb_site_odds = list(combination)
+        if self.report_all_arbs:
+            game.arb_combinations = self.profitable_combinations(game)
+
+    def analyze_snapshot(self, games, arb_queue):
+        """
+        Batch version of game_analyzer for a whole crawl cycle. The decimal odds of every market with the same number
+        of outcomes are laid out as one markets x sites x outcomes array, so the best prices, margins and wager ratios
+        of every game are found with a handful of numpy operations. Games that are arbitrage opportunities are
+        populated the same way game_analyzer does and placed in the arb queue
+
+        :param games: List of Game objects from one crawl cycle
+        :param arb_queue: Queue to place Game objects that have been deemed arbitrage opportunities
+        :return: int number of arbitrage opportunities found
+        """
+        started = time.time()
+        markets_by_size = defaultdict(list)
+        for index, game in enumerate(games):
+            for market in self.markets(game):
+                markets_by_size[len(market[0].odds)].append((index, market))
+
+        best = {}
+        for outcome_count, markets in markets_by_size.items():
+            odds = self.snapshot_odds_array([market for index, market in markets], outcome_count)
+            sites, margins, wager_ratios = self.best_combinations(odds)
+            for row in np.flatnonzero(margins < 0):
+                index, market = markets[row]
+                margin = float(margins[row])
+                if index not in best or margin < best[index][0]:
+                    best[index] = (margin, [market[site] for site in sites[row]], wager_ratios[row].tolist())
+
+        analyzed_at = time.time()
+        self.metrics.observe('analysis_seconds', analyzed_at - started)
+        self.metrics.set('last_cycle_analysis_seconds', analyzed_at - started)
+        self.metrics.increment('games_analyzed', len(games))
+        self.metrics.increment('arbs_found', len(best))
+
+        for index in sorted(best):
+            margin, combination, wager_ratios = best[index]
+            games[index].timestamps['analyzed'] = analyzed_at
+            self.set_arbitrage(games[index], margin, combination, wager_ratios)
+            self.logger.debug("GAME_ANALYZER: Found arbitrage opportunity")
+            arb_queue.put(games[index])
+
+        return len(best)
+
+    def snapshot_odds_array(self, markets, outcome_count):
+        """
+        Dense markets x sites x outcomes array of decimal odds, [n, m] holds the prices of markets[n][m] and missing
+        prices are 0 so they are never the best price
+
+        :param markets: List of lists of SiteOdds
+        :param outcome_count: int number of outcomes in every market
+        :return: numpy array
+        """
+        width = max(len(market) for market in markets)
+        odds = np.zeros((len(markets), width, outcome_count))
+        for row, market in enumerate(markets):
+            for column, site_odds in enumerate(market):
+                odds[row, column] = site_odds.odds
+        return odds
+
+    def best_combinations(self, odds):
+        """
+        Vectorized best_combination over a snapshot odds array
+
+        :param odds: markets x sites x outcomes numpy array of decimal odds
+        :return: (markets x outcomes array of site columns, array of margins, markets x outcomes array of wager ratios)
+        """
+        market_count, site_count, outcome_count = odds.shape
+        rows = np.arange(market_count)[:, None]
+        outcomes = np.arange(outcome_count)[None, :]
+
+        # best and runner up site for each outcome
+        best = odds.argmax(axis=1)
+        without_best = odds.copy()
+        without_best[rows, best, outcomes] = 0
+        second = without_best.argmax(axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sites = best.copy()
+            same_site = (best == best[:, :1]).all(axis=1)
+            if same_site.any():
+                # swap in the runner up for whichever outcome gives the best margin
+                best_implied = 1 / odds[rows, best, outcomes]
+                second_implied = 1 / odds[rows, second, outcomes]
+                candidate_margins = np.empty((market_count, outcome_count))
+                for outcome in range(outcome_count):
+                    implied = best_implied.copy()
+                    implied[:, outcome] = second_implied[:, outcome]
+                    candidate_margins[:, outcome] = self.implied_total(implied) - 1
+                replaced = candidate_margins.argmin(axis=1)
+                same_rows = np.flatnonzero(same_site)
+                sites[same_rows, replaced[same_rows]] = second[same_rows, replaced[same_rows]]
+
+            chosen_implied = 1 / odds[rows, sites, outcomes]
+            implied_total = self.implied_total(chosen_implied)
+            margins = implied_total - 1
+            wager_ratios = chosen_implied / implied_total[:, None]
+
+        return sites, margins, wager_ratios
+
+    def implied_total(self, implied):
+        # summed outcome by outcome so the result matches determine_margin_decimal exactly
+        total = implied[:, 0].copy()
+        for outcome in range(1, implied.shape[1]):
+            total += implied[:, outcome]
+        return total
+
+    def profitable_combinations(self, game):
+        """
+        Every combination of SiteOdds, not all from the same site, that is an arbitrage opportunity, best margin first
+
+        :param game: Game object
+        :return: List of (float margin, List of SiteOdds, one per outcome) tuples
+        """
+        combinations = []
+        for market in self.markets(game):
+            outcome_count = len(market[0].odds)
+            by_outcome = [sorted(market, key=lambda site_odds: site_odds.odds[outcome], reverse=True)
+                          for outcome in range(outcome_count)]
+
+            # smallest implied probability the outcomes from n onwards can still add
+            remaining = [0] * (outcome_count + 1)
+            for outcome in reversed(range(outcome_count)):
+                remaining[outcome] = remaining[outcome + 1] + 1 / by_outcome[outcome][0].odds[outcome]
+
+            def extend(outcome, chosen, implied):
+                if outcome == outcome_count:
+                    if not all(site_odds is chosen[0] for site_odds in chosen):
+                        combinations.append((implied - 1, list(chosen)))
+                    return
+                for site_odds in by_outcome[outcome]:
+                    next_implied = implied + 1 / site_odds.odds[outcome]
+                    if next_implied + remaining[outcome + 1] >= 1:
+                        # prices only get worse from here on
+                        break
+                    chosen.append(site_odds)
+                    extend(outcome + 1, chosen, next_implied)
+                    chosen.pop()
+
+            extend(0, [], 0)
+
+        combinations.sort(key=lambda combination: combination[0])
+        return combinations
 
     def game_watcher(self, game_queue, arb_queue, shutdown_event):
         """
@@ -575,135 +4454,257 @@ class ArbCrawler:
             #create a pool of worker threads to help game analyzer
             pool = ThreadPool(processes=5)
 
+            profiler = self.start_profiler('watcher')
             self.logger.debug("GAME_WATCHER: Game watcher started.")
             while True:
-                found_game = game_queue.get()
-                self.logger.debug("GAME_WATCHER: recieved game in queue")
-                if found_game is None:  # Crawler initiated shutdown
-                    self.logger.debug("GAME_WATCHER: Recieved None type game")
+                cycle_update = game_queue.get()
+                profiler.checkpoint()
+                if isinstance(cycle_update, EndOfStream):  # Crawler initiated shutdown
+                    self.logger.debug("GAME_WATCHER: Recieved end of stream: {}".format(cycle_update.reason))
                     break
-                self.logger.debug("GAME_WATCHER: Adding game to game analyzer queue")
-                pool.apply_async(func=self.game_analyzer, args=(found_game, arb_queue,))
+                self.receive_cycle(cycle_update)
+                if self.analysis_mode == "batch":
+                    self.analyze_snapshot(cycle_update.games, arb_queue)
+                else:
+                    for found_game in cycle_update.games:
+                        pool.apply_async(func=self.game_analyzer, args=(found_game, arb_queue, shutdown_event,))
 
         except Exception as e:
             self.logger.debug("GAME_WATCHER: ERROR in applying game to analysis queue")
             traceback.print_exc()
             shutdown_event.set()  # Alert Crawler
-            arb_queue.put(None)  # Alert game analyzer
             self.send_error_notification()
 
         pool.close()
         pool.join()
+        arb_queue.close("game watcher stopped")  # Alert arbitrage actioner
 
-    def send_game_notification(self, game):
+    def game_notification_text(self, game):
         """
-        Send an email notification with information pertaining to the list of arb opportunity games
-        :param games: List of Game objects
-        :return: None
+        The part of a notification email describing one arbitrage opportunity
+
+        :param game: Game object that is an arbitrage opportunity
+        :return: String
         """
-        subject = 'Arbitrage Opportunity'
+        mail_body = "{}\n".format(str(game))
 
-        mail_body = "The bot has found the following arbitrage opportunity:\n"
+        mail_body += "\nUse this strategy:\n"
 
-        mail_body += "{}\n".format(str(game))
+        mail_body += "    {}\n".format(game.describe_arbitrage())
 
-        mail_body += "\nUse this strategy:\n"
+        if len(game.arb_combinations) > 1:
+            mail_body += "\nAll profitable combinations:\n"
+            for margin, combination in game.arb_combinations:
+                mail_body += "    {} for margin {}\n".format(" and ".join(
+                    "{} at odds {} on {}".format(outcome_name, site_odds.odds[outcome], site_odds.site.name)
+                    for outcome, (outcome_name, site_odds) in enumerate(zip(game.outcome_names(len(combination)),
+                                                                            combination))), margin)
 
-        mail_body += "    Wager {} {} at odds {} on {} and {} {} at odds {} on {} for margin {}\n".format(
-            game.team_1_name,
-            game.wager_ratio_1,
-            game.arb_site_odds_1.odds1,
-            game.arb_site_odds_1.site.name,
-            game.team_2_name,
-            game.wager_ratio_2,
-            game.arb_site_odds_2.odds2,
-            game.arb_site_odds_2.site.name,
-            game.margin)
+        return mail_body
 
-        mail_body += "\nSent from ArbCrawler"
+    def smtp_connection(self):
+        return SmtpConnection(self.mail_server, self.mail_server_port, self.gmail_user, self.gmail_pass,
+                              self.email_config.get('email_ssl', True), logger=self.logger)
 
-        message = "From: {}\nTo: {}\nSubject: {} {}".format(self.gmail_user, ", ".join(self.email_recipients),
-                                                            subject, mail_body)
+    def record_detection(self, game):
+        """
+        Append an arbitrage opportunity found during a replay to the detections file as a JSON line
 
-        try:
-            self.logger.debug("SEND_GAME_NOTIFICATION: Attemting to send an email to {} for arbitrage notification".format(self.email_recipeints))
-            server = smtplib.SMTP_SSL(self.mail_server, self.mail_server_port)
-            server.ehlo()
-            server.login(self.gmail_user, self.gmail_pass)
-            server.sendmail(self.gmail_user, self.email_recipients, message)
-            server.close()
-        except :
-            self.logger.debug("SEND_GAME_NOTIFICATION: ERROR There was an error sending an email {}". format(sys.exc_info()[0]))
+        :param game: Game object that is an arbitrage opportunity
+        :return: None
+        """
+        if self.detections_file is None:
+            return
+
+        detection = {
+            'game_id': list(game.game_id) if game.game_id is not None else None,
+            'team_1_name': game.team_1_name,
+            'team_2_name': game.team_2_name,
+            'margin': game.margin,
+            'sites': [site_odds.site.name for site_odds in game.arb_site_odds],
+            'odds': [site_odds.odds[outcome] for outcome, site_odds in enumerate(game.arb_site_odds)],
+            'latency_seconds': game.timestamps['actioned'] - game.timestamps['seen'] if 'seen' in game.timestamps else None,
+        }
+        with open(self.detections_file, 'a') as f:
+            f.write(json.dumps(detection) + '\n')
 
     def send_error_notification(self):
         """
         Upon unexpected shutdown of ArbCrawler, send notification to email list
         :return: None
         """
+        if self.replaying:
+            return
+
         subject = 'ArbCrawler Error: UNEXPECTED SHUTDOWN'
 
         mail_body = "ArbCrawler bot has unexpectedly shutdown.\n"
 
-        message = "From: {}\nTo: {}\nSubject: {} {}".format(self.gmail_user, ", ".join(self.email_recipients),
-                                                            subject, mail_body)
+        message = "From: {}\nTo: {}\nSubject: {}\n\n{}".format(self.gmail_user, ", ".join(self.email_recipients),
+                                                               subject, mail_body)
 
+        connection = self.smtp_connection()
         try:
             self.logger.debug("SEND_GAME_NOTIFICATION: Sending an email to {} for unexpected shutdown event".format(self.email_recipients))
-            server = smtplib.SMTP_SSL(self.mail_server, self.mail_server_port)
-            server.ehlo()
-            server.login(self.gmail_user, self.gmail_pass)
-            server.sendmail(self.gmail_user, self.email_recipients, message)
-            server.close()
+            connection.send(self.email_recipients, message)
         except:
             self.logger.debug("SEND_ERROR_NOTIFICATION: ERROR There was an error sending an email.")
+        connection.close()
 
     def arbitrage_actioner(self, arb_queue, shutdown_event):
 
         self.logger.debug("ARBITRAGE_ACTIONER: Arbitrage actioner starting up...")
+        notifier = None
         try:
+            profiler = self.start_profiler('actioner')
+            # urls still queued for a crawler that has stopped are not worth waiting for at exit
+            self.arb_urls.cancel_join_thread()
+            if not self.replaying:
+                notifier = Notifier(self.smtp_connection(), self.email_recipients, self.game_notification_text,
+                                    self.notification_window_seconds, self.notification_repeat_minutes * 60,
+                                    metrics=self.metrics, logger=self.logger)
             while True:
                 found_arbitrage_opportunity = arb_queue.get()
-                self.logger.debug("ARBITRAGE_ACTIONER: Actioning on found arbitrage opportunity for game {} vs. {}".format(found_arbitrage_opportunity.team_1_name, found_arbitrage_opportunity.team_2_name))
-                if found_arbitrage_opportunity is None:
-                    sys.exit()
-
-                self.logger.debug("ARBITRAGE_ACTIONER: ARBITRAGE OPPORTUNITY")
-                self.logger.debug(found_arbitrage_opportunity)
-                self.logger.debug("    Wager {} {} at odds {} on {} and {} {} at odds {} on {} for margin {}".format(found_arbitrage_opportunity.team_1_name,
-                                                                                   found_arbitrage_opportunity.wager_ratio_1,
-                                                                                   found_arbitrage_opportunity.arb_site_odds_1.odds1,
-                                                                                   found_arbitrage_opportunity.arb_site_odds_1.site.name,
-                                                                                   found_arbitrage_opportunity.team_2_name,
-                                                                                   found_arbitrage_opportunity.wager_ratio_2,
-                                                                                   found_arbitrage_opportunity.arb_site_odds_2.odds2,
-                                                                                   found_arbitrage_opportunity.arb_site_odds_2.site.name,
-                                                                                   found_arbitrage_opportunity.margin))
-
-                # Notify by email
-                self.send_game_notification(found_arbitrage_opportunity)
+                profiler.checkpoint()
+                if isinstance(found_arbitrage_opportunity, EndOfStream):
+                    self.logger.debug("ARBITRAGE_ACTIONER: Recieved end of stream: {}".format(found_arbitrage_opportunity.reason))
+                    break
+                self.log_arbitrage(found_arbitrage_opportunity)
+
+                # Notify by email from the notifier's thread, or note it down when replaying
+                if notifier is not None:
+                    notifier.submit(found_arbitrage_opportunity)
+                    self.arb_urls.put(([site_odds.url for site_odds in found_arbitrage_opportunity.site_odds],
+                                       found_arbitrage_opportunity.timestamps['actioned']))
+                else:
+                    self.record_detection(found_arbitrage_opportunity)
+                    if 'seen' in found_arbitrage_opportunity.timestamps:
+                        self.metrics.observe('detection_latency_seconds', found_arbitrage_opportunity.timestamps['actioned'] -
+                                             found_arbitrage_opportunity.timestamps['seen'])
         except Exception as e:
             self.logger.debug("ARBITRAGE_ACTIONER: ERROR Error while actioning arbitrage opportunity")
             traceback.print_exc()
-            shutdown_event.set()  # Alert Crawler
-            self.game_queue.put(None)  # Alert game watcher
+            shutdown_event.set()  # Alert Crawler, which ends the stream to the game watcher
             self.send_error_notification()
 
-            self.logger.debug("ARBITRAGE_ACTIONER: Actioner shutting down.")
+        if notifier is not None:
+            notifier.close()
+        self.logger.debug("ARBITRAGE_ACTIONER: Actioner shutting down.")
+
+    def log_arbitrage(self, game):
+        """
+        Stamp an arbitrage opportunity the actioner has taken off the arb queue as actioned and log it
+
+        :param game: Game object that is an arbitrage opportunity
+        :return: None
+        """
+        self.logger.debug("ARBITRAGE_ACTIONER: Actioning on found arbitrage opportunity for game %s vs. %s",
+                          game.team_1_name, game.team_2_name)
+        game.timestamps['actioned'] = time.time()
+
+        self.logger.debug("ARBITRAGE_ACTIONER: ARBITRAGE OPPORTUNITY")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(repr(game))
+            self.logger.debug("    %s", game.describe_arbitrage())
+
+    def run_command(self, command):
+        """
+        Handle a command line command other than exit
+
+        profile start [sample|cprofile] [crawler|watcher|actioner ...]  start profiling, sample and all processes by default
+        profile stop [crawler|watcher|actioner ...]                     stop profiling and write the profiles to profile_dir
+        status                                                          queue depths and the last cycle's stage timings
 
-    def sigterm_handler(self, signal, frame):
-        # NEEDS FIXING
+        With the asyncio runtime the one process to profile is runtime
+
+        :param command: String typed at the prompt
+        :return: String to print
+        """
+        words = command.split()
+        if len(words) >= 2 and words[0] == 'profile' and words[1] in ('start', 'stop'):
+            mode = None
+            targets = words[2:]
+            if words[1] == 'start':
+                mode = 'sample'
+                if targets and targets[0] in ('sample', 'cprofile'):
+                    mode = targets.pop(0)
+            targets = targets or list(self.control_queues)
+            unknown = [target for target in targets if target not in self.control_queues]
+            if unknown:
+                return "Unknown process {}, choose from {}".format(", ".join(unknown), ", ".join(self.control_queues))
+            for target in targets:
+                self.control_queues[target].put((words[1], mode))
+            self.logger.debug("MAIN: profile {} {} sent to {}".format(words[1], mode or "", ", ".join(targets)))
+            return "profile {} sent to {}".format(words[1], ", ".join(targets))
+
+        if words == ['status']:
+            counters, gauges, histograms = self.metrics.snapshot()
+            lines = ["game queue: {} cycles waiting, arb queue: {} games waiting".format(
+                self.game_queue.qsize(), self.arb_queue.qsize())]
+            lines.append("last cycle: {:.0f} pages, {:.0f} games".format(gauges['last_cycle_pages'],
+                                                                        gauges['last_cycle_games']))
+            for stage in ('seconds', 'fetch_wait_seconds', 'parse_seconds', 'match_seconds', 'analysis_seconds'):
+                lines.append("    {:<22} {:.3f}".format(stage, gauges['last_cycle_' + stage]))
+            return "\n".join(lines)
+
+        if command.strip():
+            return "Commands: exit, status, profile start [sample|cprofile] [{0} ...], profile stop [{0} ...]".format(
+                "|".join(self.control_queues))
+        return ""
+
+    def metrics_reporter(self, shutdown_event):
+        """
+        Thread in the main process that writes a summary of the metrics to the log every metrics_summary_seconds
+        """
+        while not shutdown_event.wait(self.metrics_summary_seconds):
+            self.logger.debug("METRICS: {}".format(self.metrics.summary()))
+
+    def serve_metrics(self):
+        if self.metrics_port:
+            self.metrics_server = start_metrics_server(self.metrics, self.metrics_port)
+            self.logger.debug("MAIN: Serving metrics at http://127.0.0.1:{}/metrics".format(self.metrics_port))
+
+    def sigterm_handler(self, signum, frame):
+        """
+        Shut down on SIGTERM the same way as the exit command. The worker processes are forked with this handler and
+        leave the signal to the main process, which ends their streams once it is out of input()
+        """
+        if os.getpid() != self.main_pid:
+            return
         self.logger.debug('SIGTERM_HANDLER: Shutting down')
-        self.game_queue.put(None)
-        self.arb_queue.put(None)
-        sys.exit(0)
+        raise ShutdownRequested("sigterm")
 
     def main(self):
         self.logger.debug("MAIN: Starting ArbCrawler...")
+
+        if self.shard_role and self.shard_authkey is None:
+            raise ValueError("shard_authkey has to be set to run a sharded crawl")
+        if self.shard_role == 'node':
+            self.run_node()
+        elif self.runtime == 'asyncio':
+            AsyncRuntime(self).run()
+        else:
+            self.run_processes()
+
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+        self.logger.debug("METRICS: {}".format(self.metrics.summary()))
+        self.logger.debug("MAIN: Exiting ArbCrawler")
+
+    def run_processes(self):
+        """
+        Run the crawler, game watcher and arbitrage actioner in processes of their own, with the command line in this
+        one, until exit or SIGTERM
+
+        :return: None
+        """
+        self.main_pid = os.getpid()
         signal.signal(signal.SIGTERM, self.sigterm_handler)
 
         # Create and start the web crawler process
         self.logger.debug("MAIN: Creating crawler process...")
-        self.crawler_process = Process(target=self.crawler, args=(self.game_queue, self.shutdown_event,))
+        crawler = self.aggregator if self.shard_role == 'aggregator' else self.crawler
+        self.crawler_process = Process(target=crawler, args=(self.game_queue, self.shutdown_event,))
         self.crawler_process.start()
         self.logger.debug("MAIN: Done.")
 
@@ -721,31 +4722,85 @@ class ArbCrawler:
 
         self.logger.debug("MAIN: ArbCrawler started, workers running...")
 
+        self.serve_metrics()
+        threading.Thread(target=self.metrics_reporter, args=(self.shutdown_event,), daemon=True).start()
+
         # Very basic command line interface
-        while True:
-            command = input("$ ")
-            if command == 'exit':
-                self.logger.debug("MAIN: ArbCrawler shutting down worker processes...")
-                self.shutdown_event.set()
-                self.game_queue.put(None)
-                self.arb_queue.put(None)
-                break
+        reason = "exit"
+        try:
+            while True:
+                command = input("$ ")
+                if command == 'exit':
+                    break
+                output = self.run_command(command)
+                if output:
+                    print(output)
+        except ShutdownRequested as e:
+            reason = str(e)
+        # the queues are closed once, a second SIGTERM while the workers wind down is ignored
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+        self.logger.debug("MAIN: ArbCrawler shutting down worker processes...")
+        self.shutdown_event.set()
+        self.game_queue.close(reason)
+        self.arb_queue.close(reason)
 
         self.crawler_process.join()
         self.game_watcher_process.join()
         self.arbitrage_actioner_process.join()
 
-        self.logger.debug("MAIN: Exiting ArbCrawler")
+    def replay(self, recording_dir, speedup=None, repeat=1, detections_file=None):
+        """
+        Run the pipeline on recorded pages instead of the live sites. No browser, network or email server is used,
+        arbitrage opportunities are written to detections_file. Returns once every page has been actioned
+
+        :param recording_dir: String directory of a PageRecording
+        :param speedup: optional float, how many times faster than recorded to replay, as fast as possible if None
+        :param repeat: int number of times to play the recording
+        :param detections_file: optional String path of a JSON lines file for the arbitrage opportunities found
+        :return: None
+        """
+        self.logger.debug("MAIN: Replaying {}...".format(recording_dir))
+        self.replaying = True
+        self.detections_file = detections_file
+
+        self.crawler_process = Process(target=self.replayer, args=(self.game_queue, self.shutdown_event, recording_dir,
+                                                                   speedup, repeat,))
+        self.game_watcher_process = Process(target=self.game_watcher, args=(self.game_queue, self.arb_queue, self.shutdown_event,))
+        self.arbitrage_actioner_process = Process(target=self.arbitrage_actioner, args=(self.arb_queue, self.shutdown_event, ))
+        self.crawler_process.start()
+        self.game_watcher_process.start()
+        self.arbitrage_actioner_process.start()
+
+        self.crawler_process.join()
+        self.game_watcher_process.join()
+        self.arbitrage_actioner_process.join()
+
+        self.logger.debug("METRICS: {}".format(self.metrics.summary()))
+        self.logger.debug("MAIN: Replay finished")
 
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Please supply a config file and email config file")
+        print("Please supply a config file and email config file, then optionally --replay <recording dir> "
+              "[--speedup <times>] [--repeat <plays>] [--detections <file>], or --shard aggregator|node "
+              "[--node <name>]")
         sys.exit()
 
     arb_crawler = ArbCrawler(sys.argv[1], sys.argv[2])
-
-    arb_crawler.main()
+    options = dict(zip(sys.argv[3::2], sys.argv[4::2]))
+    if "--shard" in options:
+        arb_crawler.shard_role = options["--shard"]
+    if "--node" in options:
+        arb_crawler.shard_node_name = options["--node"]
+
+    if "--replay" in options:
+        arb_crawler.replay(options["--replay"],
+                           speedup=float(options["--speedup"]) if "--speedup" in options else None,
+                           repeat=int(options.get("--repeat", 1)),
+                           detections_file=options.get("--detections"))
+    else:
+        arb_crawler.main()
 
 
 
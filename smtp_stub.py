@@ -0,0 +1,99 @@
+from socketserver import ThreadingTCPServer, StreamRequestHandler
+from threading import Thread, Lock
+import sys
+import time
+
+
+class SmtpStubHandler(StreamRequestHandler):
+    """
+    Speaks just enough SMTP for smtplib to log in and send mail. Every login is accepted and every message is kept
+    in the server's messages list as a (sender, recipients, data) tuple instead of being delivered
+    """
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("utf-8"))
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply("220 localhost ArbCrawler SMTP stub")
+
+        sender = None
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8").rstrip("\r\n")
+            verb = command.split(" ", 1)[0].upper()
+
+            if verb == "EHLO":
+                self.reply("250-localhost")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif verb == "HELO":
+                self.reply("250 localhost")
+            elif verb == "AUTH":
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL":
+                sender = command.split(":", 1)[1].strip().strip("<>")
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip().strip("<>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                for data_line in self.rfile:
+                    if data_line in (b".\r\n", b".\n"):
+                        break
+                    data.append(data_line.decode("utf-8"))
+                if self.server.delay_seconds:
+                    time.sleep(self.server.delay_seconds)
+                with self.server.lock:
+                    self.server.messages.append((sender, recipients, "".join(data)))
+                self.reply("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SmtpStubServer(ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def start_smtp_stub(port=0, delay_seconds=0):
+    """
+    Start an SMTP stub on localhost in a background thread
+
+    :param port: int port to listen on, 0 picks a free port
+    :param delay_seconds: float time each message takes to be accepted, to stand in for a slow mail server
+    :return: SmtpStubServer with messages and connections attributes, call shutdown() on it to stop it
+    """
+    server = SmtpStubServer(("127.0.0.1", port), SmtpStubHandler)
+    server.messages = []
+    server.connections = 0
+    server.delay_seconds = delay_seconds
+    server.lock = Lock()
+    server.thread = Thread(target=server.serve_forever, daemon=True)
+    server.thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    server = start_smtp_stub(int(sys.argv[1]) if len(sys.argv) > 1 else 2525)
+    print("SMTP stub listening on 127.0.0.1:{}, set email_ssl = false in the email config".format(
+        server.server_address[1]))
+    try:
+        while True:
+            count = len(server.messages)
+            server.thread.join(5)
+            for sender, recipients, data in server.messages[count:]:
+                print("From {} to {}:\n{}".format(sender, ", ".join(recipients), data))
+    except KeyboardInterrupt:
+        server.shutdown()